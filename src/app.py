@@ -1,17 +1,41 @@
+# gevent has to patch socket/ssl/threading before anything else imports them -- flask,
+# requests and grequests keep references to the unpatched ones otherwise
+from gevent import monkey
+monkey.patch_all()
+
 import sys
-import json
 from node import Node
 from os import environ
-from flask_restful import Api, Resource, reqparse
-from flask import Flask, request
-from gevent import monkey
-from vector_clock import VectorClockDecoder
-from history import HistoryDecoder
-monkey.patch_all()
+from flask_restful import Api, Resource, reqparse, inputs
+from flask import Flask, make_response, request
+from server import Server
+import wire
+import stream
+
+# every response carries the node's view epoch (current_view), so a client routing keys
+# itself can tell its topology is out of date
+VIEW_HEADER = "X-Kvs-View"
 
 app = Flask(__name__)
+# Histories/VectorClocks in responses go out as the same JSON strings as always
+app.config["RESTFUL_JSON"] = {"cls": wire.WireJSONEncoder}
 api = Api(app)
 
+
+@api.representation(wire.BINARY_MIMETYPE)
+def output_binary(data, code, headers=None):
+    # used whenever the caller sends "Accept: application/x-kvs-binary" (see wire.py)
+    resp = make_response(wire.dumps(data), code)
+    resp.headers.extend(headers or {})
+    resp.headers["Content-Type"] = wire.BINARY_MIMETYPE
+    return resp
+
+
+@app.after_request
+def add_view_header(response):
+    response.headers[VIEW_HEADER] = str(instance.current_view)
+    return response
+
 """
     Changes required: _____________________________________________________
 
@@ -34,14 +58,28 @@ class KVS(Resource):
     """
 
 
+class Batch(Resource):
+    def put(self):
+        return instance.batch("put")
+
+    def get(self):
+        return instance.batch("get")
+
+
 class ViewChange(Resource):
     def put(self):
         # get the view from the request to pass as argument
         parser = reqparse.RequestParser()
         parser.add_argument("view")
         parser.add_argument("repl-factor")
+        # keep serving both views while keys move, or stop the store (false) -- default:
+        # VIEW_CHANGE_MODE
+        parser.add_argument("online", type=inputs.boolean)
+        # only plan it: what would move between which nodes (see planner.py)
+        parser.add_argument("dry-run", type=inputs.boolean, default=False)
         args = parser.parse_args()
-        return instance.try_reshard(args["view"], int(args["repl-factor"]))
+        return instance.try_reshard(args["view"], int(args["repl-factor"]), args["online"],
+                                    args["dry-run"])
 
 
 class KeyCount(Resource):
@@ -63,9 +101,10 @@ class Reshard(Resource):
 
         # Handle incoming dictionaries here (if shard leader)
         elif command == "put_payload":
-            json_data = request.json
-            payload = json_data["payload"]
-            return instance.put_payload(payload)
+            # a stream of chunks (see stream.py), or the whole payload in one body
+            if request.mimetype == stream.STREAM_MIMETYPE:
+                return instance.put_payload(stream.read_frames(request.stream))
+            return instance.put_payload([wire.request_body()])
 
         # # handle incoming dictionaries here (if shard follower)
         # elif command == "put_shard_keys":
@@ -79,9 +118,25 @@ class Reshard(Resource):
             parser.add_argument("view")
             parser.add_argument("repl_factor")
             parser.add_argument("current_view")
+            parser.add_argument("routing", type=dict)
             args = parser.parse_args()
             return instance.set_shards_and_view(args["view"], int(args["repl_factor"]),
-                            args["current_view"])
+                            args["current_view"], args["routing"])
+
+        # online view change (see Node.online_reshard): switch to the new view, keeping the old kvs
+        elif command == "begin_migration":
+            args = wire.request_body()
+            return instance.begin_migration(args["view"], int(args["repl_factor"]),
+                                            args["current_view"], args["routing"],
+                                            args["old_shards"])
+
+        # an old shard's replica moves the shard's keys to the new shards
+        elif command == "migrate":
+            return instance.migrate(wire.request_body()["shard"])
+
+        # an old shard's keys are all at their new replicas
+        elif command == "migrated":
+            return instance.confirm_migrated(wire.request_body()["shard"])
 
     def get(self, command):
         # Handle Reshard here
@@ -96,19 +151,58 @@ class Reshard(Resource):
         elif command == "send_keys_to_replicas":
             return instance.distribute_keys()
 
+        # (online view change) keys of the old view, for the shard's migration or a GET
+        elif command == "retired":
+            return instance.get_retired(wire.request_body().get("keys"))
+
+        # (dry run) what my shard would send where in a view change
+        elif command == "plan":
+            args = wire.request_body()
+            return instance.plan_moves(args["view"], int(args["repl_factor"]))
+
+        # how long my reshard streams waited on the throttle so far
+        elif command == "throttle":
+            return instance.throttle.stats(), 200
+
 
 class Gossip(Resource):
     def get(self):
         # get the view from the request to pass as argument
-        json_data = request.json
+        json_data = wire.request_body()
         hist = json_data["item-history"]
         for key, val in hist.items():
-            hist[key] = json.loads(hist[key], cls=HistoryDecoder)
-        
+            hist[key] = wire.to_history(hist[key])
+
         return instance.gossip_ack(json_data["items"], hist,
-                    json.loads(json_data["updated-key-times"], cls=HistoryDecoder),
-                    json.loads(json_data["vector-clock"], cls=VectorClockDecoder),
-                    json_data["address"])
+                    wire.to_history(json_data["updated-key-times"]),
+                    wire.to_clock(json_data["vector-clock"]),
+                    json_data["address"],
+                    json_data.get("seq", 0), json_data.get("ack", 0),
+                    json_data.get("request-ids"), json_data.get("applied"),
+                    json_data.get("log"), json_data.get("ack-log"))
+
+
+class Session(Resource):
+    def get(self, session_id):
+        return instance.session_ack("GET", session_id, {})
+
+    def put(self, session_id):
+        return instance.session_ack("PUT", session_id, wire.request_body())
+
+
+class Topology(Resource):
+    def get(self):
+        return instance.topology()
+
+
+class Connections(Resource):
+    def get(self):
+        return instance.connection_stats()
+
+
+class Merkle(Resource):
+    def get(self, command):
+        return instance.merkle_ack(command, wire.request_body())
 
 
 class Liveness(Resource):
@@ -128,6 +222,8 @@ class SingleShardInfo(Resource):
 
 # /kvs/keys/<key>	GET, PUT, DELETE
 api.add_resource(KVS, "/kvs/keys/<string:key>")
+# /kvs/batch	GET, PUT --> many keys, one causal context
+api.add_resource(Batch, "/kvs/batch")
 # /kvs/key-count	GET
 api.add_resource(KeyCount, "/kvs/key-count")
 # /kvs/view-change	PUT
@@ -138,12 +234,21 @@ api.add_resource(Reshard, "/kvs/reshard/<string:command>")
 api.add_resource(ShardsInfo, "/kvs/shards")
 # /kvs/shards/<shard_id> ==> get info for a specific shard
 api.add_resource(SingleShardInfo, "/kvs/shards/<int:shard_id>")
+# /kvs/topology --> view, shards and routing settings, for clients that route keys themselves
+api.add_resource(Topology, "/kvs/topology")
 
 
 api.add_resource(Gossip, "/kvs/gossip")
 api.add_resource(Liveness, "/kvs/liveness")
+# /kvs/connections --> per-peer connection reuse stats
+api.add_resource(Connections, "/kvs/connections")
+# /kvs/session/<id> --> causal contexts of session clients, kept by the session's owner
+api.add_resource(Session, "/kvs/session/<string:session_id>")
+# /kvs/merkle/<level|repair> --> anti-entropy between replicas
+api.add_resource(Merkle, "/kvs/merkle/<string:command>")
 
 if __name__ == "__main__":
     if "VIEW" in environ and "REPL_FACTOR" in environ:
         instance = Node(environ["VIEW"], environ["REPL_FACTOR"])
-    app.run(debug=True, host="0.0.0.0", port="13800", threaded=True)
+    # gevent WSGI server, see server.py for its settings (SERVER=dev for Flask's own)
+    Server.from_environ(app, environ).serve(instance)
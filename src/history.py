@@ -1,13 +1,16 @@
 """
 History Class will be used to store causal histories
 """
-import copy
 import json
+from collections.abc import MutableMapping
 from vector_clock import VectorClock, VectorClockDecoder, VectorClockEncoder
 
 
 class HistoryEncoder(json.JSONEncoder):
     def default(self, hist):
+        if isinstance(hist, LazyHistory):
+            # clocks nobody looked at go back out as the exact strings that came in
+            return {key: hist.hist.encoded(key) for key in hist.hist}
         if isinstance(hist, History):
             dct = {}
             for key, clock in hist.items():
@@ -51,6 +54,8 @@ class History:
                 merge(foreign_hist):	merge foreign history into local history
                                                                 return list of updated keys
 
+                copy():			a new History with the same events
+
         Access individual clocks with "hist[key]"
 
         Iterate through clocks with "for key,clock in hist.items()"
@@ -93,12 +98,20 @@ class History:
         false if it was rejected
         """
         if key not in self.hist or VectorClock.compare(clock, self.hist[key]) == VectorClock.GREATER_THAN:
-            # not sure if deepcopy is actually necessary here - I've just been worried
-            # about accidently deleting referenced objects in other parts of the program
-            self.hist.update({key: copy.deepcopy(clock)})
+            # copy so that later changes to the caller's clock (e.g. cur_time) don't leak in
+            self.hist[key] = clock.copy() if clock is not None else None
             return True
         return False
 
+    def copy(self):
+        """
+        purpose:	a History that can change without affecting this one
+                        (clocks are never changed in place once inserted, so they're shared)
+        """
+        hist = History()
+        hist.hist = dict(self.hist)
+        return hist
+
     def merge(self, foreign_hist):
         """
         Purpose:	merges foreign hist with self.hist
@@ -118,7 +131,72 @@ class History:
                 continue
             l_clock = self.hist[f_key]
             if l_clock is None or VectorClock.compare(f_clock, l_clock) == VectorClock.GREATER_THAN:
-                self.hist[f_key] = copy.deepcopy(f_clock)
+                self.hist[f_key] = f_clock.copy()
                 updated_keys.append(f_key)
 
         return updated_keys
+
+
+class LazyClocks(MutableMapping):
+    """
+        {key : VectorClock} over {key : clock JSON string} -- a clock is only decoded the first
+        time it's looked at
+    """
+
+    def __init__(self, encoded):
+        self.raw = encoded          # {key : clock JSON string} as the client sent it
+        self.decoded = {}           # {key : VectorClock} for the keys looked at / set
+        self.changed = False
+
+    def __getitem__(self, key):
+        clock = self.decoded.get(key)
+        if clock is None:
+            if key not in self.raw:
+                raise KeyError(key)
+            clock = self.decoded[key] = json.loads(self.raw[key], cls=VectorClockDecoder)
+        return clock
+
+    def __setitem__(self, key, clock):
+        # no string for it anymore, it gets encoded from the clock
+        self.raw[key] = None
+        self.decoded[key] = clock
+        self.changed = True
+
+    def __delitem__(self, key):
+        del self.raw[key]
+        self.decoded.pop(key, None)
+        self.changed = True
+
+    def __contains__(self, key):
+        return key in self.raw
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def encoded(self, key):
+        if self.raw[key] is not None:
+            return self.raw[key]
+        return VectorClockEncoder().encode(self.decoded[key])
+
+
+class LazyHistory(History):
+    """
+        a History straight from a client's JSON causal context -- only the outer object is
+        parsed, each clock is decoded when something asks for it (see LazyClocks), and if the
+        History doesn't change it's sent back as the very same string
+
+        copy() gives a regular History
+    """
+
+    def __init__(self, raw):
+        History.__init__(self)
+        self.raw = raw
+        self.hist = LazyClocks(json.loads(raw))
+
+    @property
+    def changed(self):
+        return self.hist.changed
+
@@ -0,0 +1,84 @@
+"""
+    Per-peer latency tracking, used to pick which replica a proxied request goes to first and
+    when to hedge it with a second one
+"""
+import threading
+from collections import deque
+
+ALPHA = 0.2                 # weight of the newest sample in the moving average
+WINDOW = 200                # samples kept per peer for percentiles
+MIN_SAMPLES = 10            # below this, a peer's percentile isn't trusted yet
+DEFAULT_HEDGE_DELAY = 0.05  # seconds to wait before hedging when we know nothing yet
+
+
+class LatencyTracker:
+    """
+    API:
+        record(addr, seconds):      a request to addr took this long
+
+        failed(addr, penalty):      a request to addr failed / timed out -- counts as penalty seconds
+
+        order(addrs):               addrs sorted fastest first (peers we've never heard from
+                                    go first, so they get measured)
+
+        hedge_delay(addr):          how long to wait on addr before hedging -- the percentile of
+                                    its recent latencies
+
+        stats():                    {addr : {"ewma-ms", "p<percentile>-ms", "samples"}}
+    """
+
+    def __init__(self, percentile=95, alpha=ALPHA, window=WINDOW):
+        self.percentile = percentile
+        self.alpha = alpha
+        self.window = window
+        self.ewma = {}              # {addr : seconds}
+        self.samples = {}           # {addr : deque of recent seconds}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        HEDGE_PERCENTILE    - latency percentile a replica gets before a hedged request goes out
+                              (default 95)
+        """
+        return cls(float(environ.get("HEDGE_PERCENTILE", 95)))
+
+    def record(self, addr, seconds):
+        with self.lock:
+            if addr in self.ewma:
+                self.ewma[addr] += self.alpha * (seconds - self.ewma[addr])
+            else:
+                self.ewma[addr] = seconds
+            if addr not in self.samples:
+                self.samples[addr] = deque(maxlen=self.window)
+            self.samples[addr].append(seconds)
+
+    def failed(self, addr, penalty):
+        self.record(addr, penalty)
+
+    def order(self, addrs):
+        ewma = self.ewma
+        # stable sort, so equally fast replicas keep the shard's order
+        return sorted(addrs, key=lambda addr: ewma.get(addr, 0.0))
+
+    def percentile_of(self, addr):
+        samples = self.samples.get(addr)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def hedge_delay(self, addr):
+        delay = self.percentile_of(addr)
+        return DEFAULT_HEDGE_DELAY if delay is None else delay
+
+    def stats(self):
+        stats = {}
+        for addr in list(self.ewma):
+            pct = self.percentile_of(addr)
+            stats[addr] = {"ewma-ms": round(self.ewma[addr] * 1000, 2),
+                           "p{:g}-ms".format(self.percentile):
+                               round(pct * 1000, 2) if pct is not None else None,
+                           "samples": len(self.samples[addr])}
+        return stats
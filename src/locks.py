@@ -0,0 +1,100 @@
+"""
+    Locks for a node's shared state (see the concurrency notes in Node.__init__)
+
+    API:
+        StripedLock(stripes):
+            lock(key):      the lock of key's stripe, a context manager -- requests for keys
+                            on different stripes go at once, without a lock per key
+            hold(keys):     context manager holding the stripes of all the keys, taken in
+                            stripe order so two callers can't deadlock
+
+        RWLock():
+            read():         shared -- any number of readers at once
+            write():        exclusive -- waits for the readers in flight, and new readers wait
+                            for a waiting writer (so a stream of requests can't starve it)
+
+    Both are reentrant for the thread (greenlet, under gevent) holding them, and a writer may
+    read. A reader can't upgrade to a writer, that raises RuntimeError.
+"""
+import threading
+from contextlib import contextmanager, ExitStack
+
+DEFAULT_STRIPES = 256
+
+
+class StripedLock:
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self.locks = [threading.RLock() for _ in range(stripes)]
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        LOCK_STRIPES    - number of key locks (default 256)
+        """
+        return cls(int(environ.get("LOCK_STRIPES", DEFAULT_STRIPES)))
+
+    def stripe(self, key):
+        return hash(key) % len(self.locks)
+
+    def lock(self, key):
+        return self.locks[self.stripe(key)]
+
+    @contextmanager
+    def hold(self, keys):
+        with ExitStack() as stack:
+            for stripe in sorted({self.stripe(key) for key in keys}):
+                stack.enter_context(self.locks[stripe])
+            yield
+
+
+class RWLock:
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = {}           # {thread ident : nested reads}
+        self.writer = None          # thread ident of the writer
+        self.writer_depth = 0       # nested writes of the writer
+        self.writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self.cond:
+            # already inside read()/write() -- waiting for a writer now would deadlock
+            if self.writer != me and me not in self.readers:
+                while self.writer is not None or self.writers_waiting:
+                    self.cond.wait()
+            self.readers[me] = self.readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers[me] -= 1
+                if not self.readers[me]:
+                    del self.readers[me]
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self.cond:
+            if self.writer == me:
+                self.writer_depth += 1
+            else:
+                if me in self.readers:
+                    raise RuntimeError("can't upgrade a read lock to a write lock")
+                self.writers_waiting += 1
+                try:
+                    while self.writer is not None or self.readers:
+                        self.cond.wait()
+                finally:
+                    self.writers_waiting -= 1
+                self.writer = me
+                self.writer_depth = 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer_depth -= 1
+                if not self.writer_depth:
+                    self.writer = None
+                    self.cond.notify_all()
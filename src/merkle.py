@@ -0,0 +1,117 @@
+"""
+    Merkle tree over a replica's key/version space, used for anti-entropy repair
+
+    The tree has a fixed depth: a key always lands in the same leaf bucket (the top `depth`
+    bits of a hash of the key), so two replicas' trees line up node for node no matter
+    which keys they hold. Every key contributes a digest of (key, value, version) and a
+    node's hash is the XOR of the digests below it -- which is what lets a write update the
+    tree in place: XOR the change into the leaf and each of its ancestors (depth + 1 ints)
+    instead of rehashing anything.
+
+        levels[0]           [root]
+        levels[1]           [left, right]
+        ...
+        levels[depth]       2^depth leaf buckets
+
+    Node i at level d has children 2i and 2i + 1 at level d + 1.
+
+    Repair (Node.anti_entropy) compares two trees from the root down, only following the
+    nodes that differ, and then exchanges the keys of the divergent leaf buckets -- so the
+    traffic grows with the size of the difference and not the size of the shard.
+"""
+import json
+import hashlib
+import threading
+
+DEFAULT_DEPTH = 10          # 1024 leaf buckets
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def entry_digest(key, value, clock):
+    """
+        digest of one key's state -- replicas that agree on the value and version of a key
+        produce the same digest (the clock's home address doesn't matter, only its times)
+    """
+    version = "" if clock is None else ",".join(
+        "{}={}".format(addr, time) for addr, time in sorted(clock.items()))
+    data = "{}\0{}\0{}".format(key, json.dumps(value, sort_keys=True), version)
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class MerkleTree:
+    """
+    API:
+        update(key, value, clock):  (re)hash a key into the tree
+
+        remove(key):                take a key out of the tree
+
+        rebuild(kvs, versions):     start over from a whole memtable (after resharding)
+
+        hashes(level, indexes):     the hashes of some nodes at one level
+
+        children(indexes):          the child indexes of some nodes (one level down)
+
+        keys_in(buckets):           every key in some leaf buckets
+    """
+
+    def __init__(self, depth=DEFAULT_DEPTH):
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.levels = [[0] * (1 << level) for level in range(self.depth + 1)]
+        self.digests = {}                                   # {key : digest}
+        self.buckets = [set() for _ in range(1 << self.depth)]  # leaf -> keys
+
+    def bucket(self, key):
+        return key_hash(key) >> (64 - self.depth)
+
+    def apply(self, key, digest):
+        old = self.digests.get(key, 0)
+        delta = old ^ digest
+        if delta == 0:
+            return
+        leaf = self.bucket(key)
+        if digest:
+            self.digests[key] = digest
+            self.buckets[leaf].add(key)
+        else:
+            del self.digests[key]
+            self.buckets[leaf].discard(key)
+        # the change shows up in the leaf and every ancestor
+        for level in range(self.depth, -1, -1):
+            self.levels[level][leaf >> (self.depth - level)] ^= delta
+
+    def update(self, key, value, clock):
+        digest = entry_digest(key, value, clock)
+        with self.lock:
+            self.apply(key, digest)
+
+    def remove(self, key):
+        with self.lock:
+            self.apply(key, 0)
+
+    def rebuild(self, kvs, versions):
+        with self.lock:
+            self.clear()
+            for key, value in list(kvs.items()):
+                self.apply(key, entry_digest(key, value, versions[key]))
+
+    def root(self):
+        return self.levels[0][0]
+
+    def hashes(self, level, indexes):
+        nodes = self.levels[level]
+        return [nodes[index] for index in indexes]
+
+    @staticmethod
+    def children(indexes):
+        return [child for index in indexes for child in (2 * index, 2 * index + 1)]
+
+    def keys_in(self, buckets):
+        with self.lock:
+            return [key for leaf in buckets for key in self.buckets[leaf]]
@@ -1,17 +1,32 @@
+import io
 import sys
-import hashlib
 import json
 from os import environ
 import threading
 from flask_restful import reqparse
-from flask import request
+from flask import request, Response
 import requests
 import grequests
+import gevent
+import gevent.queue
 import schedule
 import time
 import math
-from vector_clock import VectorClock, VectorClockEncoder, VectorClockDecoder
-from history import History, HistoryDecoder, HistoryEncoder
+import uuid
+from collections import OrderedDict
+from vector_clock import VectorClock
+from history import History
+from storage import StorageEngine
+import wire
+import stream
+import partitioner
+import planner
+import peers
+import sessions
+from latency import LatencyTracker
+from rehash import Rehasher
+from throttle import Throttle
+from locks import StripedLock, RWLock
 from urllib.parse import urlparse, parse_qs
 
 DEBUG = False
@@ -19,6 +34,14 @@ DEBUG = False
 
 # lets use a consistent timeout for everything
 TIMEOUT_LENGTH = 0.5
+# how often a GET that waits for a version asks the other replicas for it again
+# (see wait_for_version)
+PULL_INTERVAL = 0.25
+# view change modes: the store stops while keys move, or keeps serving the old and new view at
+# once (see online_reshard)
+OFFLINE, ONLINE = "offline", "online"
+# the error of a request for a key of another shard -- the view changed after it was routed here
+NOT_IN_SHARD = "Key is not in this shard"
 
 
 def timeout_handler(req, exception):
@@ -27,11 +50,65 @@ def timeout_handler(req, exception):
     return None
 
 
+def same_version(clock, other):
+    # (a key without a version is only the same as another one without)
+    if clock is None or other is None:
+        return clock is None and other is None
+    return VectorClock.compare(clock, other) == VectorClock.EQUAL
+
+
+def throttle_report(before, after):
+    """
+        the "throttle" part of a view change's response, from every node's throttle stats
+        before and after it: how long each node's reshard streams waited on its throttle and
+        how many bytes they sent (streams that ran side by side each count their wait)
+    """
+    nodes = {}
+    for address, stats in sorted(after.items()):
+        if stats is None or before.get(address) is None:
+            continue
+        nodes[address] = {"seconds": round(stats["seconds"] - before[address]["seconds"], 3),
+                          "bytes": stats["bytes"] - before[address]["bytes"]}
+    return {"seconds": round(sum(node["seconds"] for node in nodes.values()), 3), "nodes": nodes}
+
+
 class Node:
     def __init__(self, new_view, repl_factor):
 
+        # concurrency ########################################################
+        # request handlers (one greenlet/thread each), the gossip thread and the reshard
+        # endpoints all share the state below. The locks, always taken in this order:
+        #   view_lock    read by everything that uses the kvs or the view, written by view
+        #                changes and the reshard steps that walk or swap the whole kvs
+        #   key_locks    a key's stripe -- its value, version and history change together
+        #   clock_lock   cur_time, merged/incremented atomically; only copies of it are
+        #                handed out (see tick/observe)
+        #   update_lock  the gossip update log, request ID window and applied frontiers
+        # No lock is held across a request to another node (a node asks itself for things
+        # during a view change).
+        self.view_lock = RWLock()
+        self.key_locks = StripedLock.from_environ(environ)
+        self.clock_lock = threading.RLock()
+        self.update_lock = threading.RLock()
+        # bumped by view changes and whenever the update log starts over -- gossip answers to
+        # a message sent before that are dropped (their seqs/acks mean nothing anymore)
+        self.state_epoch = 0
+
         # view change & node IDs ##############################################
         self.fragments = []         # view change fragments (usually empty)
+        # keys move between nodes during a view change as a stream of chunks of about this
+        # many bytes (see stream.py)
+        self.chunk_bytes = int(environ.get("RESHARD_CHUNK_BYTES", stream.DEFAULT_CHUNK_BYTES))
+        # online view changes (see online_reshard) -- the view switches at once, and what a node
+        # had in the old view stays here, read-only, until every old shard's keys are confirmed
+        # at their new replicas; a new owner reads a key it doesn't have yet from the old ones.
+        # The default: the keys move as planned (planner.py), which is what a dry run reports
+        self.view_change_mode = environ.get("VIEW_CHANGE_MODE", ONLINE)
+        self.retired_kvs = {}               # my kvs as of the view we're migrating from
+        self.retired_versions = History()   # and its versions
+        self.retired_shards = []            # that view's shards
+        self.retired_partitioner = None     # and its key placement
+        self.migrating = set()              # IDs of its shards not confirmed migrated yet
 
         # create and then set our view/shard vars
         self.view = []                  # current view
@@ -39,6 +116,10 @@ class Node:
         self.repl_factor = None         # current view repl_factor
         self.__old_repl_factor = None   # old view repl_factor
         self.shards = []                # functionally equivalent to our view from asgn2
+        self.routing = None             # partitioner/hash settings recorded with the view
+        # maps keys to shard IDs, rebuilt for every view (see partitioner.py)
+        self.router = partitioner.RoutingTable(
+            cache_size=int(environ.get("ROUTE_CACHE_SIZE", partitioner.DEFAULT_CACHE_SIZE)))
         # 2d array where shards[i][j] = addr of shard i, replica j
         self.__old_shards = []          # needed for view change
         self.this_shard = None          # ID of this replica"s shard
@@ -47,36 +128,61 @@ class Node:
         self.current_view = 0
         self.cur_time = None
 
-        self.set_shards_and_view(new_view, int(repl_factor))
-
-        ######################################################################
-
         # kvs / causality stuff ##############################################
-        self.local_kvs = {}         # the kvs dict of this node
-
-        self.per_item_history = {}  # {key : History} -- History contains all
-        # dependencies of "key", including
-
-        # the clock associated w/ each of our keys
-        self.local_key_versions = History()
-        # I decided to store this separately
-        # from the history because it makes
-        # resharding simpler
-
-        # keys/clocks that have been changed
-        self.between_gossip_updates = History()
-        # since the last fully successful
-        # gossip (when all replicas
-        # received my updates)
+        # local_kvs, local_key_versions and per_item_history live in the storage
+        # engine's memtable (see the properties below) -- if STORAGE_DIR is set
+        # they are also written to a log and replayed here after a restart
+        self.storage = StorageEngine.from_environ(environ)
+        # keep-alive sessions for everything we send to other nodes
+        self.peers = peers.PeerPool.from_environ(environ)
+        # how fast each peer answers -- picks/hedges replicas for proxied GETs
+        self.latency = LatencyTracker.from_environ(environ)
+        # causal contexts of clients that use session tokens (see sessions.py)
+        self.sessions = sessions.SessionStore.from_environ(environ)
+        # works out the new shard of every key of a large store on a pool of processes
+        self.rehasher = Rehasher.from_environ(environ)
+        # paces the reshard traffic this node sends (see throttle.py)
+        self.throttle = Throttle.from_environ(environ)
+        saved_view = self.storage.recover()
+        if saved_view is not None:
+            # whatever view we logged last is newer than the one we were booted with
+            new_view = saved_view["view"]
+            repl_factor = saved_view["repl_factor"]
+            self.routing = saved_view.get("routing")
+
+        self.set_shards_and_view(new_view, int(repl_factor),
+                                 saved_view["current_view"] if saved_view is not None else 0)
+
+        # make sure we never hand out a clock older than one we already used
+        if self.cur_time is not None:
+            for key, clock in self.local_key_versions.items():
+                if clock is not None and set(clock) == set(self.cur_time):
+                    self.cur_time.merge(clock)
+
+        # delta gossip -- every local write gets the next sequence number, and each replica
+        # only gets sent the keys written after the last sequence number it acked
+        # (the log also carries the client request ID of each write, see remember_request)
+        self.request_id_window = int(environ.get("REQUEST_ID_WINDOW", 10000))
+        self.reset_update_log()
+
+        # blocking GETs -- a GET for a key that's older here than in the client's context may
+        # wait for the client's version instead of being NACKed: "wait" seconds from the request,
+        # else GET_WAIT, never more than MAX_GET_WAIT (see waiting_get)
+        self.get_wait = float(environ.get("GET_WAIT", 0))
+        self.max_get_wait = float(environ.get("MAX_GET_WAIT", 2))
+        self.version_waiters = {}   # {key : set of Events}, set when a new version of key lands
 
         ######################################################################
 
         # gossip stuff #######################################################
         self.replica_alive = {}
+        # seconds between Merkle-tree repairs with every replica of my shard
+        self.anti_entropy_interval = int(environ.get("ANTI_ENTROPY_INTERVAL", 30))
         if self.this_shard is not None:
             self.replica_alive = {replica:True for replica in self.shards[self.this_shard]}
+        self.stopped = threading.Event()    # set by close()
         self.gossip_thread = threading.Thread(
-            target=self.timed_gossip)
+            target=self.timed_gossip, daemon=True)
         #self.liveness_thread = threading.Thread(
         #    target=self.timed_liveness_check)
         self.gossip_thread.start()
@@ -85,6 +191,37 @@ class Node:
         self.wait_time = 2
         ######################################################################
 
+    # memtable accessors ###################################################
+    @property
+    def local_kvs(self):
+        return self.storage.kvs         # the kvs dict of this node
+
+    @local_kvs.setter
+    def local_kvs(self, kvs):
+        self.storage.kvs = kvs
+
+    @property
+    def per_item_history(self):
+        return self.storage.item_history    # {key : History} -- History contains all
+                                            # dependencies of "key"
+
+    @per_item_history.setter
+    def per_item_history(self, item_history):
+        self.storage.item_history = item_history
+
+    @property
+    def local_key_versions(self):
+        # the clock associated w/ each of our keys
+        # I decided to store this separately
+        # from the history because it makes
+        # resharding simpler
+        return self.storage.versions
+
+    @local_key_versions.setter
+    def local_key_versions(self, versions):
+        self.storage.versions = versions
+    ########################################################################
+
     def get_shard_id(self, addr):
         return self.view.index(addr) // self.repl_factor
 
@@ -96,81 +233,237 @@ class Node:
             ID of server that the key should be stored on (need ID instead
             of address to facilitate placing keys in buckets during reshard)
         """
-        # encode(utf8) -> unicode objects must be encoded before hashing
-        # hexdigest() -> hex string (no binary data)
-        hash_val = int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16)
-        return hash_val % len(self.shards)
+        # placement is up to the view's partitioner + hash, cached by the routing table
+        return self.router.shard(key)
 
-    def set_shards_and_view(self, new_view, repl_factor, current_view=0):
+    def set_shards_and_view(self, new_view, repl_factor, current_view=0, routing=None):
         """
         Params:
             - A string corresponding to the new_view
             - An int corresponding to replication factor
+            - The view's routing settings (partitioner, hash, vnodes) if the leader sent them,
+              otherwise we keep ours (or take them from the environment on first boot)
         Result:
             Updates all current view information for the node
         Returns:
             Nothing
         """
-        # save previous view variables
-        self.old_view = self.view
-        self.__old_shards = self.shards
-        self.__old_repl_factor = self.repl_factor
-        self.__old_this_shard = self.this_shard
+        with self.view_lock.write():
+            self.state_epoch += 1
+            # save previous view variables
+            self.__old_view = self.view
+            self.__old_shards = self.shards
+            self.__old_repl_factor = self.repl_factor
+            self.__old_this_shard = self.this_shard
+
+            # Converts passed-in VIEW string to an array then sorts
+            self.view = new_view.split(",")
+            self.view.sort()
+            self.repl_factor = repl_factor
+
+            self.current_view = int(current_view)
+
+            # update shards to reflect the view change
+            # (shard i is the i-th repl_factor addresses of the sorted view)
+            self.shards = planner.shards_of(self.view, repl_factor)
+
+            # key placement depends on the number of shards, so rebuild it (and drop the
+            # cached routes) with the shards
+            if routing is not None:
+                self.routing = routing
+            elif self.routing is None:
+                self.routing = partitioner.routing_from_environ(environ)
+            self.router.reset(partitioner.from_routing(self.routing, len(self.shards)))
+
+            self.storage.log_view(self.view, self.repl_factor, self.current_view, self.routing)
+
+            # save my shard_id
+            if environ["ADDRESS"] not in self.view:
+                self.this_shard = None
+                return
+
+            self.this_shard = self.view.index(environ["ADDRESS"]) // repl_factor
+            # reset vector clocks at the beginning of view changes
+            with self.clock_lock:
+                self.cur_time = VectorClock(
+                    environ["ADDRESS"], self.shards[self.this_shard])
 
-        # Converts passed-in VIEW string to an array then sorts
-        self.view = new_view.split(",")
-        self.view.sort()
-        self.repl_factor = repl_factor
-
-        self.current_view = int(current_view)
-
-        # update shards to reflect the view change
-        self.shards = [[None for x in range(repl_factor)]
-                       for y in range(len(self.view)//repl_factor)]
+    def reset_histories(self):
+        # resests histories between view changes
+        with self.view_lock.write():
+            self.per_item_history = {}
+            self.local_key_versions = History()
+            self.reset_update_log()
+
+    def reset_update_log(self):
+        with self.update_lock:
+            self.state_epoch += 1
+            # seqs only mean something within one update log -- they start over after a restart
+            # and every view change, so every log gets an ID of its own that goes with them
+            self.log_id = uuid.uuid4().hex
+            self.update_seq = 0             # sequence number of my last local write
+            self.update_log = {}            # {key : seq of its last local write}, in seq order
+            self.peer_acked = {}            # {replica : highest of my seqs it has applied}
+            self.received_from = {}         # {replica : highest of its seqs I have applied}
+            self.peer_logs = {}             # {replica : ID of its update log those seqs are of}
+            self.update_request_ids = {}    # {key : [request ID, status] of its last local write}
+            # the last request_id_window client request IDs written to my shard -- a retried PUT
+            # with one of these gets the original answer instead of a new version
+            # (versions don't survive a view change, so neither do these)
+            self.seen_requests = OrderedDict()  # {request ID : (key, version, status)}
+            # applied frontier -- {replica : t} means I have applied every write that replica made
+            # up to its own clock time t (gossip always carries ALL of a replica's writes I haven't
+            # acked, so after applying a message I'm caught up to the sender's clock at the time)
+            self.applied = {}
+            # my clock times of the writes between tick and record_update -- they aren't in the
+            # update log yet, so my own frontier stays below them (see applied_frontier)
+            self.unrecorded = set()
+            self.peer_applied = {}          # {replica : its applied frontier, as of its last gossip}
+            # for reads that skip the causal checks (see stale_get)
+            self.synced_at = {}             # {replica : time.monotonic() of our last gossip with it}
+            self.landed_at = {}             # {key : time.monotonic() its version was written here}
+
+    def record_update(self, key, request_id=None, status=None, version=None):
+        # re-inserting moves the key to the end, so the log stays sorted by seq
+        # (version: the write's version from tick, it's in the log now)
+        with self.update_lock:
+            if version is not None:
+                self.unrecorded.discard(version[environ["ADDRESS"]])
+            self.update_seq += 1
+            self.update_log.pop(key, None)
+            self.update_log[key] = self.update_seq
+            if request_id is None:
+                self.update_request_ids.pop(key, None)
+            else:
+                self.update_request_ids[key] = [request_id, status]
 
-        # populate shards
-        for addr in self.view:
-            shard_id = self.view.index(addr) // self.repl_factor
-            repl_id = self.view.index(addr) % self.repl_factor
-            self.shards[shard_id][repl_id] = addr
+    def tick(self, high_clock=None):
+        """
+            a local write: merge a client's high clock into cur_time and increment it
+            Returns: a copy of the new cur_time -- the write's version
+        """
+        with self.clock_lock:
+            self.cur_time.merge(high_clock)
+            self.cur_time.increment()
+            with self.update_lock:
+                self.unrecorded.add(self.cur_time[environ["ADDRESS"]])
+            return self.cur_time.copy()
+
+    def observe(self, clock=None):
+        """
+            merge a clock we've seen (a client's high clock, a replica's clock) into cur_time
+            Returns: a copy of cur_time afterwards
+        """
+        with self.clock_lock:
+            self.cur_time.merge(clock)
+            return self.cur_time.copy()
 
-        # save my shard_id
-        if environ["ADDRESS"] not in self.view:
-            self.this_shard = None
+    def applied_frontier(self):
+        """
+            {replica : t} -- I have applied every write replica made up to its clock time t. My
+            own writes count once they're in the update log (record_update), so a gossip message
+            built under the same locks (see updates_for) carries every write of mine below it
+        """
+        with self.clock_lock, self.update_lock:
+            applied = dict(self.applied)
+            if self.cur_time is not None:
+                mine = self.cur_time[environ["ADDRESS"]]
+                if self.unrecorded:
+                    mine = min(self.unrecorded) - 1
+                applied[environ["ADDRESS"]] = mine
+            return applied
+
+    def learn_applied(self, replica, their_applied):
+        """
+            after applying a gossip message from replica: I'm caught up with its writes up to
+            its clock time when it sent them, and it told me how far it is caught up with everyone
+        """
+        if not their_applied:
             return
+        with self.update_lock:
+            self.applied[replica] = max(self.applied.get(replica, 0),
+                                        their_applied.get(replica, 0))
+            self.peer_applied[replica] = their_applied
 
-        self.this_shard = self.view.index(environ["ADDRESS"]) // repl_factor
-        # reset vector clocks at the beginning of view changes
-        self.cur_time = VectorClock(
-            environ["ADDRESS"], self.shards[self.this_shard])
-
-    def reset_histories(self):
-        # resests histories between view changes
-        self.per_item_history = {}
-        self.local_key_versions = History()
-        self.between_gossip_updates = History()
-
-    def try_reshard(self, new_view, repl_factor):
+    def stable_frontier(self):
+        """
+        Returns: a clock of my shard that every replica of the shard has applied everything
+                 below (element-wise min of all our applied frontiers), None outside of a shard
+        """
+        if self.this_shard is None or self.cur_time is None:
+            return None
+        replicas = self.shards[self.this_shard]
+        mine = self.applied_frontier()
+        with self.update_lock:
+            frontiers = [mine] + [self.peer_applied.get(replica, {})
+                                  for replica in replicas if replica != environ["ADDRESS"]]
+        stable = VectorClock(environ["ADDRESS"], replicas)
+        for addr in replicas:
+            stable.set(addr, min(frontier.get(addr, 0) for frontier in frontiers))
+        return stable
+
+    def compact_history(self, history):
         """
-            - if I"m the shard leader, call initiate_reshard,
+            drop the entries of a client's history that can't matter anymore -- keys of my
+            shard whose version every replica of the shard has already applied, so no replica
+            could ever hand out something older. The high clock list still summarizes them; only
+            the entries that aren't stable yet stay, so the context doesn't grow with the session
+        """
+        stable = self.stable_frontier()
+        if stable is None:
+            return history
+        for key, clock in list(history.items()):
+            if stable.dominates(clock) and self.hash(key) == self.this_shard:
+                del history.hist[key]
+        return history
+
+    def remember_request(self, request_id, key, version, status):
+        # oldest request IDs fall out of the window first
+        with self.update_lock:
+            self.seen_requests.pop(request_id, None)
+            self.seen_requests[request_id] = (key, version.copy() if version is not None else None,
+                                              status)
+            while len(self.seen_requests) > self.request_id_window:
+                self.seen_requests.popitem(last=False)
+
+    def try_reshard(self, new_view, repl_factor, online=None, dry_run=False):
+        """
+            - if I"m the shard leader, call online_reshard (or initiate_reshard if the request
+              or VIEW_CHANGE_MODE says "offline", or plan_reshard for a dry run),
               otherwise I"m a proxy for my shard leader
+            - only an online view change follows a plan, so only an online one can be planned
         """
+        if online is None:
+            online = self.view_change_mode == ONLINE
+        if dry_run and not online:
+            # an offline view change moves every key through the old and new shard leaders,
+            # not what plan_reshard would report
+            return {"error": "Only an online view change can be planned", "message": "Error in PUT",
+                    "mode": OFFLINE}, 400
         # I'm not the leader -- be proxy
         # Case 1: request sent to a completely new node
         if environ["ADDRESS"] not in self.view:
-            response = requests.put("http://{}/kvs/view-change".format(
-                self.shards[0][0]),
-                json={"view": new_view, "repl-factor": repl_factor},
-                headers=dict(request.headers), timeout=TIMEOUT_LENGTH)
-            return response.json(), 200
+            response = self.peers.send("PUT", self.shards[0][0], "/kvs/view-change",
+                json={"view": new_view, "repl-factor": repl_factor, "online": online,
+                  "dry-run": dry_run},
+                headers=peers.forward_headers(request.headers), timeout=TIMEOUT_LENGTH)
+            return response.json(), response.status_code
         # Case 2: request sent to a current node, but not the shard-leader
         if self.shards[self.this_shard][0] != environ["ADDRESS"]:
-            response = requests.put("http://{}/kvs/view-change".format(
-                self.shards[self.this_shard][0]),
-                json={"view": new_view, "repl-factor": repl_factor},
-                headers=dict(request.headers), timeout=TIMEOUT_LENGTH)
-            return response.json(), 200
-
+            response = self.peers.send("PUT", self.shards[self.this_shard][0], "/kvs/view-change",
+                json={"view": new_view, "repl-factor": repl_factor, "online": online,
+                  "dry-run": dry_run},
+                headers=peers.forward_headers(request.headers), timeout=TIMEOUT_LENGTH)
+            return response.json(), response.status_code
+
+        if dry_run:
+            return self.plan_reshard(new_view, repl_factor)
+        # one view change at a time -- the last online one may still be moving keys
+        if self.migrating:
+            return {"error": "Keys of the last view change are still being migrated",
+                    "message": "Error in PUT", "migrating": sorted(self.migrating)}, 503
+        if online:
+            return self.online_reshard(new_view, repl_factor)
         return self.initiate_reshard(new_view, repl_factor)
 
     def initiate_reshard(self, new_view, repl_factor):
@@ -197,10 +490,14 @@ class Node:
                         if self.__old_shards[i][0] != environ["ADDRESS"]]
 
         
+        # (to report how long the steps below waited on the throttles)
+        throttled = self.throttle_stats_of(all_nodes)
+
         # Step 0: Tell shard leaders to collect all their keys -------------------------------------
         # please note this is completely different from "prime" in asgn3
         # return the value of current_view
-        rs = [grequests.put("http://{}/kvs/reshard/prime".format(leader))
+        rs = [self.peers.put(leader, "/kvs/reshard/prime",
+                            headers=wire.BINARY_HEADERS)
               for leader in old_leaders]
         responses = grequests.map(rs)
 
@@ -210,16 +507,17 @@ class Node:
         # find the max of (current_view IDs) -- because reshard leader could be brand new node
         all_view_IDs = []
         for response in responses:
-            all_view_IDs.append(response.json()["current_view"])
+            all_view_IDs.append(wire.response_body(response)["current_view"])
         all_view_IDs.append(self.current_view)
         self.current_view = max(all_view_IDs) + 1
         # ------------------------------------------------------------------------------------------
 
         # Step 0.5: Give new view to all nodes in the system ---------------------------------------
-        rs = [grequests.put("http://{}/kvs/reshard/set_new_view".format(node), 
+        rs = [self.peers.put(node, "/kvs/reshard/set_new_view", 
                             json={"view": ",".join(self.view),
                            "repl_factor": self.repl_factor,
-                           "current_view": self.current_view}) for node in all_nodes]
+                           "current_view": self.current_view,
+                           "routing": self.routing}) for node in all_nodes]
         responses = grequests.map(rs)
         # ------------------------------------------------------------------------------------------
 
@@ -227,7 +525,7 @@ class Node:
         # contact all old shard leaders at endpoint: "/kvs/reshard/rehash"
         # Rehash: Nodes rehash their keys into "fragments" (dictionaries for
         #        every other shard leader)
-        rs = [grequests.put("http://{}/kvs/reshard/rehash".format(follower),
+        rs = [self.peers.put(follower, "/kvs/reshard/rehash",
                                 json={"view": ",".join(self.view),
                              "repl_factor": self.repl_factor}) for follower in old_leaders]
         responses = grequests.map(rs)
@@ -235,15 +533,18 @@ class Node:
         # CODE HERE
 
         # Rehashes myself and assembles fragments for other shards
-        self.rehash()
+        # (histories first, so the Merkle tree rehash rebuilds matches the versions left)
         self.reset_histories()
+        self.rehash()
         # ------------------------------------------------------------------------------------------
 
         # Step 2: Send our fragments to all shard leaders in new_view  -----------------------------
         # shard_ID ==> self.view.index(shard_leader) // self.repl_factor
-        rs = [grequests.put("http://{}/kvs/reshard/put_payload".format(shard_leader),
-                            json={"payload": self.fragments[self.get_shard_id(shard_leader)]})
-                            for shard_leader in new_leaders]
+        # (only to the leaders our fragment for isn't empty)
+        rs = [self.send_payload(shard_leader,
+                                self.fragments[self.get_shard_id(shard_leader)].items())
+              for shard_leader in new_leaders
+              if self.fragments[self.get_shard_id(shard_leader)]]
         responses = grequests.map(rs)
 
         # Make sure all fragments were received
@@ -258,16 +559,16 @@ class Node:
         # ------------------------------------------------------------------------------------------
 
         # Step 3: Tell old shard leaders to send their keys to new shard leaders -------------------
-        rs = [grequests.get("http://{}/kvs/reshard/reshard".format(follower))
+        # (each of them only as fast as its throttle lets it, see send_payload)
+        rs = [self.peers.get(follower, "/kvs/reshard/reshard")
               for follower in old_leaders]
-        # WIP: We may want to consider throttling
         responses = grequests.map(rs, exception_handler=timeout_handler)
         # Check 200 response from all nodes
         # CODE HERE
         # ------------------------------------------------------------------------------------------
 
         # Step 4: Tell new shard leaders to send their keys to the other replicas in their shard ---
-        rs = [grequests.get("http://{}/kvs/reshard/send_keys_to_replicas".format(leader))
+        rs = [self.peers.get(leader, "/kvs/reshard/send_keys_to_replicas")
               for leader in new_leaders]
         responses = grequests.map(rs)
         # ------------------------------------------------------------------------------------------
@@ -276,8 +577,7 @@ class Node:
         if environ["ADDRESS"] in self.view and environ["ADDRESS"] == self.shards[self.this_shard][0]:
             others = [replica for replica in self.shards[self.this_shard]
                       if replica != environ["ADDRESS"]]
-            rs = [grequests.put("http://{}/kvs/reshard/put_payload".format(other),
-                                json={"payload": self.local_kvs}) for other in others]
+            rs = [self.send_payload(other, self.kvs_items()) for other in others]
             grequests.map(rs)
         # ------------------------------------------------------------------------------------------
 
@@ -295,7 +595,8 @@ class Node:
                                 "key-count": len(self.local_kvs),
                                 "replicas": self.shards[self.this_shard]})
 
-        return {"message": "View change successful", "shards": shard_resp}, 200
+        return {"message": "View change successful", "shards": shard_resp,
+                "throttle": throttle_report(throttled, self.throttle_stats_of(all_nodes))}, 200
 
     def prime(self):
         """
@@ -306,24 +607,7 @@ class Node:
         """
         other_replicas = [replica for replica in self.shards[self.this_shard]
                           if replica != environ["ADDRESS"]]
-
-        # send key request message --> receiving nodes send their keys and then clear their kvs
-        res = [grequests.get("http://{}/kvs/reshard/get_keys".format(replica))
-                     for replica in other_replicas]
-        responses = grequests.map(res)
-
-        # leader puts all keys in his kvs if they"re more recent
-        for response in responses:
-            new_keys = response.json()["keys"]
-            new_hist = json.loads(response.json()["history"], cls=HistoryDecoder)
-
-            updated_keys = self.local_key_versions.merge(new_hist)
-            # update our keys if we need to
-            for key in updated_keys:
-                self.local_kvs[key] = new_keys[key]
-
-        # leader no longer needs histories
-        self.reset_histories()
+        self.collect_keys(other_replicas)
 
         return {"current_view": self.current_view}, 200
 
@@ -339,69 +623,148 @@ class Node:
             return
         other_replicas = [replica for replica in self.__old_shards[self.__old_this_shard]
                           if replica != environ["ADDRESS"]]
+        self.collect_keys(other_replicas)
 
+    def collect_keys(self, replicas):
+        """
+            the shard leader's part of prime/leader_prime: take the keys of the other replicas
+            (they hand them all over and clear their kvs, see get_keys), a chunk at a time as
+            they stream in
+        """
         # send key request message --> receiving nodes send their keys and then clear their kvs
-        res = [grequests.get("http://{}/kvs/reshard/get_keys".format(replica))
-                     for replica in other_replicas]
-        responses = grequests.map(res)
+        res = [self.peers.get(replica, "/kvs/reshard/get_keys", headers=stream.STREAM_HEADERS)
+               for replica in replicas]
+        # (stream: the body is read below, chunk by chunk)
+        responses = grequests.map(res, stream=True)
 
         # leader puts all keys in his kvs if they"re more recent
         for response in responses:
-            new_keys = response.json()["keys"]
-            new_hist = json.loads(response.json()["history"], cls=HistoryDecoder)
-
-            updated_keys = self.local_key_versions.merge(new_hist)
-            # update our keys if we need to
-            for key in updated_keys:
-                self.local_kvs[key] = new_keys[key]
-
-        # leader no longer needs histories
-        self.reset_histories()
+            for chunk in stream.read_frames(response.raw):
+                with self.view_lock.write():
+                    updated_keys = self.local_key_versions.merge(chunk["history"])
+                    # update our keys if we need to
+                    for key in updated_keys:
+                        self.local_kvs[key] = chunk["keys"][key]
+            response.close()
+
+        with self.view_lock.write():
+            # leader no longer needs histories
+            self.reset_histories()
+            self.storage.checkpoint()
 
     def get_keys(self):
         """
         - Receiving node responds to caller(shard leader) with all of its keys and their most recent updates
+          (streamed, see stream.py)
         - then removes its kvs and all histories
         """
-        kvs = self.local_kvs
-        versions = self.local_key_versions
-        self.local_kvs = {}
+        with self.view_lock.write():
+            kvs = self.local_kvs
+            versions = self.local_key_versions
+            self.local_kvs = {}
 
-        self.reset_histories()
+            self.reset_histories()
+            self.storage.checkpoint()
 
-        return {"keys": kvs, "history": HistoryEncoder().encode(versions)}, 200
+        # (the kvs we just took is ours alone now, no lock needed)
+        return Response(self.throttle.frames(request.remote_addr, stream.frames(
+            self.history_chunks(kvs.items(), versions))), mimetype=stream.STREAM_MIMETYPE)
+
+    def history_chunks(self, items, versions):
+        """
+            (key, value) pairs in chunks of about chunk_bytes, each with the versions of its
+            keys -- {"keys": {key: value}, "history": History}
+        """
+        for keys in stream.split(items, self.chunk_bytes):
+            history = History()
+            for key in keys:
+                if versions[key] is not None:
+                    history.hist[key] = versions[key]
+            yield {"keys": keys, "history": history}
 
     def rehash(self):
         """
         Places all local key/value pairs into their appropriate temporary dictionaries.
         """
 
-        # Replaces the fragments with empty dictionaries corresponding to the # of shards
-        self.fragments = [{} for _ in range(len(self.shards))]
-
-        # Populates the fragments with their corresponding key-value pairs based on each key"s hash
-        for key, value in self.local_kvs.items():
-            self.fragments[self.hash(key)][key] = value
-
-        # Replaces the local KVS with its new key-value pairs
-        if environ["ADDRESS"] in self.view:
-            self.local_kvs = self.fragments[self.this_shard]
-        else:
-            self.local_kvs = {}
+        with self.view_lock.write():
+            # Replaces the fragments with empty dictionaries corresponding to the # of shards
+            self.fragments = [{} for _ in range(len(self.shards))]
+
+            # Populates the fragments with their corresponding key-value pairs based on each key"s hash
+            # (straight from the new partitioner, not through the routing cache -- every key is
+            # looked up once; a large store is hashed on the rehasher's process pool)
+            local_kvs = self.local_kvs
+            keys = list(local_kvs)
+            shard_ids = self.rehasher.shards(keys, self.router.partitioner, self.routing)
+            fragments = self.fragments
+            for key, shard_id in zip(keys, shard_ids):
+                fragments[shard_id][key] = local_kvs[key]
+
+            # Replaces the local KVS with its new key-value pairs
+            if environ["ADDRESS"] in self.view:
+                self.local_kvs = self.fragments[self.this_shard]
+            else:
+                self.local_kvs = {}
+            self.storage.checkpoint()
 
-    def put_payload(self, fragment):
+    def put_payload(self, chunks):
         """
         Note: the shard leader is the one using this function
 
-        Input: A JSON payload which is just the full key/value list sent from another node.
-        Function: Adds every item in the JSON payload to local_kvs
+        Input: {"payload": key/value list} chunks sent from another node, usually as they
+               arrive (see stream.py)
+        Function: Adds every item of every chunk to local_kvs
         """
 
-        # Incorporate all incoming keys into my local kvs
-        self.local_kvs.update(fragment)
+        # Incorporate all incoming keys into my local kvs, one chunk at a time
+        for chunk in chunks:
+            with self.view_lock.write():
+                for key, value in chunk["payload"].items():
+                    # a key with a version was written since the view change, which is newer
+                    # than anything moved over from the old view
+                    if self.local_key_versions[key] is None:
+                        self.storage.write(key, value, None)
 
         return {}, 200
 
+    def send_payload(self, address, items):
+        """
+            an (unsent) request that streams (key, value) pairs into address's kvs, a chunk at
+            a time (see put_payload), paced by the throttle
+        """
+        chunks = ({"payload": chunk} for chunk in stream.split(items, self.chunk_bytes))
+        return self.peers.put(address, "/kvs/reshard/put_payload",
+                              data=self.throttle.frames(address, stream.frames(chunks)),
+                              headers=stream.STREAM_HEADERS)
+
+    def throttle_stats_of(self, nodes):
+        """
+            {address : throttle stats} of me and the given nodes (None for one that doesn't
+            answer) -- see throttle.py
+        """
+        rs = [self.peers.get(node, "/kvs/reshard/throttle") for node in nodes]
+        stats = {environ["ADDRESS"]: self.throttle.stats()}
+        for node, response in zip(nodes, grequests.map(rs, exception_handler=timeout_handler)):
+            stats[node] = (wire.response_body(response)
+                           if response is not None and response.status_code == 200 else None)
+        return stats
+
+    def kvs_items(self, keys=None, retired=False):
+        """
+            (key, value) pairs of my kvs for send_payload (only the given keys, of my retired
+            kvs if retired -- see migrate) -- read a few at a time under the view lock, so it
+            isn't held while the stream waits on the network
+        """
+        if keys is None:
+            with self.view_lock.read():
+                keys = list(self.retired_kvs if retired else self.local_kvs)
+        for start in range(0, len(keys), 1000):
+            with self.view_lock.read():
+                kvs = self.retired_kvs if retired else self.local_kvs
+                items = [(key, kvs[key]) for key in keys[start:start + 1000] if key in kvs]
+            yield from items
+
     def distribute_keys(self):
         """
         shard leader sends his keys to the other replicas in his shard
@@ -410,8 +773,7 @@ class Node:
                           if replica != environ["ADDRESS"]]
 
         # send keys
-        responses = [grequests.put("http://{}/kvs/reshard/put_payload".format(replica),
-                                   json={"payload": self.local_kvs}) for replica in other_replicas]
+        responses = [self.send_payload(replica, self.kvs_items()) for replica in other_replicas]
         grequests.map(responses)
 
         return {"shard-id": self.this_shard, "key-count": len(self.local_kvs),
@@ -424,9 +786,8 @@ class Node:
         # send data to other shard leaders in the new view
         others = [self.shards[i][0] for i in range(len(self.shards))
                         if self.shards[i][0] != environ["ADDRESS"]]
-        responses = [grequests.put("http://{}/kvs/reshard/put_payload".format(other),
-                                   json={"payload": self.fragments[self.get_shard_id(other)]}) 
-                                    for other in others]
+        responses = [self.send_payload(other, self.fragments[self.get_shard_id(other)].items())
+                     for other in others if self.fragments[self.get_shard_id(other)]]
         grequests.map(responses)
 
         # clear our temp fragments - we are done with them
@@ -441,6 +802,336 @@ class Node:
         return {"shard-id": self.this_shard, "key-count": len(self.local_kvs),
                 "replicas": self.shards[self.this_shard]}, 200
 
+    # Online view change: instead of stopping the store while keys move (initiate_reshard), every
+    # node switches to the new view at once and keeps what it had in the old view as its retired
+    # kvs. Writes go to the new owners right away; a new owner that doesn't have a key yet reads
+    # it from the retired kvs of the key's old shard (retired_get) until that shard is confirmed
+    # migrated. The retired kvs only live in memory -- a node restarted halfway through loses it.
+
+    def online_reshard(self, new_view, repl_factor):
+        """
+        Input: a comma-separated string of node addresses and a replication factor (int)
+        Outline (the view change leader's side):
+            - every node of the old and new view switches to the new view, keeping its kvs as
+              its retired kvs (begin_migration)
+            - the leader of every old shard merges its replicas' retired kvs and streams each
+              new replica the keys it doesn't have yet (migrate, see planner.py) -- the next
+              replica takes over if it fails, all old shards at once
+            - as soon as an old shard is done every node is told (confirm_migrated), its keys
+              stop falling back; the retired kvs are dropped once all of them are
+        Returns: the new shards and their key counts, like initiate_reshard, and the keys/bytes
+                 sent from node to node (503 and the shards that couldn't be migrated -- their
+                 keys keep falling back -- if any)
+        """
+        with self.view_lock.read():
+            old_shards = [list(shard) for shard in self.shards]
+            all_nodes = sorted(set(self.view).union(new_view.split(",")) - {environ["ADDRESS"]})
+            current_view = self.current_view + 1
+        throttled = self.throttle_stats_of(all_nodes)
+
+        # Step 1: everyone switches to the new view ------------------------------------------------
+        rs = [self.peers.put(node, "/kvs/reshard/begin_migration",
+                             json={"view": new_view, "repl_factor": repl_factor,
+                                   "current_view": current_view, "routing": self.routing,
+                                   "old_shards": old_shards}) for node in all_nodes]
+        self.begin_migration(new_view, repl_factor, current_view, self.routing, old_shards)
+        grequests.map(rs, exception_handler=timeout_handler)
+
+        # Step 2: old shards move their keys to the new ones, and confirm ---------------------------
+        jobs = [gevent.spawn(self.migrate_shard, shard_id, replicas, all_nodes)
+                for shard_id, replicas in enumerate(old_shards)]
+        gevent.joinall(jobs)
+        unmigrated = [shard_id for shard_id, job in enumerate(jobs) if job.value is None]
+        moves = [move for job in jobs for move in job.value or []]
+        throttle = throttle_report(throttled, self.throttle_stats_of(all_nodes))
+
+        # Step 3: construct client response --------------------------------------------------------
+        rs = [self.peers.get(shard[0], "/kvs/key-count") for shard in self.shards]
+        shard_resp = []
+        for shard_id, response in enumerate(grequests.map(rs, exception_handler=timeout_handler)):
+            shard_resp.append({"shard-id": shard_id,
+                               "key-count": response.json()["key-count"]
+                               if response is not None else None,
+                               "replicas": self.shards[shard_id]})
+
+        if unmigrated:
+            return {"error": "Some old shards could not be migrated", "message": "Error in PUT",
+                    "shards": shard_resp, "moves": moves, "migrating": unmigrated,
+                    "throttle": throttle}, 503
+        return {"message": "View change successful", "shards": shard_resp, "moves": moves,
+                "throttle": throttle}, 200
+
+    def plan_reshard(self, new_view, repl_factor):
+        """
+        Input: a comma-separated string of node addresses and a replication factor (int)
+        Returns: what an online view change to that view would send from node to node (see
+                 planner.py) without moving anything -- every old shard's leader plans its
+                 shard from its own copy, as if the shard's replicas were in sync
+        """
+        with self.view_lock.read():
+            old_leaders = [shard[0] for shard in self.shards]
+        rs = [self.peers.get(leader, "/kvs/reshard/plan",
+                             json={"view": new_view, "repl_factor": repl_factor})
+              for leader in old_leaders]
+        moves, unreachable = [], []
+        for leader, response in zip(old_leaders,
+                                    grequests.map(rs, exception_handler=timeout_handler)):
+            if response is None or response.status_code != 200:
+                unreachable.append(leader)
+                continue
+            moves.extend(wire.response_body(response)["moves"])
+
+        body = {"message": "View change planned", "dry-run": True, "mode": ONLINE,
+                "shards": planner.shards_of(new_view.split(","), repl_factor), "moves": moves,
+                "keys": sum(move["keys"] for move in moves),
+                "bytes": sum(move["bytes"] for move in moves)}
+        if unreachable:
+            body.update({"error": "Some shard leaders could not be reached",
+                         "unreachable": unreachable})
+            return body, 503
+        return body, 200
+
+    def plan_moves(self, new_view, repl_factor):
+        """
+            (the "plan" command) my shard's part of plan_reshard, from my kvs
+        """
+        new_shards = planner.shards_of(new_view.split(","), repl_factor)
+        with self.view_lock.read():
+            if self.this_shard is None:
+                return {"moves": []}, 200
+            keys = list(self.local_kvs)
+            replicas = list(self.shards[self.this_shard])
+            old_partitioner = self.router.partitioner
+        new_partitioner = partitioner.from_routing(self.routing, len(new_shards))
+        old_ids = self.rehasher.shards(keys, old_partitioner, self.routing)
+        new_ids = self.rehasher.shards(keys, new_partitioner, self.routing)
+        plan = planner.moves(replicas, new_shards,
+                             [(key, new_id) for key, old_id, new_id in zip(keys, old_ids, new_ids)
+                              if old_id == self.this_shard])
+        return {"moves": planner.summary(environ["ADDRESS"], plan, lambda key: planner.entry_bytes(
+            key, self.local_kvs.get(key)))}, 200
+
+    def begin_migration(self, new_view, repl_factor, current_view, routing, old_shards):
+        """
+        Input: the new view (as for set_shards_and_view) and the shards of the old one
+        Function: switches to the new view with new clocks; what I had becomes my retired kvs,
+                  and every old shard is migrating -- the keys I had as a replica of their old
+                  shard and own in the new view too stay in my kvs (see planner.py)
+        """
+        with self.view_lock.write():
+            retired_kvs, retired_versions = self.local_kvs, self.local_key_versions
+            self.set_shards_and_view(new_view, repl_factor, current_view, routing)
+            self.retired_kvs = retired_kvs
+            self.retired_versions = retired_versions
+            self.retired_shards = old_shards
+            self.retired_partitioner = partitioner.from_routing(self.routing, len(old_shards))
+            self.migrating = set(range(len(old_shards)))
+
+            # the rest arrive from the old shards (put_payload) or get written anew
+            kept = {}
+            if self.this_shard is not None:
+                keys = list(retired_kvs)
+                old_ids = self.rehasher.shards(keys, self.retired_partitioner, self.routing)
+                new_ids = self.rehasher.shards(keys, self.router.partitioner, self.routing)
+                for key, old_id, new_id in zip(keys, old_ids, new_ids):
+                    if new_id == self.this_shard and environ["ADDRESS"] in old_shards[old_id]:
+                        kept[key] = retired_kvs[key]
+            self.local_kvs = kept
+            self.reset_histories()
+            self.storage.checkpoint()
+        return {}, 200
+
+    def migrate_shard(self, shard_id, replicas, all_nodes):
+        """
+            (view change leader) have one replica of an old shard migrate it, the next one if it
+            fails, then tell every node
+        Returns: what it sent where (see planner.summary) once the shard is migrated, else None
+        """
+        for replica in replicas:
+            if replica == environ["ADDRESS"]:
+                body, status = self.migrate(shard_id)
+            else:
+                try:
+                    response = self.peers.send("PUT", replica, "/kvs/reshard/migrate",
+                                               json={"shard": shard_id})
+                except requests.exceptions.RequestException as exception:
+                    timeout_handler(None, exception)
+                    continue
+                body, status = wire.response_body(response), response.status_code
+            if status == 200:
+                break
+        else:
+            return None
+
+        rs = [self.peers.put(node, "/kvs/reshard/migrated", json={"shard": shard_id})
+              for node in all_nodes]
+        grequests.map(rs, exception_handler=timeout_handler)
+        self.confirm_migrated(shard_id)
+        return body.get("moves", [])
+
+    def migrate(self, shard_id):
+        """
+        Input: the ID of the old shard I'm a replica of
+        Outline:
+            - merge the retired kvs of the shard's other replicas into mine -- a write may not
+              have reached every replica before the switch, the newest version of a key wins
+            - send each new replica the shard's keys it doesn't have yet (see planner.py): all
+              of them if it wasn't a replica of the shard, else those its copy was behind on
+              (a key written there since the switch is kept, see put_payload)
+        Returns: 200 and what went where (planner.summary) once every one of them took its keys
+        """
+        with self.view_lock.read():
+            if shard_id not in self.migrating:
+                return {"shard-id": shard_id, "moves": []}, 200
+            old_replicas = list(self.retired_shards[shard_id])
+            new_replicas = {replica for shard in self.shards for replica in shard}
+            # {replica : {key : version}} -- what the copies of the replicas that stay in the
+            # view had, before the merge
+            copies = {}
+            if environ["ADDRESS"] in new_replicas:
+                copies[environ["ADDRESS"]] = {key: self.retired_versions[key]
+                                              for key in self.retired_kvs}
+        others = [replica for replica in old_replicas if replica != environ["ADDRESS"]]
+
+        res = [self.peers.get(replica, "/kvs/reshard/retired", headers=stream.STREAM_HEADERS)
+               for replica in others]
+        for replica, response in zip(others, grequests.map(res, stream=True,
+                                                          exception_handler=timeout_handler)):
+            # (a replica that's down can't add anything -- the others may have its writes)
+            if response is None:
+                continue
+            copy = {}
+            try:
+                for chunk in stream.read_frames(response.raw):
+                    with self.view_lock.write():
+                        updated_keys = set(self.retired_versions.merge(chunk["history"]))
+                        for key, value in chunk["keys"].items():
+                            if replica in new_replicas:
+                                copy[key] = chunk["history"][key]
+                            if key in updated_keys or key not in self.retired_kvs:
+                                self.retired_kvs[key] = value
+                copies[replica] = copy
+            except ValueError:
+                # cut off halfway -- what did arrive is merged, but its copy counts as unknown
+                pass
+            response.close()
+
+        # every key's new shard -- leaving out strays of other old shards, they're moved by
+        # their own shard (hashed on the rehasher's process pool if there are many)
+        with self.view_lock.read():
+            keys = list(self.retired_kvs)
+            shards = [list(shard) for shard in self.shards]
+            old_partitioner, new_partitioner = self.retired_partitioner, self.router.partitioner
+            versions = self.retired_versions
+        old_ids = self.rehasher.shards(keys, old_partitioner, self.routing)
+        new_ids = self.rehasher.shards(keys, new_partitioner, self.routing)
+        placements = [(key, new_id) for key, old_id, new_id in zip(keys, old_ids, new_ids)
+                      if old_id == shard_id]
+
+        # which keys the old replicas that stay in the view are behind on (everything, if we
+        # don't know what their copy had)
+        stale = {}
+        for replica in old_replicas:
+            if replica not in new_replicas:
+                continue
+            copy = copies.get(replica)
+            if copy is None:
+                stale[replica] = set(keys)
+                continue
+            stale[replica] = {key for key, _ in placements
+                              if key not in copy or not same_version(copy[key], versions[key])}
+        plan = planner.moves(old_replicas, shards, placements, stale)
+
+        rs = [self.send_payload(destination, self.kvs_items(keys, retired=True))
+              for destination, keys in plan.items()]
+        responses = grequests.map(rs, exception_handler=timeout_handler)
+        if any(response is None or response.status_code != 200 for response in responses):
+            return {"error": "Unable to reach every new replica", "message": "Error in migrate"}, 503
+        return {"shard-id": shard_id,
+                "moves": planner.summary(environ["ADDRESS"], plan, lambda key: planner.entry_bytes(
+                    key, self.retired_kvs.get(key)))}, 200
+
+    def confirm_migrated(self, shard_id):
+        """
+            the keys of old shard shard_id are at their new replicas -- stop falling back to it,
+            and drop the retired kvs once no shard is left
+        """
+        with self.view_lock.write():
+            self.migrating.discard(shard_id)
+            if not self.migrating:
+                self.retired_kvs = {}
+                self.retired_versions = History()
+        return {}, 200
+
+    def get_retired(self, keys=None):
+        """
+            (the "retired" command) the given keys of my retired kvs, all of it if None --
+            streamed like get_keys, with their versions (all of it is a shard's migration and
+            throttled like get_keys, a few keys are a client's GET and aren't)
+        """
+        with self.view_lock.read():
+            versions = self.retired_versions
+            migration = keys is None
+            if migration:
+                keys = list(self.retired_kvs)
+        frames = stream.frames(self.history_chunks(self.kvs_items(keys, retired=True), versions))
+        if migration:
+            frames = self.throttle.frames(request.remote_addr, frames)
+        return Response(frames, mimetype=stream.STREAM_MIMETYPE)
+
+    def retired_get(self, key, body, status):
+        """
+            a 404 of my shard during an online view change: if the key's old shard isn't
+            migrated yet, the key may just not be here yet -- ask that shard's replicas
+        Returns: body/status as they were, or the 200 with the value (newest retired version)
+        """
+        with self.view_lock.read():
+            if not self.migrating:
+                return body, status
+            old_id = self.retired_partitioner.shard(key)
+            if old_id not in self.migrating:
+                return body, status
+            replicas = list(self.retired_shards[old_id])
+
+        fetches = [gevent.spawn(self.fetch_retired, replica, key) for replica in replicas]
+        gevent.joinall(fetches)
+        found = None
+        for fetch in fetches:
+            if fetch.value is None:
+                continue
+            value, clock = fetch.value
+            if found is None or clock is not None and (
+                    found[1] is None
+                    or VectorClock.compare(clock, found[1]) == VectorClock.GREATER_THAN):
+                found = fetch.value
+        if found is None:
+            return body, status
+
+        body = dict(body, message="Retrieved successfully", doesExist=True, value=found[0])
+        body.pop("error", None)
+        return body, 200
+
+    def fetch_retired(self, replica, key):
+        """
+        Returns: (value, version) of key in replica's retired kvs, None if it doesn't have it
+                 (or doesn't answer)
+        """
+        if replica == environ["ADDRESS"]:
+            with self.view_lock.read():
+                if key not in self.retired_kvs:
+                    return None
+                return self.retired_kvs[key], self.retired_versions[key]
+        try:
+            response = self.peers.send("GET", replica, "/kvs/reshard/retired",
+                                       data=wire.dumps({"keys": [key]}),
+                                       headers=wire.BINARY_HEADERS, timeout=TIMEOUT_LENGTH)
+            for chunk in stream.read_frames(io.BytesIO(response.content)):
+                if key in chunk["keys"]:
+                    return chunk["keys"][key], chunk["history"][key]
+        except (requests.exceptions.RequestException, ValueError) as exception:
+            timeout_handler(None, exception)
+        return None
+
 
 ########## GOSSIP FUNCTIONS ########################################################################
 
@@ -449,9 +1140,27 @@ class Node:
 
     def timed_gossip(self):
         schedule.every(1).seconds.do(self.gossip)
-        while True:
+        # snapshots piggyback on the gossip timer so they never run inside a request
+        schedule.every(1).seconds.do(self.snapshot)
+        schedule.every(self.anti_entropy_interval).seconds.do(self.timed_anti_entropy)
+        while not self.stopped.wait(1):
             schedule.run_pending()
-            time.sleep(1)
+        schedule.clear()
+
+    def snapshot(self):
+        # not while a reshard step swaps the memtable
+        with self.view_lock.read():
+            self.storage.maybe_snapshot()
+
+    def close(self):
+        """
+            called by the server once it stopped taking requests: stop gossiping, stop the
+            rehash workers and close the storage engine (syncs the write-ahead log)
+        """
+        self.stopped.set()
+        self.gossip_thread.join(timeout=5)
+        self.rehasher.close()
+        self.storage.close()
 
     def timed_liveness_check(self):
         schedule.every(1).seconds.do(self.liveness_check)
@@ -466,151 +1175,344 @@ class Node:
     def gossip(self):
         """
             - protocol for 'gossiping' our keys between replicas to achieve eventual and causal consistency
+            - every replica is only sent what it hasn't acked yet (see updates_for)
         """
-        if self.this_shard is None:
-            return
-        # populate dict to send out values to be updated
-        changed_keys = {}                           # dicitonary of keys and their values
-        per_item_history_for_changed_keys = {}      # dictionary of History objects
-
-        # get the last modified items + their respective histories
-        for key in self.between_gossip_updates:
-            changed_keys[key] = self.local_kvs[key]
-            per_item_history_for_changed_keys[key] = self.per_item_history[key]
-
-        # need to send a few things:
-        # 1. self.per_item_history_for_changed_keys ==> replaces per_item_history on replica node
-        # 2. changed_keys  ==> so receiving node can update their keys/values
-        # 3. self.between_gossip_updates ==> used to compare how recent an item is
-        # 4. send self.cur_time
-
         # for each replica send a gossip msg
         # using grequests better then sending them one-by-one:
         #       - if several replicas are down, waiting for timeout would be lengthy
         #       - grequests consistent with our design philosophy from asgn3
-        replicas = [replica for replica in self.shards[self.this_shard]
-                    if replica != environ["ADDRESS"]]
-        
-        msgs = [grequests.get("http://" + replica + "/kvs/gossip",
-                              json={"items": {key:value for (key, value) in changed_keys.items()},
-                                    "item-history": {key: HistoryEncoder().encode(per_item_history_for_changed_keys[key])
-                                                     for key in changed_keys},
-                                    "updated-key-times": HistoryEncoder().encode(self.between_gossip_updates),
-                                    "vector-clock": VectorClockEncoder().encode(self.cur_time),
-                                    "address": environ["ADDRESS"]
-                                    },
-                              timeout=TIMEOUT_LENGTH) for replica in replicas]
+        # need to send a few things (per replica):
+        # 1. items/item-history/updated-key-times for the keys it hasn't acked
+        # 2. seq ==> the highest of my seqs included, it acks this back (log ==> which update
+        #    log of mine they're seqs of)
+        # 3. ack ==> the highest of its seqs I've applied, so it can stop sending those (ack-log
+        #    ==> of which of its update logs)
+        # 4. send self.cur_time
+        with self.view_lock.read():
+            if self.this_shard is None:
+                return
+            epoch = self.state_epoch
+            replicas = [replica for replica in self.shards[self.this_shard]
+                        if replica != environ["ADDRESS"]]
+            msgs = []
+            for replica in replicas:
+                msg = self.updates_for(replica)
+                with self.update_lock:
+                    msg.update({"ack": self.received_from.get(replica, 0),
+                                "ack-log": self.peer_logs.get(replica)})
+                msg.update({"vector-clock": self.observe(),
+                            "address": environ["ADDRESS"]})
+                msgs.append(self.peers.get(replica, "/kvs/gossip",
+                                          data=wire.dumps(msg), headers=wire.BINARY_HEADERS,
+                                          timeout=TIMEOUT_LENGTH))
         responses = grequests.map(msgs, exception_handler=timeout_handler)
-        
 
-        safe_to_delete = True
         # go through each response and updates my values accordingly
+        revived = []
+        with self.view_lock.read():
+            if self.state_epoch != epoch:
+                # the view changed or my update log started over while we waited -- the
+                # answers are about state that's gone
+                return
+            for i, response in enumerate(responses):
+                if response is None or response.status_code != 200:
+                    # mark replica as down -- its cursor stays put, so it gets everything later
+                    self.replica_alive[replicas[i]] = False
+                    continue
 
-        for i, response in enumerate(responses):
-            if response is None or response.status_code != 200:
-                # mark replica as down
-                self.replica_alive[replicas[i]] = False
-                # don"t delete between_gossip_history later
-                safe_to_delete = False
-                continue
-
-            items = response.json()["items"]
-            history_responses_temp = response.json()["item-history"]
-            history_responses = {}
-
-            for key in history_responses_temp:
-                history_responses[key] = json.loads(
-                    history_responses_temp[key], cls=HistoryDecoder)
+                body = wire.response_body(response)
+                history_responses = {key: wire.to_history(hist)
+                                     for key, hist in body["item-history"].items()}
+                self.apply_updates(body["items"], history_responses,
+                                   wire.to_history(body["updated-key-times"]),
+                                   body.get("request-ids"))
+                self.learn_applied(replicas[i], body.get("applied"))
+                self.sync_cursors(replicas[i], body.get("seq", 0), body.get("log"),
+                                  body.get("ack", 0), body.get("ack-log"))
 
-            other_clock = json.loads(response.json()["vector-clock"], cls=VectorClockDecoder)
-            updated_key_times = json.loads(
-                response.json()["updated-key-times"], cls=HistoryDecoder)
+                # update my vector clock
+                self.observe(wire.to_clock(body["vector-clock"]))
 
-            # merge foreign update times with mine ==> returns list of my out-of-date keys
-            keys_to_replace = self.local_key_versions.merge(updated_key_times)
-            # replace keys and update necessary variables
-            for key in keys_to_replace:
-                self.local_kvs[key] = items[key]
-                self.per_item_history[key] = history_responses[key]
+                # replica came back (e.g. a partition healed) -- reconcile everything we missed
+                if self.replica_alive.get(replicas[i]) is False:
+                    self.replica_alive[replicas[i]] = True
+                    revived.append(replicas[i])
 
-            # update my vector clock
-            self.cur_time.merge(other_clock)
+            self.prune_update_log(replicas)
 
-        # if i heard from all replicas --> delete between_gossip_updates
-        # THIS IS CURRENTLY BROKEN **************************************************************
-        # if safe_to_delete:
-        #     print("deleting update log", file=sys.stderr)
-        #     self.between_gossip_updates = History()
+        # (talks to the replica, so not under the view lock)
+        for replica in revived:
+            self.anti_entropy(replica)
 
         # just for testing --> let's see what we have
         if DEBUG:
             print("key-count: {}".format(len(self.local_kvs)), file=sys.stderr)
-            print("local_kvs:\n", self.local_kvs, file=sys.stderr)
-        # for key, version in self.local_key_versions.items():
-        #     print("key: {}\nversions: {}".format(key,version), file=sys.stderr)
-        # for key, history in self.per_item_history.items():
-        #     print("key: {}\nhistory: {}".format(key,history), file=sys.stderr)
+            print("update log: {} keys, acked: {}".format(len(self.update_log), self.peer_acked),
+                  file=sys.stderr)
+
+    def updates_for(self, replica):
+        """
+        Returns: the gossip payload for every key written since the last seq the replica acked
+                 (items, item-history, updated-key-times) plus the seq it covers and my applied
+                 frontier as of the same moment
+        """
+        with self.clock_lock, self.update_lock:
+            applied = self.applied_frontier()
+            seq = self.update_seq
+            acked = self.peer_acked.get(replica, 0)
+            changed_keys = {}                           # dictionary of keys and their values
+            per_item_history_for_changed_keys = {}      # dictionary of History objects
+            updated_key_times = History()               # the version of each changed key
+            request_ids = {}                            # the client request ID of each changed key
+
+            # the log is in seq order, so walk it backwards until we hit what was acked
+            for key in reversed(self.update_log):
+                if self.update_log[key] <= acked:
+                    break
+                if key not in self.local_kvs:
+                    continue
+                changed_keys[key] = self.local_kvs[key]
+                updated_key_times.hist[key] = self.local_key_versions[key]
+                if key in self.per_item_history:
+                    per_item_history_for_changed_keys[key] = self.per_item_history[key]
+                if key in self.update_request_ids:
+                    request_ids[key] = self.update_request_ids[key]
+
+        return {"items": changed_keys,
+                "item-history": per_item_history_for_changed_keys,
+                "updated-key-times": updated_key_times,
+                "request-ids": request_ids,
+                "seq": seq, "log": self.log_id, "applied": applied}
+
+    def sync_cursors(self, replica, seq, log_id, ack, ack_log_id):
+        """
+            after applying a gossip message (or its answer) from replica: it sent me its writes
+            up to seq of its update log log_id, and has applied mine up to ack of my log
+            ack_log_id -- an ack of an older log of mine (from before a restart or view change)
+            says nothing about this one, and a new log of its own starts over from its seq
+        """
+        with self.update_lock:
+            if ack_log_id == self.log_id:
+                # (never past my last write, and never back -- answers can arrive out of order)
+                self.peer_acked[replica] = max(self.peer_acked.get(replica, 0),
+                                               min(ack, self.update_seq))
+            if log_id == self.peer_logs.get(replica):
+                self.received_from[replica] = max(self.received_from.get(replica, 0), seq)
+            else:
+                self.peer_logs[replica] = log_id
+                self.received_from[replica] = seq
+            self.synced_at[replica] = time.monotonic()
 
-    def gossip_ack(self, sender_items, item_hist, updated_key_times, vector_clock, address):
+    def prune_update_log(self, replicas):
+        """
+            drop the log entries every replica has acked
+        """
+        with self.update_lock:
+            if not replicas:
+                self.update_log = {}
+                self.update_request_ids = {}
+                return
+            acked_by_all = min(self.peer_acked.get(replica, 0) for replica in replicas)
+            for key in list(self.update_log):
+                if self.update_log[key] > acked_by_all:
+                    break
+                del self.update_log[key]
+                self.update_request_ids.pop(key, None)
+
+    def apply_updates(self, items, item_hist, updated_key_times, request_ids=None):
+        """
+        Input:  keys/values, their per-item histories and their versions (a History) from
+                another replica (+ the client request IDs of those writes, if any)
+        Result: keys where the other replica's version is newer replace ours, and the request
+                IDs go into my window too -- so a retry that fails over to me isn't applied twice
+        Returns: the replaced keys
+        """
+        for key, (request_id, status) in (request_ids or {}).items():
+            self.remember_request(request_id, key, updated_key_times[key], status)
+        with self.view_lock.read(), self.key_locks.hold(updated_key_times.hist):
+            # merge foreign update times with mine ==> returns list of my out-of-date keys
+            keys_to_replace = self.local_key_versions.merge(updated_key_times)
+            # replace keys and update necessary variables
+            for key in keys_to_replace:
+                if item_hist.get(key) is not None:
+                    self.per_item_history[key] = item_hist[key]
+                self.storage.write(key, items[key], self.local_key_versions[key],
+                                   item_hist.get(key))
+        self.versions_landed(keys_to_replace)
+        return keys_to_replace
+
+    def gossip_ack(self, sender_items, item_hist, updated_key_times, vector_clock, address,
+                   seq=0, ack=0, request_ids=None, applied=None, log_id=None, ack_log_id=None):
         # if the sender address is in my view
         sender_address = address
-        if self.this_shard is not None and sender_address in self.shards[self.this_shard]:
+        with self.view_lock.read():
+            if self.this_shard is not None and sender_address in self.shards[self.this_shard]:
 
-            # retrieve what items that have been updated on my end
-            changed_keys = {}                           # dict of keys and their values
-            per_item_history_for_changed_keys = {}      # dict of History objects
-            for key in self.between_gossip_updates:
-                changed_keys[key] = self.local_kvs[key]
-                per_item_history_for_changed_keys[key] = self.per_item_history[key]
+                # merge sender's updates into mine
+                self.apply_updates(sender_items, item_hist, updated_key_times, request_ids)
+                self.learn_applied(sender_address, applied)
 
-            # sender_items = request.json()["items"]
-            # sender_item_hist = request.json()["item-history"]
+                # update my vector clock
+                self.observe(vector_clock)
 
-            history_responses = item_hist
+                # the sender has applied everything of mine up to "ack", so only send what's newer
+                self.sync_cursors(sender_address, seq, log_id, ack, ack_log_id)
 
-            # # populate histery responses dict with decoded sender per item history
-            # for key in item_hist:
-            #     history_responses[key] = json.loads(
-            #         item_hist[key], cls=HistoryDecoder)
+                # return ack (+ my own unacked updates)
+                response = self.updates_for(sender_address)
+                with self.update_lock:
+                    response.update({"ack": self.received_from.get(sender_address, 0),
+                                     "ack-log": self.peer_logs.get(sender_address)})
+                response.update({"vector-clock": self.observe()})
+                return response, 200
 
-            sender_clock = vector_clock
-            sender_updated_key_times = updated_key_times
+        # alternative: return some meaningful response that makes sender update the view,
+        # idk if worth the effort rn, could potentially affect view change
+        #   let it get handled during reshard
+        if DEBUG:
+            print("\n\nSender address not in shard", file=sys.stderr)
+            print("Sender address: {}\nMy address: {}\nThe view: {}\n".format(sender_address,environ["ADDRESS"],",".join(self.view)), file=sys.stderr)
+        # return a dummy response
+        return {
+            "items": {},
+            "item-history": {},
+            "updated-key-times": {},
+            "vector-clock": {}
+        }, 404
+
+########## ANTI-ENTROPY ############################################################################
+
+    # Gossip only ever ships our own writes, so a replica that missed some of them (or came
+    # back from a partition) is reconciled by comparing Merkle trees (see merkle.py):
+    #   1. walk both trees from the root down, one level per request, following only the nodes
+    #      whose hashes differ
+    #   2. swap the keys of the leaf buckets that differ -- both sides keep the newer version
+
+    def timed_anti_entropy(self):
+        # periodic repair with every other replica of my shard
+        if self.this_shard is None:
+            return
+        for replica in self.shards[self.this_shard]:
+            if replica != environ["ADDRESS"]:
+                self.anti_entropy(replica)
 
-            # merge sender update times with mine ==> returns list of my out-of-date keys
-            keys_to_replace = self.local_key_versions.merge(
-                sender_updated_key_times)
+    def anti_entropy(self, replica):
+        """
+        Input:  a replica of my shard
+        Result: both of us end up with the newest version of every key either of us has
+        Returns: repair stats (levels walked, divergent buckets, keys sent/received),
+                 or None if the replica couldn't be reached
+        """
+        if self.this_shard is None or replica not in self.shards[self.this_shard]:
+            return None
+        tree = self.storage.tree
+        stats = {"levels": 0, "buckets": 0, "sent": 0, "received": 0}
 
-            # replace keys and update necessary variables
-            for key in keys_to_replace:
-                self.local_kvs[key] = sender_items[key]
-                self.per_item_history[key] = history_responses[key]
+        # 1. descend level by level
+        level, indexes = 0, [0]
+        while True:
+            body = self.merkle_request(replica, "level", {"level": level, "indexes": indexes})
+            if body is None:
+                return None
+            stats["levels"] += 1
+            diverged = [index for index, mine, theirs
+                        in zip(indexes, tree.hashes(level, indexes), body["hashes"])
+                        if mine != theirs]
+            if not diverged:
+                return stats
+            if level == tree.depth:
+                break
+            level, indexes = level + 1, tree.children(diverged)
+
+        # 2. exchange the divergent buckets
+        stats["buckets"] = len(diverged)
+        msg = self.bucket_contents(diverged)
+        msg["buckets"] = diverged
+        body = self.merkle_request(replica, "repair", msg)
+        if body is None:
+            return None
+        stats["sent"] = len(msg["items"])
+        stats["received"] = len(self.apply_bucket_contents(body))
+        if DEBUG:
+            print("anti-entropy with {}: {}".format(replica, stats), file=sys.stderr)
+        return stats
 
-            # update my vector clock
-            self.cur_time.merge(sender_clock)
+    def merkle_request(self, replica, command, msg, timeout=TIMEOUT_LENGTH):
+        msg.update({"address": environ["ADDRESS"], "depth": self.storage.tree.depth,
+                    "current_view": self.current_view})
+        try:
+            response = self.peers.send("GET", replica, "/kvs/merkle/{}".format(command),
+                                       data=wire.dumps(msg), headers=wire.BINARY_HEADERS,
+                                       timeout=timeout)
+        except requests.exceptions.RequestException as exception:
+            timeout_handler(None, exception)
+            return None
+        if response.status_code != 200:
+            return None
+        return wire.response_body(response)
+
+    def bucket_contents(self, buckets):
+        """
+            everything we have in some leaf buckets, in the same shape gossip uses
+        """
+        with self.view_lock.read():
+            return self.key_contents(self.storage.tree.keys_in(buckets))
+
+    def key_contents(self, keys):
+        """
+            what we have of some keys, in the same shape gossip uses
+        """
+        items, item_history, key_times = {}, {}, History()
+        with self.view_lock.read():
+            for key in keys:
+                if key not in self.local_kvs:
+                    continue
+                items[key] = self.local_kvs[key]
+                if self.local_key_versions[key] is not None:
+                    key_times.hist[key] = self.local_key_versions[key]
+                if key in self.per_item_history:
+                    item_history[key] = self.per_item_history[key]
+        return {"items": items, "item-history": item_history, "updated-key-times": key_times}
+
+    def apply_bucket_contents(self, body):
+        items = body["items"]
+        item_hist = {key: wire.to_history(hist) for key, hist in body["item-history"].items()}
+        key_times = wire.to_history(body["updated-key-times"])
+        updated = self.apply_updates(items, item_hist, key_times)
+        # keys without a version (only ever written by a reshard) -- take them if we lack them
+        with self.view_lock.read(), self.key_locks.hold(items):
+            for key, value in items.items():
+                if key not in self.local_kvs and key_times[key] is None:
+                    self.storage.write(key, value, None)
+                    updated.append(key)
+        return updated
+
+    def merkle_ack(self, command, msg):
+        """
+            the other side of anti_entropy()
+        """
+        if self.this_shard is None or msg["address"] not in self.shards[self.this_shard]:
+            return {"error": "Sender not in my shard"}, 404
+        if msg["current_view"] != self.current_view:
+            # one of us is mid view change -- the reshard moves the keys, not us
+            return {"error": "View mismatch"}, 409
+        if msg["depth"] != self.storage.tree.depth:
+            return {"error": "Merkle tree depth mismatch, check MERKLE_DEPTH"}, 400
 
-            # return ack
-            return {
-                "items": {key:value for (key, value) in changed_keys.items()},
-                                    "item-history": {key: HistoryEncoder().encode(per_item_history_for_changed_keys[key])
-                                                     for key in changed_keys},
-                                    "updated-key-times": HistoryEncoder().encode(self.between_gossip_updates),
-                                    "vector-clock": VectorClockEncoder().encode(self.cur_time)
-            }, 200
+        if command == "level":
+            return {"hashes": self.storage.tree.hashes(msg["level"], msg["indexes"])}, 200
 
-        # alternative: return some meaningful response that makes sender update the view,
-        # idk if worth the effort rn, could potentially affect view change
-        #   let it get handled during reshard
-        else:
-            if DEBUG:
-                print("\n\nSender address not in shard", file=sys.stderr)
-                print("Sender address: {}\nMy address: {}\nThe view: {}\n".format(sender_address,environ["ADDRESS"],",".join(self.view)), file=sys.stderr)
-            # return a dummy response
-            return {
-                "items": {},
-                "item-history": {},
-                "updated-key-times": {},
-                "vector-clock": {}
-            }, 404
+        if command == "repair":
+            # reply with what we had before taking theirs -- they already have their own
+            mine = self.bucket_contents(msg["buckets"])
+            self.apply_bucket_contents(msg)
+            return mine, 200
+
+        if command == "pull":
+            # a replica has a GET waiting for these keys (see wait_for_version)
+            return self.key_contents(msg["keys"]), 200
+
+        return {"error": "Unknown command"}, 404
 
 # ------------------------------------------------------------------------------------------------------
 # Liveness threads currently disabled (unneccesarry )and also broken --> request.remote_addr
@@ -624,7 +1526,7 @@ class Node:
         for address in self.replica_alive:
             if self.replica_alive[address] == False:
                 try:
-                    requests.get("http://{}/kvs/liveness".format(address), timeout=TIMEOUT_LENGTH)
+                    self.peers.send("GET", address, "/kvs/liveness", timeout=TIMEOUT_LENGTH)
                 except:
                     None
                 else:
@@ -657,10 +1559,23 @@ class Node:
                         - set high_clock = self.cur_time
                         - set self.per_item_history[key] = client_history
                         - set self.local_key_versions[key] = high_clock
-                        - add key and clock to between_gossip_updates
+                        - queue the key for gossip (record_update)
                         - do client_history.insert(key,local_key_versions[key])
                         - return client_history and high_clock to the client
+                    request IDs:
+                        - the body may carry a client-generated "request-id"
+                        - a PUT whose request ID is still in the window (see remember_request)
+                            isn't written again, the client gets the original answer back
+                        - a proxy gives a PUT without one an ID of its own, so the replicas
+                            it fails over to dedup it too
+                    sessions:
+                        - instead of the causal context the body may carry a "session" token,
+                            the context is then kept by the nodes (see session_request)
                     proxy:
+                        - ONE replica of the key's shard coordinates the write (see
+                            coordinators), the others are only tried, in order, if it
+                            doesn't answer -- every replica writing it would make one
+                            version per replica of a single logical write
                         - these will be useful:
                             - self.shards[self.this_shard] is the list of all node addresses
                                 in this shard
@@ -671,17 +1586,86 @@ class Node:
         # Richard"s Update --- START ---
         # NOTE TO SELF: Returning causal context w/o json.dumps
 
-        # Gets the data
-        args = request.json
+        # Gets the data (JSON or binary, see wire.py)
+        args = wire.request_body()
         # Takes the client"s context and converts it to a dictionary
         # NOTE: Using args vs. request.args
-        causal_context = args["causal-context"]
+        # (session clients send a "session" token instead, see session_request)
+        causal_context = args.get("causal-context") or {}
 
         # Determines which shard the key should be in
         shard_id = self.hash(key)
 
         # Determines if I am a replica of the shard the key is supposed to be in
         if environ["ADDRESS"] in self.shards[shard_id]:
+            if "session" in args:
+                body, status = self.session_request(args["session"], lambda context: self.local_put(
+                    key, args.get("value"), context, args.get("request-id")))
+            else:
+                body, status = self.local_put(key, args.get("value"), causal_context,
+                                              args.get("request-id"))
+            if status == 503 and body.get("error") == NOT_IN_SHARD:
+                # the view changed under the request -- route it again
+                return self.put(key)
+            return body, status
+        else:
+            # Proxies
+            # Question: Client will always send causal-context right? Not checking for empty body currently
+            bad_response = None
+            # forward the raw body so the client's encoding (JSON or binary) and its request ID
+            # are kept -- a write without one gets one here, so a replica we fail over to after a
+            # timeout dedups against the coordinator that may have written it already
+            data = request.get_data()
+            if args.get("request-id") is None:
+                args["request-id"] = uuid.uuid4().hex
+                data = wire.request_like(args)
+            for addr in self.coordinators(shard_id, key):
+                try:
+                    response = self.peers.send("PUT", addr, "/kvs/keys/{}".format(key),
+                                               data=data,
+                                               headers=peers.forward_headers(request.headers),
+                                               timeout=TIMEOUT_LENGTH)
+                except requests.exceptions.RequestException as exception:
+                    # coordinator is down -- fail over to the next replica
+                    timeout_handler(None, exception)
+                    continue
+
+                # Gets the body
+                resp = wire.response_body(response)
+                resp.update({"address": addr})
+
+                # a 4xx would be the same on every replica, only a 5xx is worth another try
+                if response.status_code < 500:
+                    return resp, response.status_code
+                bad_response = (resp, response.status_code)
+
+            # if put couldn't be fulfilled, return why not
+            if bad_response is not None:
+                return bad_response
+
+            # All requests failed
+            # Question: Should we send back the causal context?
+            return {"error": "Unable to satisfy request", "message": "Error in PUT", "causal-context": causal_context}, 503
+
+    def coordinators(self, shard_id, key):
+        """
+        Returns: the replicas of shard_id in the order a PUT of key tries them -- the first
+                 one coordinates the write, the rest are failover
+        """
+        return partitioner.coordinator_order(key, self.shards[shard_id])
+
+    def local_put(self, key, value, causal_context, request_id=None):
+        """
+            put() for a key in my shard -- causal_context is the client's context dict, it's
+            updated in place (decoded History/VectorClocks) and returned in the response
+            request_id is the client's ID for this write (optional), see remember_request
+        """
+        # the key's value, version and history change together, and never halfway through a
+        # view change
+        with self.view_lock.read(), self.key_locks.lock(key):
+            if self.hash(key) != self.this_shard:
+                # a view change came in between (put routes it again)
+                return {"error": NOT_IN_SHARD, "message": "Error in PUT"}, 503
             # Checks if cleint"s causal context includes current view
             if "current_view" in causal_context:
                 # Checks if the client"s current view is the same as ours
@@ -703,40 +1687,38 @@ class Node:
                 return {"error": "Key is too long", "message": "Error in PUT", "causal-context": causal_context}, 400
 
             # Checks if the value is present
-            if args["value"] is None:
+            if value is None:
                 return {"error": "Value is missing", "message": "Error in PUT", "causal-context": causal_context}, 400
 
+            # A retry of a write we (or a replica we gossip with) already did
+            seen = self.seen_requests.get(request_id) if request_id is not None else None
+            if seen is not None and seen[0] == key:
+                return self.replay_put(key, seen, causal_context)
+
             adding = False
             # Determines if we are ADDING or UPDATING
             if key not in self.local_kvs:
                 adding = True
 
             # Adds/Updates the key to our KVS
-            self.local_kvs[key] = args["value"]
+            self.local_kvs[key] = value
 
             # Checks if the client"s causal context includes high clock
             if "high_clock_list" in causal_context and "history" in causal_context:
-                # Decodes History and VectorClock
-                history = json.loads(
-                    causal_context["history"], cls=HistoryDecoder)
-                # Question: I"m not sure if this part is necessary considering we already parsed the JSON so it should"ve converted it to a list for us already?
-                high_clock_list = causal_context["high_clock_list"]
+                # Decodes History and VectorClock (already decoded if the client sent binary)
+                # (and drops what's stable in my shard before it gets copied into per_item_history)
+                history = self.compact_history(wire.to_history(causal_context["history"]))
                 # Decodes each high clock in the high clock list
-                for index, high_clock in enumerate(high_clock_list):
-                    high_clock_list[index] = json.loads(
-                        high_clock, cls=VectorClockDecoder)
+                high_clock_list = [wire.to_clock(high_clock)
+                                   for high_clock in causal_context["high_clock_list"]]
 
-                # Merges our current time with the high clock
-                self.cur_time.merge(high_clock_list[self.this_shard])
+                # Merges our current time with the high clock and increments it, the high clock
+                # becomes our current time (a copy, see tick)
+                high_clock_list[self.this_shard] = self.tick(high_clock_list[self.this_shard])
 
-                # Increments our current time
-                self.cur_time.increment()
-
-                # Sets the high clock to our current time
-                high_clock_list[self.this_shard] = self.cur_time
-
-                # Updates the per item history
-                self.per_item_history[key] = history
+                # Updates the per item history (a copy, so later changes to the client's
+                # history -- e.g. the next key of a batch -- don't leak into it)
+                self.per_item_history[key] = history.copy()
 
                 # Tracks updates
                 self.per_item_history[key].insert(
@@ -745,26 +1727,22 @@ class Node:
                 # Inserts the updated per item history into the client"s history
                 history.merge(self.per_item_history[key])
 
-                # Encodes History and VectorClock before sending back
-                causal_context["history"] = HistoryEncoder().encode(history)
-                causal_context["high_clock_list"] = [VectorClockEncoder().encode(high_clock)
-                                    for high_clock in high_clock_list]
+                # History and VectorClocks get encoded for the client's format on the way out
+                causal_context["history"] = history
+                causal_context["high_clock_list"] = high_clock_list
             else:
-                # Increments our current time
-                self.cur_time.increment()
-
                 # Creates a new high clock list
                 high_clock_list = [None for _ in range(
                     len(self.view) // self.repl_factor)]
 
-                # Sets the new high clock to our current time
-                high_clock_list[self.this_shard] = self.cur_time
+                # Increments our current time, the new high clock is our current time
+                high_clock_list[self.this_shard] = self.tick()
 
                 # Creates a new history
                 history = History()
 
                 # Creates the per item history
-                self.per_item_history[key] = history
+                self.per_item_history[key] = history.copy()
 
                 # Tracks updates
                 self.per_item_history[key].insert(
@@ -773,58 +1751,59 @@ class Node:
                 # Inserts the updated per item history into the client"s history
                 history.merge(self.per_item_history[key])
 
-                # Encodes History and VectorClock before sending back
-                causal_context["history"] = HistoryEncoder().encode(history)
-                causal_context["high_clock_list"] = [VectorClockEncoder().encode(high_clock)
-                                    for high_clock in high_clock_list]
+                # History and VectorClocks get encoded for the client's format on the way out
+                causal_context["history"] = history
+                causal_context["high_clock_list"] = high_clock_list
 
-            
+        
             # Adds key and clock to local key versions
-            self.local_key_versions.insert(key, self.cur_time)
+            version = high_clock_list[self.this_shard]
+            self.local_key_versions.insert(key, version)
+
+            status = 201 if adding else 200
+            # Queues the key for gossip
+            self.record_update(key, request_id, status, version)
+            if request_id is not None:
+                self.remember_request(request_id, key, version, status)
 
-            # Adds key and clock to between gossip updates
-            self.between_gossip_updates.insert(key, self.cur_time)
+            # Makes the write durable before we ack the client
+            self.storage.write(key, value, version, self.per_item_history[key])
+            self.versions_landed([key])
 
             # Replies to the client
             if adding:
                 return {"message": "Added successfully", "replaced": False, "causal-context": causal_context}, 201
             else:
                 return {"message": "Updated successfully", "replaced": True, "causal-context": causal_context}, 200
-        else:
-            # Proxies
-            # Question: Client will always send causal-context right? Not checking for empty body currently
-            resp = [grequests.put("http://{}/kvs/keys/{}".format(addr, key),
-                                  json=request.json,
-                                  headers=dict(request.headers),
-                                  timeout=TIMEOUT_LENGTH)
-                    for addr in self.shards[shard_id]]
-            responses = grequests.map(resp, exception_handler=timeout_handler)
-
-            bad_response = None
-            # Checks for the first valid response
-            for i, response in enumerate(responses):
-                # Skips if timed out
-                if response is None:
-                    continue
-                if response.status_code != 200:
-                    bad_response = response
-                    bad_response.json().update({"address": self.shards[shard_id][i]})
+        # Richard"s Update --- END ---
 
-                # Gets json
-                resp = response.json()
-                resp.update({"address": self.shards[shard_id][i]})
+    def replay_put(self, key, seen, causal_context):
+        """
+            the answer to a retried PUT: no new version, just the client's context brought up
+            to the version the original write made (the same thing local_put handed out)
+        """
+        _, version, status = seen
+        if "high_clock_list" in causal_context and "history" in causal_context:
+            history = self.compact_history(wire.to_history(causal_context["history"]))
+            high_clock_list = [wire.to_clock(high_clock)
+                               for high_clock in causal_context["high_clock_list"]]
+        else:
+            history = History()
+            high_clock_list = [None for _ in range(len(self.view) // self.repl_factor)]
 
-                return resp, response.status_code
+        if version is not None:
+            history.insert(key, version)
+            if high_clock_list[self.this_shard] is None:
+                high_clock_list[self.this_shard] = version.copy()
+            else:
+                high_clock_list[self.this_shard].merge(version)
 
-            # if put couldn't be fulfilled, return why not
-            if bad_response is not None:
-                return bad_response.json(), bad_response.status_code
-            # All requests failed
-            # Question: Should we send back the causal context?
-            return {"error": "Unable to satisfy request", "message": "Error in PUT", "causal-context": causal_context}, 503
-        # Richard"s Update --- END ---
+        causal_context["history"] = history
+        causal_context["high_clock_list"] = high_clock_list
+        if status == 201:
+            return {"message": "Added successfully", "replaced": False, "causal-context": causal_context}, 201
+        return {"message": "Updated successfully", "replaced": True, "causal-context": causal_context}, 200
 
-        
     # -----------------------------------------------------------------------------
     def get(self, key):
         """
@@ -866,143 +1845,736 @@ class Node:
         # we need to take into account that a fresh client will not have any causal-context ==> must check
         # for this to avoid errors being thrown
 
-        args = request.json
-
-        # if no provided causal context, lets make a default one
-
-        context = args["causal-context"]
+        args = wire.request_body()
 
-        # if context is empty -> initialize with empty values
-        if "history" not in context:
-            context = {"high_clock_list": [None for i in range(len(self.view) // self.repl_factor)],
-                       "history": History(),
-                       "current_view": self.current_view}       # might fuck up
-            client_history = context["history"]
-            client_high_clock_list = context["high_clock_list"]
-        else:
-            client_history = json.loads(context["history"], cls=HistoryDecoder)
-            # high_clock must be a list equal to the number of shards in the view
-            client_high_clock_list = context["high_clock_list"]
-            for index, clock in enumerate(client_high_clock_list):
-                client_high_clock_list[index] = json.loads(
-                    clock, cls=VectorClockDecoder)
+        # reads that don't need causal consistency skip the context altogether (see stale_get)
+        try:
+            max_staleness = self.max_staleness(dict(request.args.items(), **args))
+        except ValueError as error:
+            return {"error": str(error), "message": "Error in GET"}, 400
+        if max_staleness is not None:
+            return self.stale_get(key, max_staleness)
 
-        client_view_id = int(context["current_view"])
+        # if no provided causal context, lets make a default one
+        client_history, client_high_clock_list, client_view_id = self.decode_context(
+            args.get("causal-context") or {})
+        # the client may let us wait for its version of the key (see waiting_get)
+        deadline = self.get_deadline(args)
 
         node_id = self.hash(key)
         if environ["ADDRESS"] not in self.shards[node_id]:
-            res = [grequests.get("http://{}/kvs/keys/{}".format(addr, key),
-                                 json=request.json,
-                                 headers=dict(request.headers),
-                                 timeout=TIMEOUT_LENGTH)
-                   for addr in self.shards[node_id]]
-            responses = grequests.map(res, exception_handler=timeout_handler)
-
-            bad_response = None
-            # Checks for the first valid response
-            for i, response in enumerate(responses):
-                # Skips if timed out
-                if response is None:
-                    continue
-                # response was received, but node didn't have the key
-                if response.status_code != 200:
-                    bad_response = response
-                    bad_response.json().update({"address": self.shards[node_id][i]})
-                    continue
-
-                # Gets json
-                resp = response.json()
-                resp.update({"address": self.shards[node_id][i]})
-
+            # forward the raw body so the client's encoding (JSON or binary) is kept
+            # (fastest replica first, hedged -- see hedged_get)
+            response, address = self.hedged_get(self.shards[node_id], "/kvs/keys/{}".format(key),
+                                                timeout=TIMEOUT_LENGTH + max(
+                                                    0, deadline - time.monotonic()),
+                                                data=request.get_data(),
+                                                headers=peers.forward_headers(request.headers))
+
+            # first valid response, or if no node had the key but we still heard from them,
+            # the last error message
+            if response is not None:
+                resp = wire.response_body(response)
+                resp.update({"address": address})
                 return resp, response.status_code
 
-            # if no node had the key, but we still heard from them, return message
-            if bad_response is not None:
-                return bad_response.json(), bad_response.status_code
-
             # All requests failed
-            context = {"high_clock_list": [VectorClockEncoder().encode(clock) for clock in client_high_clock_list],
-                       "history": HistoryEncoder().encode(client_history),
+            context = {"high_clock_list": client_high_clock_list,
+                       "history": client_history,
                        "current_view": client_view_id}
             return {"error": "Unable to satisfy request", "message": "Error in GET", "causal-context": context}, 503
 
-        # Determine if the history of the key is consistent with the client
-        # Compare client"s vc for the key they"re trying to access with ours
-        # Safe to return if VC compare is not -1
-        try:
-            local_vc = self.local_key_versions[key]
-        except:
-            local_vc = None
-        client_vc = client_history[key]
-        compare_val = VectorClock.compare(local_vc, client_vc)
-
-        #
-        # isn"t it safe to return whatever we have if the clocks are concurrent?
-        # pretty sure VectorClock no longer returns CONCURRENT, it has a built-in tie breaker
-        #
-        is_safe = (compare_val == VectorClock.GREATER_THAN or compare_val == VectorClock.EQUAL) or local_vc is None
-
-        new_causal_context = False
-        if client_view_id < self.current_view:
-            # automatically safe to return whatever we have
-            # override comparison from before, and signal to return fresh context
-            is_safe = True
-            new_causal_context = True
-
-        if (is_safe):
-            if new_causal_context:
-                # Client was behind on view change, so give fresh context
-                # return client whatever we"ve seen to this point
-                client_view_id = self.current_view
-                # if we have the key, give them the history of the key
-                # otherwise give blank history object since they"re starting fresh
-                if key in self.local_kvs:
-                    try:
-                        fresh_history = self.per_item_history[key]
-                    except:
+        if "session" in args:
+            body, status = self.session_request(args["session"], lambda context: self.waiting_get(
+                key, *self.decode_context(context), deadline))
+        else:
+            body, status = self.waiting_get(key, client_history, client_high_clock_list,
+                                            client_view_id, deadline)
+        if status == 503 and body.get("error") == NOT_IN_SHARD:
+            # the view changed under the request -- route it again
+            return self.get(key)
+        return body, status
+
+    def stale_get(self, key, max_staleness):
+        """
+            get() without the causal checks: whatever value the replica has, no context needed
+            and none returned, never NACKed
+        Outline:
+            - another shard's key goes to its fastest replica (hedged -- see hedged_get)
+            - if we haven't heard from every other replica of my shard within max_staleness
+              seconds, pull the key from them first (see pull)
+            - answer with the value, how long ago its version was written here ("version-age")
+              and how far behind the other replicas we may be ("replica-lag"), in milliseconds
+              (null if unknown)
+        """
+        node_id = self.hash(key)
+        if environ["ADDRESS"] not in self.shards[node_id]:
+            response, address = self.hedged_get(self.shards[node_id], "/kvs/keys/{}".format(key),
+                                                data=request.get_data(),
+                                                headers=peers.forward_headers(request.headers),
+                                                params=request.args)
+            if response is None:
+                return {"error": "Unable to satisfy request", "message": "Error in GET"}, 503
+            resp = wire.response_body(response)
+            resp.update({"address": address})
+            return resp, response.status_code
+
+        lag = self.replica_lag()
+        if lag > max_staleness:
+            start = time.monotonic()
+            if self.pull(key):
+                # everyone just told us what they have of the key
+                lag = time.monotonic() - start
+
+        def millis(seconds):
+            return None if seconds is None or seconds == float("inf") else round(seconds * 1000)
+
+        with self.view_lock.read(), self.key_locks.lock(key):
+            if key in self.local_kvs:
+                landed = self.landed_at.get(key)
+                return {"message": "Retrieved successfully", "doesExist": True,
+                        "value": self.local_kvs[key],
+                        "version-age": millis(time.monotonic() - landed
+                                              if landed is not None else None),
+                        "replica-lag": millis(lag)}, 200
+        # (it may not be migrated here yet, see retired_get)
+        return self.retired_get(key, {"message": "Error in GET", "error": "Key does not exist",
+                                      "doesExist": False, "replica-lag": millis(lag)}, 404)
+
+    def max_staleness(self, args):
+        """
+        Input:  a GET's request body and query string -- "consistency": "any" reads whatever
+                the replica has, "max-staleness": ms the same, as long as the replica has heard
+                from the other replicas of its shard within the last ms milliseconds
+        Returns: the bound in seconds (inf for "any"), None for a regular (causal) GET
+        """
+        if "max-staleness" in args:
+            try:
+                max_staleness = float(args["max-staleness"]) / 1000
+            except (TypeError, ValueError):
+                max_staleness = -1
+            if not max_staleness >= 0:
+                raise ValueError("max-staleness must be a number of milliseconds")
+            return max_staleness
+        consistency = args.get("consistency", "causal")
+        if consistency == "any":
+            return float("inf")
+        if consistency != "causal":
+            raise ValueError("consistency must be causal or any")
+        return None
+
+    def replica_lag(self):
+        """
+        Returns: how long ago we last gossiped with the replica of my shard we've gone the
+                 longest without (everything it wrote before then is here), in seconds -- inf if
+                 one never answered
+        """
+        with self.view_lock.read():
+            if self.this_shard is None:
+                return float("inf")
+            replicas = [replica for replica in self.shards[self.this_shard]
+                        if replica != environ["ADDRESS"]]
+        now = time.monotonic()
+        return max([now - self.synced_at.get(replica, float("-inf")) for replica in replicas],
+                   default=0)
+
+    def hedged_get(self, replicas, path, timeout=TIMEOUT_LENGTH, **kwargs):
+        """
+        Input:  the replicas of a shard, and the GET to send them (timeout for each request)
+        Outline:
+            - ask the replica with the lowest latency (EWMA) first
+            - if it hasn't answered within its usual (percentile) latency, send one hedged
+              request to the next replica
+            - the first answer is returned as soon as it arrives -- a 404 too: the replica passed
+              the causal check, it would have NACKed (400) if the client had seen a version
+            - a replica that fails, NACKs or answers with a 5xx makes us move on to the next one
+        Returns: (the first answer, its address), else the last NACK/5xx we got, else
+                 (None, None)
+        """
+        replicas = self.latency.order(replicas)
+        answers = gevent.queue.Queue()
+
+        def ask(addr):
+            start = time.monotonic()
+            try:
+                response = self.peers.send("GET", addr, path, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as exception:
+                timeout_handler(None, exception)
+                self.latency.failed(addr, timeout)
+                response = None
+            else:
+                self.latency.record(addr, time.monotonic() - start)
+            answers.put((response, addr))
+
+        gevent.spawn(ask, replicas[0])
+        sent, outstanding, hedged = 1, 1, False
+        bad_response = (None, None)
+        while outstanding:
+            # only wait for the hedge delay while there's still a hedge to send
+            wait = None
+            if not hedged and sent < len(replicas):
+                wait = self.latency.hedge_delay(replicas[sent - 1])
+            try:
+                response, addr = answers.get(timeout=wait)
+            except gevent.queue.Empty:
+                hedged = True
+                gevent.spawn(ask, replicas[sent])
+                sent, outstanding = sent + 1, outstanding + 1
+                continue
+
+            outstanding -= 1
+            if response is not None and response.status_code < 500 and response.status_code != 400:
+                return response, addr
+            if response is not None:
+                bad_response = (response, addr)
+            # nothing useful and nothing else in flight -- try the next replica
+            if outstanding == 0 and sent < len(replicas):
+                gevent.spawn(ask, replicas[sent])
+                sent, outstanding = sent + 1, outstanding + 1
+        return bad_response
+
+    def decode_context(self, context):
+        """
+        Input:  a client's causal context (JSON strings or binary-decoded objects, see wire.py)
+        Returns: (history, high clock list, view ID), fresh ones if the context is empty
+                 -- decoded lazily: the history's clocks as they're looked at (LazyHistory) and
+                 only my shard's high clock, the others stay as they came (use wire.to_clock)
+        """
+        # if context is empty -> initialize with empty values
+        if "history" not in context:
+            return (History(), [None for i in range(len(self.view) // self.repl_factor)],
+                    self.current_view)
+        # high_clock must be a list equal to the number of shards in the view
+        return (wire.lazy_history(context["history"]),
+                [wire.to_clock(clock) if shard_id == self.this_shard else clock
+                 for shard_id, clock in enumerate(context["high_clock_list"])],
+                int(context["current_view"]))
+
+    def local_get(self, key, client_history, client_high_clock_list, client_view_id):
+        """
+            get() for a key in my shard, with the client's decoded context (which gets
+            updated in place)
+        """
+        with self.view_lock.read(), self.key_locks.lock(key):
+            if self.hash(key) != self.this_shard:
+                # a view change came in between (get routes it again)
+                return {"error": NOT_IN_SHARD, "message": "Error in GET"}, 503
+            # Determine if the history of the key is consistent with the client
+            # Compare client"s vc for the key they"re trying to access with ours
+            # Safe to return if VC compare is not -1
+            try:
+                local_vc = self.local_key_versions[key]
+            except:
+                local_vc = None
+            client_vc = client_history[key]
+            compare_val = VectorClock.compare(local_vc, client_vc)
+
+            #
+            # isn"t it safe to return whatever we have if the clocks are concurrent?
+            # pretty sure VectorClock no longer returns CONCURRENT, it has a built-in tie breaker
+            #
+            is_safe = (compare_val == VectorClock.GREATER_THAN or compare_val == VectorClock.EQUAL) or local_vc is None
+
+            new_causal_context = False
+            if client_view_id < self.current_view:
+                # automatically safe to return whatever we have
+                # override comparison from before, and signal to return fresh context
+                is_safe = True
+                new_causal_context = True
+
+            if (is_safe):
+                if new_causal_context:
+                    # Client was behind on view change, so give fresh context
+                    # return client whatever we"ve seen to this point
+                    client_view_id = self.current_view
+                    # if we have the key, give them the history of the key
+                    # otherwise give blank history object since they"re starting fresh
+                    if key in self.local_kvs:
+                        try:
+                            fresh_history = self.per_item_history[key].copy()
+                        except:
+                            fresh_history = History()
+                    else:
                         fresh_history = History()
+                    # the clocks of the old view mean nothing now (and there may be a different
+                    # number of shards), so the high clock list starts over too
+                    new_context = {"high_clock_list": [None for _ in range(
+                                       len(self.view) // self.repl_factor)],
+                                   "history": fresh_history,
+                                   "current_view": client_view_id}
                 else:
-                    fresh_history = History()
-                new_context = {"high_clock_list": [VectorClockEncoder().encode(clock) for clock in client_high_clock_list],
-                               "history": HistoryEncoder().encode(fresh_history),
-                               "current_view": client_view_id}
-            else:
-                # know client is up to date with all causal dependencies
-                # Merge our local vc with client"s just to make sure we"re up to date
-                self.cur_time.merge(client_high_clock_list[self.this_shard])
-                client_high_clock_list[self.this_shard] = self.cur_time
+                    # know client is up to date with all causal dependencies
+                    # Merge our local vc with client"s just to make sure we"re up to date
+                    client_high_clock_list[self.this_shard] = self.observe(
+                        client_high_clock_list[self.this_shard])
+
+                    # set up client"s context object to be up to date with what we know
+                    if key in self.local_kvs:
+                        # per_item_history won't exist after view change --> key error
+                        try:
+                            grew = client_history.merge(self.per_item_history[key])
+                        except:
+                            grew = False
+                        # only a history that grew needs compacting (looking at every entry would
+                        # decode all of them, see LazyHistory)
+                        if grew:
+                            self.compact_history(client_history)
+
+                    # finally return the key the client asked for, with updated clock and history for client
+                    # (encoded for the client's format on the way out, see wire.py)
+                    new_context = {"high_clock_list": client_high_clock_list,
+                                   "history": client_history,
+                                   "current_view": client_view_id}
 
-                # set up client"s context object to be up to date with what we know
                 if key in self.local_kvs:
-                    # per_item_history won't exist after view change --> key error
-                    try:
-                        client_history.merge(self.per_item_history[key])
-                    except:
-                        pass
+                    return {"message": "Retrieved successfully", "doesExist": True, "value": self.local_kvs[key],
+                            "causal-context": new_context}, 200
+                else:
+                    # Because we checked it"s safe to ack client, we can be sure the key hasn"t been inserted yet
+                    return {"message": "Error in GET", "error": "Key does not exist", "doesExist": False,
+                            "causal-context": new_context}, 404
 
-                # finally return the key the client asked for, with updated clock and history for client
+            else:
+                # NACK
+                # Possible to attempt gossip here
+                # Want to make sure regular get works first, then can add gossip optimization
                 #
-                # changed to json.dumps() because had error for no fp with json.dump()
-                new_context = {"high_clock_list": [VectorClockEncoder().encode(clock) for clock in client_high_clock_list],
-                               "history": HistoryEncoder().encode(client_history),
-                               "current_view": client_view_id}
+                # Austin requested we update our high_clock on failed requests just to keep most current time
+                self.observe(client_high_clock_list[self.this_shard])
+                return {"error": "Unable to satisfy request", "message": "Error in GET"}, 400
 
-            if key in self.local_kvs:
-                return {"message": "Retrieved successfully", "doesExist": True, "value": self.local_kvs[key],
-                        "causal-context": new_context}, 200
+    # Blocking GET: instead of NACKing a client whose context has a newer version of the key
+    # than we do, park the request until the version gets here -- pull the key from the other
+    # replicas of my shard right away (and again every PULL_INTERVAL), and also wake up as soon
+    # as gossip or anti-entropy brings a new version of it. Bounded by the client's "wait".
+
+    def get_deadline(self, args):
+        """
+        Input:  a GET's request body -- "wait" is how many seconds the client lets us wait for
+                its version of the key (GET_WAIT if it doesn't say, at most MAX_GET_WAIT)
+        Returns: the time.monotonic() until which the GET may wait
+        """
+        try:
+            wait = float(args.get("wait", self.get_wait))
+        except (TypeError, ValueError):
+            wait = 0
+        return time.monotonic() + max(0, min(wait, self.max_get_wait))
+
+    def waiting_get(self, key, client_history, client_high_clock_list, client_view_id, deadline):
+        """
+            local_get(), but if we don't have the client's version of the key yet, wait for it
+            until deadline (see wait_for_version) before giving up with a 400
+            -- same for a 404 when the client has seen a version of the key in this view
+            (any other 404 may be a key that isn't migrated here yet, see retired_get)
+        """
+        body, status = self.local_get(key, client_history, client_high_clock_list,
+                                      client_view_id)
+        if status not in (400, 404):
+            return body, status
+        client_vc = client_history[key]
+        if client_vc is None or client_view_id != self.current_view:
+            # nothing to wait for -- but the key may still be in the old view
+            if status == 404:
+                return self.retired_get(key, body, status)
+            return body, status
+        if time.monotonic() >= deadline:
+            return body, status
+        # no locks held while we wait
+        self.wait_for_version(key, client_vc, deadline)
+        return self.local_get(key, client_history, client_high_clock_list, client_view_id)
+
+    def has_version(self, key, clock):
+        """
+        Returns: True if our version of key is clock or newer
+        """
+        local_vc = self.local_key_versions[key]
+        return local_vc is not None and VectorClock.compare(local_vc, clock) in (
+            VectorClock.GREATER_THAN, VectorClock.EQUAL)
+
+    def wait_for_version(self, key, clock, deadline):
+        """
+        Outline:
+            - ask the other replicas of my shard for key (pull)
+            - wait for a new version of key to land here, from anywhere, but no longer than
+              PULL_INTERVAL -- then pull again
+            - until we have clock's version of key (or a newer one), or the deadline passes
+        Returns: True if we have it
+        """
+        arrived = threading.Event()
+        with self.update_lock:
+            self.version_waiters.setdefault(key, set()).add(arrived)
+        try:
+            while not self.has_version(key, clock):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                arrived.clear()
+                if self.pull(key, clock, min(remaining, TIMEOUT_LENGTH)):
+                    return True
+                # nobody had it (yet) -- it may be on its way to us or to them
+                arrived.wait(max(0, min(deadline - time.monotonic(), PULL_INTERVAL)))
+            return True
+        finally:
+            with self.update_lock:
+                waiters = self.version_waiters[key]
+                waiters.discard(arrived)
+                if not waiters:
+                    del self.version_waiters[key]
+
+    def pull(self, key, clock=None, timeout=TIMEOUT_LENGTH):
+        """
+            ask every other replica of my shard for key at once, taking whatever version is
+            newer than ours (the "pull" command of the Merkle endpoint)
+        Returns: with a clock, True as soon as we have its version of key (or a newer one)
+                 without, True once every replica has answered
+        """
+        with self.view_lock.read():
+            if self.this_shard is None:
+                return False
+            replicas = [replica for replica in self.shards[self.this_shard]
+                        if replica != environ["ADDRESS"]]
+        pulls = [gevent.spawn(self.merkle_request, replica, "pull", {"keys": [key]}, timeout)
+                 for replica in replicas]
+        answered = 0
+        try:
+            for done in gevent.iwait(pulls):
+                if done.value is not None:
+                    self.apply_bucket_contents(done.value)
+                    answered += 1
+                    if clock is not None and self.has_version(key, clock):
+                        return True
+            return clock is None and answered == len(replicas)
+        finally:
+            gevent.killall(pulls, block=False)
+
+    def versions_landed(self, keys):
+        """
+            new versions of these keys were just written here -- note when (see stale_get) and
+            wake the GETs waiting for one
+        """
+        now = time.monotonic()
+        for key in keys:
+            self.landed_at[key] = now
+        if not self.version_waiters:
+            return
+        with self.update_lock:
+            for key in keys:
+                for arrived in self.version_waiters.get(key, ()):
+                    arrived.set()
+
+########## SESSIONS ################################################################################
+
+    def session_request(self, token, op):
+        """
+            run op(causal context) with the context of the client's session (see sessions.py)
+            instead of one the client sent, write what it changed through to the session's
+            owner, and answer with the next token instead of the context
+        """
+        try:
+            session_id, view, version = sessions.parse_token(token)
+        except ValueError:
+            return {"error": "Invalid session token", "message": "Error in session"}, 400
+
+        if session_id is None:
+            session_id, context = sessions.new_session_id(), {}
+        else:
+            found = self.load_session(session_id, version)
+            if found is not None:
+                version, context = found
+            elif view < self.current_view:
+                # the session is from an older view -- its context would have been thrown
+                # away anyway (like a stale causal-context), so start over
+                version, context = 0, {}
             else:
-                # Because we checked it"s safe to ack client, we can be sure the key hasn"t been inserted yet
-                return {"message": "Error in GET", "error": "Key does not exist", "doesExist": False,
-                        "causal-context": new_context}, 404
+                return {"error": "Session context unavailable", "message": "Error in session"}, 503
+
+        before = sessions.snapshot(context)
+        body, status = op(context)
+        new_context = body.pop("causal-context", None)
+        delta = sessions.context_delta(before, new_context) \
+            if new_context is not None and "history" in new_context else None
+        if delta is not None:
+            new_version = self.store_session(session_id, version, delta, new_context)
+            if new_version is None:
+                # the request went through but the owner didn't take the new context -- hand
+                # it to the client instead, so it can carry on without a session
+                body["causal-context"] = new_context
+                body.update({"error": "Session context unavailable", "message": "Error in session"})
+                return body, 503
+            if new_version == version + 1:
+                # nothing else of the session happened in between, so this is that version
+                self.sessions.put(session_id, new_version, new_context)
+            version = new_version
+
+        body["session"] = sessions.make_token(session_id, self.current_view, version)
+        return body, status
+
+    def session_owners(self, session_id):
+        # the session id is placed like a key, the first replica in the order owns it
+        return partitioner.coordinator_order(session_id, self.shards[self.hash(session_id)])
+
+    def load_session(self, session_id, version):
+        """
+        Returns: (version, context) of the session, at least as new as version -- from my
+                 store if I have that, otherwise from the owner (or its replicas), None if
+                 nobody does
+        """
+        found = self.sessions.get(session_id)
+        if found is not None and found[0] >= version:
+            return found
+        for addr in self.session_owners(session_id):
+            if addr == environ["ADDRESS"]:
+                continue
+            try:
+                response = self.peers.send("GET", addr, "/kvs/session/{}".format(session_id),
+                                           headers=wire.BINARY_HEADERS, timeout=TIMEOUT_LENGTH)
+            except requests.exceptions.RequestException as exception:
+                timeout_handler(None, exception)
+                continue
+            if response.status_code != 200:
+                continue
+            body = wire.response_body(response)
+            if body["version"] >= version:
+                self.sessions.put(session_id, body["version"], body["context"])
+                return self.sessions.get(session_id)
+        return None
 
+    def store_session(self, session_id, base, delta, context):
+        """
+            write a request's delta through to the session's owner (the next replica of the
+            owner shard if it's down)
+        Returns: the session's new version, None if no owner took it
+        """
+        for addr in self.session_owners(session_id):
+            if addr == environ["ADDRESS"]:
+                version = self.apply_session(session_id, delta, base, context)
+                if version is not None:
+                    return version
+                continue
+            msg = {"delta": delta, "base": base}
+            try:
+                response = self.peers.send("PUT", addr, "/kvs/session/{}".format(session_id),
+                                           data=wire.dumps(msg), headers=wire.BINARY_HEADERS,
+                                           timeout=TIMEOUT_LENGTH)
+                if response.status_code == 409:
+                    # it's behind the version we started from (e.g. it just took over from
+                    # the owner) -- send it the whole context instead
+                    msg = {"context": context, "base": base}
+                    response = self.peers.send("PUT", addr, "/kvs/session/{}".format(session_id),
+                                               data=wire.dumps(msg), headers=wire.BINARY_HEADERS,
+                                               timeout=TIMEOUT_LENGTH)
+            except requests.exceptions.RequestException as exception:
+                timeout_handler(None, exception)
+                continue
+            if response.status_code == 200:
+                return wire.response_body(response)["version"]
+        return None
+
+    def apply_session(self, session_id, delta, base, context=None):
+        """
+            owner side: merge a delta (or take a whole context) and copy the result to the
+            other replicas of my shard
+        """
+        version = self.sessions.apply(session_id, delta, base) if delta is not None else None
+        if version is None:
+            if context is None:
+                return None
+            version = base + 1
+            self.sessions.put(session_id, version, context)
+        found = self.sessions.get(session_id)
+        if found is not None:
+            msg = wire.dumps({"replica": True, "version": found[0], "context": found[1]})
+            for replica in self.shards[self.this_shard]:
+                if replica != environ["ADDRESS"]:
+                    gevent.spawn(self.send_session_copy, replica, session_id, msg)
+        return version
+
+    def send_session_copy(self, replica, session_id, msg):
+        try:
+            self.peers.send("PUT", replica, "/kvs/session/{}".format(session_id),
+                            data=msg, headers=wire.BINARY_HEADERS, timeout=TIMEOUT_LENGTH)
+        except requests.exceptions.RequestException as exception:
+            # it'll get the next version, or the node that needs it asks the owner
+            timeout_handler(None, exception)
+
+    def session_ack(self, method, session_id, msg):
+        """
+            /kvs/session/<id>:  GET --> {"version", "context"}
+                                PUT --> {"delta", "base"} / {"context", "base"} from a node that
+                                        ran a request of the session, or {"replica", "version",
+                                        "context"} from the owner
+        """
+        if method == "GET":
+            found = self.sessions.get(session_id)
+            if found is None:
+                return {"error": "Unknown session"}, 404
+            return {"version": found[0], "context": found[1]}, 200
+        if msg.get("replica"):
+            self.sessions.put(session_id, msg["version"], msg["context"])
+            return {"version": msg["version"]}, 200
+        version = self.apply_session(session_id, msg.get("delta"), msg["base"], msg.get("context"))
+        if version is None:
+            return {"error": "Session is behind", "base": msg["base"]}, 409
+        return {"version": version}, 200
+
+########## BATCH ###################################################################################
+
+    def batch(self, command):
+        """
+        Input:  GET --> {"keys": [key, ...], "causal-context": context}
+                PUT --> {"puts": {key: value, ...}, "causal-context": context}
+                ("forwarded": true marks a sub-batch sent by another node, it's never forwarded again)
+                a PUT may carry a "request-id" -- each key is written with "<request-id>/<key>" as
+                its request ID, so retrying the whole batch doesn't write anything twice
+                a "session" token may stand in for the causal context (see session_request)
+                a GET may carry a "wait" -- the keys it's waiting for share it (see waiting_get)
+        Outline:
+            - group the keys by shard (Node.hash)
+            - send one sub-batch to every other shard involved, all in parallel (failing over to
+              the shard's next replica if one doesn't answer)
+            - meanwhile do my own shard's keys, one after the other with the same context
+            - merge every shard's context into one for the client
+        Returns:
+            {"results": {key: {"status": code, ...same body /kvs/keys/<key> would give...}},
+             "causal-context": merged context}
+        """
+        args = wire.request_body()
+        if "session" in args:
+            return self.session_request(args["session"],
+                                        lambda context: self.run_batch(command, args, context))
+        return self.run_batch(command, args, args.get("causal-context") or {})
+
+    def run_batch(self, command, args, context):
+        if command == "put":
+            entries = args.get("puts") or {}
         else:
-            # NACK
-            # Possible to attempt gossip here
-            # Want to make sure regular get works first, then can add gossip optimization
-            #
-            # Austin requested we update our high_clock on failed requests just to keep most current time
-            self.cur_time.merge(client_high_clock_list[self.this_shard])
-            return {"error": "Unable to satisfy request", "message": "Error in GET"}, 400
+            entries = {key: None for key in args.get("keys") or []}
+
+        # one deadline for every key the batch waits for (see waiting_get)
+        deadline = self.get_deadline(args) if command == "get" else time.monotonic()
+
+        groups = {}                 # {shard_id : [keys]}
+        for key in entries:
+            groups.setdefault(self.hash(key), []).append(key)
+        my_keys = groups.pop(self.this_shard, [])
+
+        results = {}
+        if args.get("forwarded"):
+            # the sender's view says these are mine -- don't bounce them around
+            for keys in groups.values():
+                for key in keys:
+                    results[key] = {"status": 503, "error": NOT_IN_SHARD,
+                                    "message": "Error in batch"}
+            groups = {}
+
+        # encode the sub-batches before my keys change the context, then send them off
+        pending = None
+        if groups:
+            messages = {}
+            for shard_id, keys in groups.items():
+                sub_batch = {"causal-context": context, "forwarded": True}
+                if command == "put":
+                    sub_batch["puts"] = {key: entries[key] for key in keys}
+                    sub_batch["request-id"] = args.get("request-id")
+                else:
+                    sub_batch["keys"] = keys
+                    sub_batch["wait"] = max(0, deadline - time.monotonic())
+                messages[shard_id] = wire.dumps(sub_batch)
+            pending = gevent.spawn(self.send_sub_batches, command, messages,
+                                   TIMEOUT_LENGTH + max(0, deadline - time.monotonic()))
+
+        contexts = []
+        if my_keys:
+            if command == "put":
+                for key in my_keys:
+                    # local_put updates context in place
+                    body, status = self.local_put(key, entries[key], context,
+                                                  "{}/{}".format(args["request-id"], key)
+                                                  if args.get("request-id") is not None else None)
+                    body.pop("causal-context", None)
+                    body["status"] = status
+                    results[key] = body
+                contexts.append(context)
+            else:
+                history, high_clock_list, view_id = self.decode_context(context)
+                for key in my_keys:
+                    body, status = self.waiting_get(key, history, high_clock_list, view_id,
+                                                    deadline)
+                    new_context = body.pop("causal-context", None)
+                    if new_context is not None:
+                        history = new_context["history"]
+                        high_clock_list = new_context["high_clock_list"]
+                        view_id = new_context["current_view"]
+                    body["status"] = status
+                    results[key] = body
+                contexts.append({"history": history, "high_clock_list": high_clock_list,
+                                 "current_view": view_id})
+
+        responses = pending.get() if pending is not None else {}
+        for shard_id, keys in groups.items():
+            if shard_id not in responses:
+                for key in keys:
+                    results[key] = {"status": 503, "error": "Unable to satisfy request",
+                                    "message": "Error in batch"}
+                continue
+            body, address = responses[shard_id]
+            for key, result in body["results"].items():
+                result["address"] = address
+                results[key] = result
+            contexts.append(body["causal-context"])
+
+        return {"results": results,
+                "causal-context": self.merge_contexts(contexts) if contexts else context}, 200
+
+    def send_sub_batches(self, command, messages, timeout=TIMEOUT_LENGTH):
+        """
+        Input:  {shard_id : encoded sub-batch} (and the timeout for each one)
+        Returns: {shard_id : (decoded response, address that answered)} for every shard that did
+        """
+        responses = {}
+        remaining = dict(messages)
+        for attempt in range(self.repl_factor):
+            if not remaining:
+                break
+            shard_ids = list(remaining)
+            rs = [self.peers.request(command.upper(), self.shards[shard_id][attempt], "/kvs/batch",
+                                     data=remaining[shard_id], headers=wire.BINARY_HEADERS,
+                                     timeout=timeout)
+                  for shard_id in shard_ids]
+            for shard_id, response in zip(shard_ids, grequests.map(rs, exception_handler=timeout_handler)):
+                if response is not None and response.status_code == 200:
+                    responses[shard_id] = (wire.response_body(response),
+                                           self.shards[shard_id][attempt])
+                    del remaining[shard_id]
+        return responses
+
+    def merge_contexts(self, contexts):
+        """
+        Input:  causal contexts handed out for different parts of one batch
+        Returns: one context that has seen everything any of them has (only contexts from the
+                 newest view count -- older ones were reset anyway)
+        """
+        view_id = max(int(context["current_view"]) for context in contexts)
+        history = History()
+        high_clock_list = None
+        for context in contexts:
+            if int(context["current_view"]) != view_id or "history" not in context:
+                continue
+            hist, clocks, _ = self.decode_context(context)
+            history.merge(hist)
+            if high_clock_list is None:
+                high_clock_list = [None] * len(clocks)
+            for i, clock in enumerate(clocks):
+                clock = wire.to_clock(clock)
+                if clock is None:
+                    continue
+                if high_clock_list[i] is None:
+                    high_clock_list[i] = clock.copy()
+                else:
+                    high_clock_list[i].merge(clock)
+        if high_clock_list is None:
+            return {"current_view": view_id}
+        return {"high_clock_list": high_clock_list, "history": history, "current_view": view_id}
 
     # ------------------------------------------------------------------------------
     """
@@ -1041,8 +2613,8 @@ class Node:
     def get_shard_info(self, shard_id):
         # forward message to the appropriate node
         if shard_id != self.this_shard:
-            msgs = [grequests.get("http://{}/kvs/shards/{}".format(addr, shard_id),
-                                  headers=dict(request.headers), timeout=TIMEOUT_LENGTH)
+            msgs = [self.peers.get(addr, "/kvs/shards/{}".format(shard_id),
+                                   headers=peers.forward_headers(request.headers), timeout=TIMEOUT_LENGTH)
                     for addr in self.shards[shard_id]]
             responses = grequests.map(msgs, exception_handler=timeout_handler)
 
@@ -1059,6 +2631,28 @@ class Node:
                 "key-count": len(self.local_kvs),
                 "replicas": self.shards[self.this_shard]}, 200
 
+    def topology(self):
+        """
+        Returns: everything a client needs to send a key straight to its shard -- the view, its
+                 shards, repl_factor, routing settings (partitioner, hash, vnodes) and the
+                 view's epoch (current_view, which goes up with every view change) -- and the
+                 old shards still being migrated after an online view change
+        """
+        return {"message": "Topology retrieved successfully",
+                "current_view": self.current_view,
+                "view": self.view,
+                "repl_factor": self.repl_factor,
+                "shards": self.shards,
+                "routing": self.routing,
+                "migrating": sorted(self.migrating)}, 200
+
+    def connection_stats(self):
+        """
+            how well the keep-alive pools to other nodes are being reused
+        """
+        return {"pool-size": self.peers.pool_size, "peers": self.peers.stats(),
+                "latency": self.latency.stats(), "reshard-throttle": self.throttle.stats()}, 200
+
     def get_all_shard_IDs(self):
         return {"message": "Shard membership retrieved successfully",
                 "shards": [shard_id for shard_id in range(len(self.shards))]}, 200
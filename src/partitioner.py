@@ -0,0 +1,195 @@
+"""
+    Partitioners -- decide which shard a key lives on
+
+    All of them map a key to a shard ID in range(num_shards), and every node has to use the
+    same partitioner (PARTITIONER / VNODES must match across the view) or they won't agree on
+    where keys go.
+
+        mod         md5(key) % num_shards -- the original placement. Changing the number of
+                    shards moves almost every key.
+
+        ring        consistent-hash ring: every shard owns VNODES points on a ring of md5
+                    values, and a key belongs to the first point clockwise from md5(key).
+                    Going from N to N+1 shards only moves ~1/(N+1) of the keys (the ones
+                    the new shard's points land in front of).
+
+        rendezvous  highest random weight: a key belongs to the shard with the largest
+                    md5("shard-id:key"). Same ~1/(N+1) movement with no ring to build, but
+                    every lookup hashes the key once per shard.
+
+    The hash underneath (md5 above) can be swapped for blake2b with an 8 byte digest, which
+    skips md5's hexdigest -> 128 bit int round trip. The partitioner, hash and vnodes are
+    the view's "routing" settings: the reshard leader sends them with the new view and
+    every node logs them with the view, so the whole view always agrees on placement.
+
+    RoutingTable puts a bounded LRU cache of key -> shard ID in front of a partitioner.
+
+    coordinator_order picks which replica of the shard coordinates a write of a key -- nodes
+    proxying a PUT and clients routing it themselves (tests/client.py) use the same order.
+"""
+import bisect
+import hashlib
+from collections import OrderedDict
+
+MOD = "mod"
+RING = "ring"
+RENDEZVOUS = "rendezvous"
+
+MD5 = "md5"
+BLAKE2B = "blake2b"
+
+DEFAULT_VNODES = 128
+DEFAULT_CACHE_SIZE = 65536
+
+
+def md5_int(string):
+    # encode(utf8) -> unicode objects must be encoded before hashing
+    return int(hashlib.md5(string.encode("utf-8")).hexdigest(), 16)
+
+
+def blake2b_int(string):
+    return int.from_bytes(hashlib.blake2b(string.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+HASHES = {MD5: md5_int, BLAKE2B: blake2b_int}
+
+
+def get_hash(hash_name):
+    if hash_name not in HASHES:
+        raise ValueError("Unknown hash: {}".format(hash_name))
+    return HASHES[hash_name]
+
+
+class ModPartitioner:
+    name = MOD
+
+    def __init__(self, num_shards, hash_name=MD5):
+        self.num_shards = num_shards
+        self.hash_name = hash_name
+        self.hash_fn = get_hash(hash_name)
+
+    def shard(self, key):
+        return self.hash_fn(key) % self.num_shards
+
+
+class RingPartitioner:
+    name = RING
+
+    def __init__(self, num_shards, vnodes=DEFAULT_VNODES, hash_name=MD5):
+        self.num_shards = num_shards
+        self.vnodes = vnodes
+        self.hash_name = hash_name
+        self.hash_fn = get_hash(hash_name)
+        # points[i] is owned by owners[i]; both sorted by position on the ring
+        ring = sorted((self.hash_fn("shard-{}-vnode-{}".format(shard_id, vnode)), shard_id)
+                      for shard_id in range(num_shards) for vnode in range(vnodes))
+        self.points = [point for point, _ in ring]
+        self.owners = [shard_id for _, shard_id in ring]
+
+    def shard(self, key):
+        i = bisect.bisect(self.points, self.hash_fn(key))
+        # wrap around past the last point
+        if i == len(self.points):
+            i = 0
+        return self.owners[i]
+
+
+class RendezvousPartitioner:
+    name = RENDEZVOUS
+
+    def __init__(self, num_shards, hash_name=MD5):
+        self.num_shards = num_shards
+        self.hash_name = hash_name
+        self.hash_fn = get_hash(hash_name)
+
+    def shard(self, key):
+        best_shard, best_weight = 0, -1
+        hash_fn = self.hash_fn
+        for shard_id in range(self.num_shards):
+            weight = hash_fn("{}:{}".format(shard_id, key))
+            if weight > best_weight:
+                best_shard, best_weight = shard_id, weight
+        return best_shard
+
+
+def make_partitioner(name, num_shards, vnodes=DEFAULT_VNODES, hash_name=MD5):
+    if name == MOD:
+        return ModPartitioner(num_shards, hash_name)
+    if name == RING:
+        return RingPartitioner(num_shards, vnodes, hash_name)
+    if name == RENDEZVOUS:
+        return RendezvousPartitioner(num_shards, hash_name)
+    raise ValueError("Unknown partitioner: {}".format(name))
+
+
+def routing_from_environ(environ):
+    """
+    PARTITIONER     - mod | ring | rendezvous (default mod)
+    HASH            - md5 | blake2b (default md5)
+    VNODES          - points per shard on the ring (default 128)
+
+    Returns:
+        the routing settings {"partitioner", "hash", "vnodes"} that get recorded with a view
+    """
+    routing = {"partitioner": environ.get("PARTITIONER", MOD),
+               "hash": environ.get("HASH", MD5),
+               "vnodes": int(environ.get("VNODES", DEFAULT_VNODES))}
+    # fail at startup rather than on the first request
+    make_partitioner(routing["partitioner"], 1, 1, routing["hash"])
+    return routing
+
+
+def from_routing(routing, num_shards):
+    return make_partitioner(routing["partitioner"], num_shards,
+                            int(routing.get("vnodes", DEFAULT_VNODES)), routing.get("hash", MD5))
+
+
+def coordinator_order(key, replicas):
+    """
+    Returns: replicas in the order a write of key tries them -- the first one coordinates the
+             write, the rest are failover
+    """
+    # the same key always starts at the same replica (so writes to one key meet there),
+    # different keys spread over the shard -- salted so the start doesn't line up with the
+    # hash that picked the shard
+    start = md5_int("coordinator:" + key) % len(replicas)
+    return replicas[start:] + replicas[:start]
+
+
+class RoutingTable:
+    """
+    key -> shard ID, cached
+
+    API:
+        shard(key):             shard ID for key (from the cache if we've routed it recently)
+
+        reset(partitioner):     switch to a new partitioner (new view) and drop the cache
+
+    The cache is an LRU bounded at cache_size keys, so hot keys skip hashing entirely.
+    """
+
+    def __init__(self, partitioner=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.partitioner = partitioner
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def reset(self, partitioner):
+        self.partitioner = partitioner
+        self.cache = OrderedDict()
+
+    def shard(self, key):
+        cache = self.cache
+        shard_id = cache.get(key)
+        if shard_id is not None:
+            try:
+                cache.move_to_end(key)
+            except KeyError:
+                # evicted by another request in between, the answer is still right
+                pass
+            return shard_id
+        shard_id = self.partitioner.shard(key)
+        if self.cache_size > 0:
+            cache[key] = shard_id
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return shard_id
@@ -0,0 +1,102 @@
+"""
+    Pooled, keep-alive HTTP sessions for node-to-node traffic
+
+    A bare grequests.get/put makes a brand new requests.Session -- and so a new TCP connection
+    -- for every request. PeerPool keeps one Session per peer instead, each with its own
+    urllib3 connection pool, and every outbound call in node.py goes through it.
+
+    API:
+        get(addr, path, **kwargs) / put(...):
+                                    an unsent grequests request to http://addr/path on addr's
+                                    session (for grequests.map)
+
+        send(method, addr, path, **kwargs):
+                                    send a request right away, returns the requests.Response
+
+        stats():                    per-peer requests sent / connections opened / reuse
+"""
+import threading
+import grequests
+import requests
+from requests.adapters import HTTPAdapter
+
+# hop-by-hop headers (plus the ones that belong to the original connection) that must not
+# be copied onto a proxied request, or e.g. a client's "Connection: close" would kill a
+# pooled connection
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "te",
+              "trailer", "upgrade", "host", "content-length"}
+
+
+def forward_headers(headers):
+    """
+        headers of an incoming request, safe to send on a pooled connection to another node
+    """
+    return {name: value for name, value in dict(headers).items()
+            if name.lower() not in HOP_BY_HOP}
+
+
+class PeerPool:
+    def __init__(self, pool_size=10, pool_block=False, retries=0):
+        self.pool_size = pool_size      # max idle keep-alive connections kept per peer
+        self.pool_block = pool_block    # wait for a free connection instead of opening more
+        self.retries = retries          # connection retries (reads are never retried)
+        self.sessions = {}              # {addr : requests.Session}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        POOL_SIZE       - keep-alive connections per peer (default 10)
+        POOL_BLOCK      - 1 => block when all of a peer's connections are busy (default 0)
+        POOL_RETRIES    - retries for failed connection attempts (default 0)
+        """
+        return cls(int(environ.get("POOL_SIZE", 10)),
+                   environ.get("POOL_BLOCK", "0") == "1",
+                   int(environ.get("POOL_RETRIES", 0)))
+
+    def session(self, addr):
+        session = self.sessions.get(addr)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(addr)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                          pool_block=self.pool_block, max_retries=self.retries)
+                    session.mount("http://", adapter)
+                    self.sessions[addr] = session
+        return session
+
+    def request(self, method, addr, path, **kwargs):
+        return grequests.AsyncRequest(method, "http://{}{}".format(addr, path),
+                                      session=self.session(addr), **kwargs)
+
+    def get(self, addr, path, **kwargs):
+        return self.request("GET", addr, path, **kwargs)
+
+    def put(self, addr, path, **kwargs):
+        return self.request("PUT", addr, path, **kwargs)
+
+    def send(self, method, addr, path, **kwargs):
+        return self.session(addr).request(method, "http://{}{}".format(addr, path), **kwargs)
+
+    def stats(self):
+        """
+        Returns: {addr : {"requests", "connections", "reused", "reuse-ratio"}}
+                 (connections = TCP connections opened, reused = requests that didn't need one)
+        """
+        stats = {}
+        for addr, session in list(self.sessions.items()):
+            num_requests, num_connections = 0, 0
+            adapter = session.get_adapter("http://")
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+            stats[addr] = {"requests": num_requests, "connections": num_connections,
+                           "reused": num_requests - num_connections,
+                           "reuse-ratio": round((num_requests - num_connections) / num_requests, 3)
+                           if num_requests else 0.0}
+        return stats
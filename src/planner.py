@@ -0,0 +1,63 @@
+"""
+    Reshard planning -- which keys have to move from which node to which when the view changes
+
+    A key of old shard o that the new view places on shard n only has to go to the replicas of
+    n that weren't replicas of o: the others had it in the old view and keep it. The one
+    exception is a replica whose copy turned out to be older than the shard's newest version
+    of a key when the old shard merged its replicas' copies (see Node.migrate) -- it gets that
+    key sent again. Keys never move between nodes that both keep them, and nothing goes to a
+    node that doesn't need anything (no empty fragments).
+
+    A plan is {destination: [keys]} for one old shard, sent by whichever of its replicas runs
+    the migration. A dry run (PUT /kvs/view-change?dry-run=1) makes one per old shard from its
+    leader's copy and reports them, nothing moves.
+
+    API:
+        shards_of(view, repl_factor):       a view's shards, as Node.set_shards_and_view lays
+                                            them out
+        moves(old_replicas, new_shards, placements, stale=None):
+                                            the plan of one old shard
+        summary(source, plan, size):        [{"from", "to", "keys", "bytes"}] of a plan
+        entry_bytes(key, value):            what a key counts for in "bytes"
+"""
+
+
+def shards_of(view, repl_factor):
+    """
+    Input:  the addresses of a view (any order) and its replication factor
+    Returns: shards[i][j] = address of replica j of shard i
+    """
+    view = sorted(view)
+    return [view[start:start + repl_factor]
+            for start in range(0, len(view) // repl_factor * repl_factor, repl_factor)]
+
+
+def moves(old_replicas, new_shards, placements, stale=None):
+    """
+    Input:  the replicas of the old shard, the new view's shards, (key, new shard ID) of every
+            key of the old shard, and {replica : keys its copy doesn't have the newest version
+            of} if the copies were compared (a replica missing from it counts as up to date)
+    Returns: {destination : [keys]}, only destinations that get something
+    """
+    old_replicas = set(old_replicas)
+    stale = stale or {}
+    plan = {}
+    for key, new_id in placements:
+        for replica in new_shards[new_id]:
+            if replica not in old_replicas or key in stale.get(replica, ()):
+                plan.setdefault(replica, []).append(key)
+    return plan
+
+
+def entry_bytes(key, value):
+    return len(key.encode("utf-8")) + (len(value.encode("utf-8")) if isinstance(value, str) else 0)
+
+
+def summary(source, plan, size):
+    """
+    Input:  the node sending the plan's keys, the plan, and size(key) -> bytes of a key
+    Returns: a list of {"from", "to", "keys", "bytes"}, one per destination
+    """
+    return [{"from": source, "to": destination, "keys": len(keys),
+             "bytes": sum(size(key) for key in keys)}
+            for destination, keys in sorted(plan.items())]
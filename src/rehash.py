@@ -0,0 +1,86 @@
+"""
+    Parallel rehash -- the shard of every key of a large store under a new view, worked out by
+    a pool of processes instead of one loop in the node
+
+    Only the keys go to the workers (split into one slice per worker); each worker builds the
+    view's partitioner from its routing settings and sends back the shard IDs of its slice as
+    a compact array. The node then builds the fragments from those, so the values never leave
+    it. The pool uses "spawn" (forking a process that runs gevent and a few threads isn't
+    safe), is started the first time it's needed and kept for the next view change.
+
+    Below min_keys keys, or with fewer than two workers, it's the one loop as before -- the
+    pool costs more than it saves on a small store.
+
+    API:
+        Rehasher(workers, min_keys):
+            from_environ(environ)
+            shards(keys, partitioner, routing):    shard ID of every key, in keys order
+            close()
+"""
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import partitioner as partitioners
+
+DEFAULT_MIN_KEYS = 100000
+
+# partitioners workers have built, by routing settings -- a ring is worth keeping around
+_partitioners = {}
+
+
+def shard_slice(routing, num_shards, keys):
+    """
+        (in a worker) shard IDs of a slice of keys
+    """
+    settings = (routing["partitioner"], routing.get("hash"), routing.get("vnodes"), num_shards)
+    if settings not in _partitioners:
+        _partitioners[settings] = partitioners.from_routing(routing, num_shards)
+    shard = _partitioners[settings].shard
+    return array("H", [shard(key) for key in keys])
+
+
+class Rehasher:
+    def __init__(self, workers=None, min_keys=DEFAULT_MIN_KEYS):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.min_keys = min_keys
+        self.pool = None
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        REHASH_WORKERS      - processes that rehash a large store (default: one per core)
+        REHASH_MIN_KEYS     - smallest store that gets rehashed in parallel (default 100000)
+        """
+        workers = environ.get("REHASH_WORKERS")
+        return cls(int(workers) if workers is not None else None,
+                   int(environ.get("REHASH_MIN_KEYS", DEFAULT_MIN_KEYS)))
+
+    def parallel(self, num_keys):
+        return self.workers > 1 and num_keys >= self.min_keys
+
+    def shards(self, keys, partitioner, routing):
+        """
+        Input:  a list of keys, the new view's partitioner and its routing settings (what the
+                workers build the same partitioner from)
+        Returns: the shard ID of every key, in keys order
+        """
+        if not self.parallel(len(keys)):
+            shard = partitioner.shard
+            return [shard(key) for key in keys]
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+        size = -(-len(keys) // self.workers)
+        futures = [self.pool.submit(shard_slice, routing, partitioner.num_shards,
+                                    keys[start:start + size])
+                   for start in range(0, len(keys), size)]
+        shard_ids = array("H")
+        for future in futures:
+            shard_ids.extend(future.result())
+        return shard_ids
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
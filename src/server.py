@@ -0,0 +1,126 @@
+"""
+    Production HTTP server for a node
+
+    Serves the Flask app on gevent's WSGI server: every connection is handled by a
+    greenlet from a bounded pool, with HTTP/1.1 keep-alive and an idle timeout between
+    requests. On SIGTERM/SIGINT the server stops accepting connections, lets the requests in
+    flight finish (up to SHUTDOWN_TIMEOUT seconds) and then closes the node -- gossip stops
+    and the write-ahead log is flushed.
+
+    A node's state lives in its one process, so there are no worker processes: WORKERS is
+    the number of connections served at once. gevent.monkey.patch_all() must have run before
+    flask/requests/grequests were imported (see the top of app.py).
+
+    API:
+        Server.from_environ(app, environ):  a Server configured from the environment
+        serve(node):                        serve until SIGTERM/SIGINT, then node.close()
+"""
+import sys
+import signal
+import socket
+import gevent
+import gevent.pool
+from gevent.pywsgi import WSGIServer, WSGIHandler
+
+
+class KeepAliveHandler(WSGIHandler):
+    """
+        pywsgi's handler with an idle timeout on keep-alive connections: a client that
+        doesn't send its next request within keepalive seconds is disconnected, so idle
+        connections don't hold on to the pool. keepalive 0 closes every connection after
+        one response.
+    """
+
+    def handle(self):
+        # pywsgi writes the headers and the body separately -- without NODELAY the body waits
+        # for the client's delayed ACK (~40ms) on every keep-alive request
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return super().handle()
+
+    def read_requestline(self):
+        if self.server.closed:
+            # shutting down -- finish the response we sent and hang up
+            return None
+        # let the other connections have a turn before this one's next request, it may
+        # already be buffered and would then be served without ever yielding
+        gevent.sleep(0)
+        self.socket.settimeout(self.server.keepalive or None)
+        # waiting for the next request, Server.stop() may hang up on us
+        self.server.idle.add(gevent.getcurrent())
+        try:
+            # a timeout here is a socket.error, which closes the connection
+            return super().read_requestline()
+        finally:
+            self.server.idle.discard(gevent.getcurrent())
+            if self.socket is not None:
+                self.socket.settimeout(None)
+
+    def start_response(self, status, headers, exc_info=None):
+        if not self.server.keepalive:
+            # tells the client, and pywsgi, to close the connection after this response
+            headers = list(headers) + [("Connection", "close")]
+        return super().start_response(status, headers, exc_info)
+
+
+class Server:
+    def __init__(self, app, host="0.0.0.0", port=13800, mode="gevent", workers=1000,
+                 backlog=1024, keepalive=75, shutdown_timeout=10, access_log=False):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.mode = mode                        # "gevent" or "dev" (Flask's server)
+        self.workers = workers                  # connections served at once
+        self.backlog = backlog                  # listen() backlog
+        self.keepalive = keepalive              # idle seconds before a connection is closed
+        self.shutdown_timeout = shutdown_timeout
+        self.access_log = access_log            # log every request to stderr
+        self.server = None
+
+    @classmethod
+    def from_environ(cls, app, environ):
+        """
+        HOST                - address to listen on (default 0.0.0.0)
+        PORT                - port to listen on (default 13800)
+        SERVER              - gevent (default) or dev -- Flask's threaded development server,
+                              for debugging and comparison (tests/server_bench.py)
+        WORKERS             - connections served at once (default 1000)
+        BACKLOG             - listen backlog (default 1024)
+        KEEPALIVE           - seconds an idle keep-alive connection is kept open, 0 disables
+                              keep-alive (default 75)
+        SHUTDOWN_TIMEOUT    - seconds requests in flight get to finish on shutdown (default 10)
+        ACCESS_LOG          - 1 => log every request (default 0)
+        """
+        return cls(app, environ.get("HOST", "0.0.0.0"), int(environ.get("PORT", 13800)),
+                   environ.get("SERVER", "gevent"), int(environ.get("WORKERS", 1000)),
+                   int(environ.get("BACKLOG", 1024)), float(environ.get("KEEPALIVE", 75)),
+                   float(environ.get("SHUTDOWN_TIMEOUT", 10)),
+                   environ.get("ACCESS_LOG", "0") == "1")
+
+    def serve(self, node=None):
+        if self.mode == "dev":
+            self.app.run(host=self.host, port=self.port, threaded=True)
+            return
+
+        self.server = WSGIServer((self.host, self.port), self.app, backlog=self.backlog,
+                                 spawn=gevent.pool.Pool(self.workers),
+                                 handler_class=KeepAliveHandler,
+                                 log=sys.stderr if self.access_log else None)
+        self.server.keepalive = self.keepalive
+        self.server.idle = set()        # handlers waiting for a keep-alive request
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            gevent.signal_handler(signum, self.stop)
+        print("Serving on {}:{} (workers {}, backlog {}, keep-alive {}s)".format(
+            self.host, self.port, self.workers, self.backlog, self.keepalive), file=sys.stderr)
+        self.server.serve_forever(stop_timeout=self.shutdown_timeout)
+        if node is not None:
+            node.close()
+        print("Stopped", file=sys.stderr)
+
+    def stop(self):
+        # stop accepting, then wait for the requests in flight -- serve() returns after this
+        if self.server is not None and not self.server.closed:
+            print("Shutting down", file=sys.stderr)
+            self.server.close()
+            # idle keep-alive connections would otherwise hold up the shutdown until timeout
+            gevent.killall(list(self.server.idle), block=False)
+            self.server.stop(timeout=self.shutdown_timeout)
@@ -0,0 +1,177 @@
+"""
+    Server-side causal sessions
+
+    Instead of shipping its causal context with every request, a client may send a session
+    token ("session" in the body, "" to start one) and the nodes keep the context for it:
+
+        token:      "<session id>:<view>:<version>" -- opaque to the client, it just sends
+                    back the last one it got
+
+        owner:      the session id is placed like a key (Node.hash), and the first replica of
+                    that shard in partitioner.coordinator_order owns it. Every request's change
+                    to the context is written through to the owner as a delta, which bumps the
+                    version; the owner copies the result to the other replicas of its shard.
+
+        caching:    every node keeps the sessions it has seen in a SessionStore too. A token's
+                    version says how new a context the client depends on, so a node only asks
+                    the owner when its own copy is older than that.
+
+    A delta only holds what a request changed: the history entries it added, the ones
+    compaction dropped (see Node.compact_history) and the high clock list.
+"""
+import uuid
+import threading
+from collections import OrderedDict
+from history import History
+import wire
+
+DEFAULT_CAPACITY = 100000
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def parse_token(token):
+    """
+    Returns: (session id, view, version), (None, None, 0) for "start a new session"
+    Raises:  ValueError for anything that isn't a token
+    """
+    if not token:
+        return None, None, 0
+    session_id, view, version = str(token).rsplit(":", 2)
+    return session_id, int(view), int(version)
+
+
+def make_token(session_id, view, version):
+    return "{}:{}:{}".format(session_id, view, version)
+
+
+def copy_context(context):
+    """
+        a decoded copy of a causal context that later requests can change without touching
+        this one (requests update their context's history and clocks in place)
+    """
+    if "history" not in context:
+        return dict(context)
+    return {"history": wire.to_history(context["history"]).copy(),
+            "high_clock_list": [clock.copy() if clock is not None else None
+                                for clock in (wire.to_clock(clock)
+                                              for clock in context["high_clock_list"])],
+            "current_view": int(context["current_view"])}
+
+
+def snapshot(context):
+    """
+        what a request's context looked like before it ran -- compared with the result by
+        context_delta
+    """
+    if "history" not in context:
+        return {}, []
+    return dict(context["history"].items()), [clock.copy() if clock is not None else None
+                                              for clock in context["high_clock_list"]]
+
+
+def context_delta(before, after):
+    """
+    Input:  snapshot() of a context before a request, the context the request handed out
+    Returns: {"history", "drop", "high_clock_list", "current_view"} -- new/changed entries,
+             entries that went away, and the clocks -- or None if nothing changed
+    """
+    entries, clocks = before
+    history = History()
+    drop = History()
+    for key, clock in after["history"].items():
+        # inserts/merges always put in a new clock object, so identity says what changed
+        if key not in entries or entries[key] is not clock:
+            history.hist[key] = clock
+    for key, clock in entries.items():
+        if key not in after["history"].hist:
+            drop.hist[key] = clock
+    high_clock_list = list(after["high_clock_list"])
+    if not history.hist and not drop.hist and len(clocks) == len(high_clock_list) and all(
+            (old is None and new is None) or (old is not None and new is not None and
+                                              old.addrs == new.addrs and old.times == new.times)
+            for old, new in zip(clocks, high_clock_list)):
+        return None
+    return {"history": history, "drop": drop, "high_clock_list": high_clock_list,
+            "current_view": int(after["current_view"])}
+
+
+class SessionStore:
+    """
+    API:
+        get(session_id):                (version, copy of the context) or None
+
+        put(session_id, version, context):
+                                        keep a copy of a context, unless we have a newer one
+
+        apply(session_id, delta, base): merge a request's delta into the session (owner only)
+                                        returns the new version, or None if our copy is older
+                                        than base (the version the request started from)
+
+    Bounded at capacity sessions, least recently used go first.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.sessions = OrderedDict()       # {session id : (version, context)}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        SESSIONS    - causal sessions a node keeps (default 100000)
+        """
+        return cls(int(environ.get("SESSIONS", DEFAULT_CAPACITY)))
+
+    def store(self, session_id, version, context):
+        self.sessions[session_id] = (version, context)
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.capacity:
+            self.sessions.popitem(last=False)
+
+    def get(self, session_id):
+        with self.lock:
+            found = self.sessions.get(session_id)
+            if found is None:
+                return None
+            self.sessions.move_to_end(session_id)
+            return found[0], copy_context(found[1])
+
+    def put(self, session_id, version, context):
+        with self.lock:
+            found = self.sessions.get(session_id)
+            if found is None or found[0] < version:
+                self.store(session_id, version, copy_context(context))
+
+    def apply(self, session_id, delta, base):
+        with self.lock:
+            version, context = self.sessions.get(session_id, (0, {}))
+            if version < base:
+                return None
+            view = delta["current_view"]
+            if "history" not in context or context["current_view"] < view:
+                # new session, or the request ran in a newer view -- the old context is gone
+                context = {"history": History(),
+                           "high_clock_list": [None] * len(delta["high_clock_list"]),
+                           "current_view": view}
+            if context["current_view"] == view:
+                history = context["history"]
+                for key, clock in wire.to_history(delta["drop"]).items():
+                    # unless another request of the session has put in something newer since
+                    if key in history.hist and (clock is None or clock.dominates(history[key])):
+                        del history.hist[key]
+                history.merge(wire.to_history(delta["history"]))
+                high_clock_list = context["high_clock_list"]
+                for i, clock in enumerate(delta["high_clock_list"]):
+                    clock = wire.to_clock(clock)
+                    if clock is None:
+                        continue
+                    if high_clock_list[i] is None:
+                        high_clock_list[i] = clock.copy()
+                    else:
+                        high_clock_list[i].merge(clock)
+            version += 1
+            self.store(session_id, version, context)
+            return version
@@ -0,0 +1,170 @@
+"""
+    Point-in-time snapshot files of a node's memtable
+
+    Layout (all integers big-endian):
+
+        header:     magic "KVSSNAP1" | lsn (u64) | view (u32 len + json)
+        addresses:  count (u32) | count x (u16 len + utf8 addr)
+        entries:    count (u32) | count x entry
+
+        entry:      key (u16 len + utf8) | value (u32 len + json)
+                    | version (clock) | item history (history)
+        clock:      n (u8, 0xFF = None) | home addr index (u32) | n x (addr index (u32), time (u64))
+        history:    n (u32, 0xFFFFFFFF = None) | n x (key (u16 len + utf8), clock)
+
+    Every address shows up once in the address table and clocks refer to it by index, which
+    keeps snapshots small even though every clock carries "ip:port" strings.
+"""
+import os
+import json
+import mmap
+import struct
+from vector_clock import VectorClock
+from history import History
+
+MAGIC = b"KVSSNAP1"
+
+U8 = struct.Struct("!B")
+U16 = struct.Struct("!H")
+U32 = struct.Struct("!I")
+U64 = struct.Struct("!Q")
+CLOCK_ENTRY = struct.Struct("!IQ")
+
+NO_CLOCK = 0xFF
+NO_HISTORY = 0xFFFFFFFF
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self.addr_index = {}
+        self.addrs = []
+
+    def index(self, addr):
+        if addr not in self.addr_index:
+            self.addr_index[addr] = len(self.addrs)
+            self.addrs.append(addr)
+        return self.addr_index[addr]
+
+    def pack_str(self, string, size):
+        data = string.encode("utf-8")
+        return size.pack(len(data)) + data
+
+    def pack_clock(self, clock):
+        if clock is None:
+            return U8.pack(NO_CLOCK)
+        parts = [U8.pack(len(clock)), U32.pack(self.index(clock.addr))]
+        for addr, time in clock.items():
+            parts.append(CLOCK_ENTRY.pack(self.index(addr), time))
+        return b"".join(parts)
+
+    def pack_history(self, hist):
+        if hist is None:
+            return U32.pack(NO_HISTORY)
+        parts = [U32.pack(len(hist.hist))]
+        for key, clock in hist.items():
+            parts.append(self.pack_str(key, U16))
+            parts.append(self.pack_clock(clock))
+        return b"".join(parts)
+
+    def write(self, path, lsn, view_record, kvs, versions, item_history):
+        """
+            writes the snapshot to <path>.tmp and atomically renames it over <path>
+        """
+        # entries have to be packed first so the address table is complete
+        body = []
+        for key, value in kvs:
+            body.append(self.pack_str(key, U16))
+            body.append(self.pack_str(json.dumps(value), U32))
+            body.append(self.pack_clock(versions.get(key)))
+            body.append(self.pack_history(item_history.get(key)))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as snap:
+            snap.write(MAGIC)
+            snap.write(U64.pack(lsn))
+            snap.write(self.pack_str(json.dumps(view_record), U32))
+            snap.write(U32.pack(len(self.addrs)))
+            for addr in self.addrs:
+                snap.write(self.pack_str(str(addr), U16))
+            snap.write(U32.pack(len(kvs)))
+            snap.write(b"".join(body))
+            snap.flush()
+            os.fsync(snap.fileno())
+        os.replace(tmp_path, path)
+
+
+class SnapshotReader:
+    """
+        mmaps a snapshot file and decodes it straight out of the mapping
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def unpack(self, fmt):
+        value = fmt.unpack_from(self.buf, self.offset)
+        self.offset += fmt.size
+        return value[0] if len(value) == 1 else value
+
+    def unpack_str(self, size):
+        length = self.unpack(size)
+        string = str(self.buf[self.offset:self.offset + length], "utf-8")
+        self.offset += length
+        return string
+
+    def unpack_clock(self):
+        n = self.unpack(U8)
+        if n == NO_CLOCK:
+            return None
+        home = self.addrs[self.unpack(U32)]
+        pairs = []
+        for _ in range(n):
+            addr, time = self.unpack(CLOCK_ENTRY)
+            pairs.append((self.addrs[addr], time))
+        return VectorClock.from_items(home, pairs)
+
+    def unpack_history(self):
+        n = self.unpack(U32)
+        if n == NO_HISTORY:
+            return None
+        hist = History()
+        for _ in range(n):
+            key = self.unpack_str(U16)
+            hist.hist[key] = self.unpack_clock()
+        return hist
+
+    def read(self):
+        """
+        Returns:
+            (lsn, view_record, kvs, versions, item_history)
+        """
+        with open(self.path, "rb") as snap:
+            with mmap.mmap(snap.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                self.buf = memoryview(mapped)
+                try:
+                    return self.decode()
+                finally:
+                    self.buf.release()
+
+    def decode(self):
+        if bytes(self.buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError("{} is not a snapshot file".format(self.path))
+        self.offset = len(MAGIC)
+        lsn = self.unpack(U64)
+        view_record = json.loads(self.unpack_str(U32))
+        self.addrs = [self.unpack_str(U16) for _ in range(self.unpack(U32))]
+
+        kvs = {}
+        versions = History()
+        item_history = {}
+        for _ in range(self.unpack(U32)):
+            key = self.unpack_str(U16)
+            kvs[key] = json.loads(self.unpack_str(U32))
+            clock = self.unpack_clock()
+            if clock is not None:
+                versions.hist[key] = clock
+            hist = self.unpack_history()
+            if hist is not None:
+                item_history[key] = hist
+        return lsn, view_record, kvs, versions, item_history
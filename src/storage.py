@@ -0,0 +1,311 @@
+"""
+    Storage engine used by a Node to hold its keys, versions and per-item histories
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import threading
+from vector_clock import VectorClockEncoder, VectorClockDecoder
+from history import History, HistoryDecoder, HistoryEncoder
+from snapshot import SnapshotReader, SnapshotWriter
+from merkle import MerkleTree, DEFAULT_DEPTH
+
+
+# fsync policies for the write-ahead log
+FSYNC_ALWAYS = "always"         # fsync after every record (safest, slowest)
+FSYNC_INTERVAL = "interval"     # fsync at most once every fsync_interval seconds
+FSYNC_NEVER = "never"           # leave it up to the OS
+
+# log record types
+OP_PUT = "put"                  # a single key was written
+OP_VIEW = "view"                # the node moved to a new view
+
+
+class WriteAheadLog:
+    """
+    Append-only log of framed records, each stamped with the next log sequence number
+    ("lsn"), stored on disk as:
+
+            | length (4 bytes) | crc32 (4 bytes) | json payload (length bytes) |
+
+    API:
+        append(record):     append a dict to the end of the log (honours the fsync policy)
+
+        replay():           yield every intact record from the beginning of the log
+                            (including a segment retired by rotate() that was never
+                            dropped); a torn record at the tail (crash mid-write) is
+                            truncated away
+
+        rotate(on_rotate):  retire the current segment and start a new one, calling
+                            on_rotate() while no appends can happen
+
+        drop_retired():     delete the segment retired by rotate()
+
+        sync():             force everything written so far to disk
+
+        close():            sync and close the log file
+    """
+
+    HEADER = struct.Struct("!II")
+
+    def __init__(self, path, fsync_policy=FSYNC_INTERVAL, fsync_interval=1.0):
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError("Unknown fsync policy: {}".format(fsync_policy))
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+        self.lsn = 0                    # lsn of the last record appended/replayed
+        self.file = open(self.path, "ab")
+
+    @staticmethod
+    def frame(record):
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        return WriteAheadLog.HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def append(self, record):
+        with self.lock:
+            self.lsn += 1
+            record["lsn"] = self.lsn
+            self.file.write(self.frame(record))
+            self.file.flush()
+            if self.fsync_policy == FSYNC_ALWAYS:
+                os.fsync(self.file.fileno())
+            elif self.fsync_policy == FSYNC_INTERVAL:
+                now = time.monotonic()
+                if now - self.last_sync >= self.fsync_interval:
+                    os.fsync(self.file.fileno())
+                    self.last_sync = now
+
+    def replay(self):
+        with self.lock:
+            self.file.flush()
+            if os.path.exists(self.path + ".old"):
+                for record in self.read_segment(self.path + ".old"):
+                    yield record
+
+            good_bytes = 0
+            with open(self.path, "rb") as log:
+                while True:
+                    header = log.read(self.HEADER.size)
+                    if len(header) < self.HEADER.size:
+                        break
+                    length, crc = self.HEADER.unpack(header)
+                    payload = log.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    good_bytes += self.HEADER.size + length
+                    yield json.loads(payload.decode("utf-8"))
+
+            # anything past the last intact record is garbage from a crash
+            if good_bytes != os.path.getsize(self.path):
+                print("Truncating torn write-ahead log tail at byte {}".format(good_bytes),
+                      file=sys.stderr)
+                self.file.truncate(good_bytes)
+
+    def read_segment(self, path):
+        with open(path, "rb") as log:
+            while True:
+                header = log.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    return
+                length, crc = self.HEADER.unpack(header)
+                payload = log.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                yield json.loads(payload.decode("utf-8"))
+
+    def rotate(self, on_rotate):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            if os.path.exists(self.path + ".old"):
+                # the previous snapshot never finished -- keep both segments' records
+                with open(self.path + ".old", "ab") as old, open(self.path, "rb") as cur:
+                    old.write(cur.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.path + ".old")
+            self.file = open(self.path, "ab")
+            self.last_sync = time.monotonic()
+            return on_rotate()
+
+    def drop_retired(self):
+        if os.path.exists(self.path + ".old"):
+            os.remove(self.path + ".old")
+
+    def sync(self):
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class StorageEngine:
+    """
+    The memtable of a node (kvs, versions and per-item histories), optionally backed by a
+    WriteAheadLog and periodic snapshots so that a restarted node can serve reads without
+    re-pulling its shard.
+
+    Every logged record carries a log sequence number (lsn). A snapshot remembers the lsn it
+    covers, so recovery loads the snapshot and only replays the log tail after it.
+
+    API:
+        write(key, value, clock, history):  put a key in the memtable and log it
+
+        log_view(view, repl_factor, current_view, routing):
+                                            remember the view we moved to (and how it
+                                            places keys)
+
+        snapshot():                         write a point-in-time snapshot and drop the
+                                            log segment it covers
+
+        maybe_snapshot():                   snapshot if enough records were logged since
+                                            the last one (called from the gossip timer)
+
+        checkpoint():                       used after resharding replaces the memtable --
+                                            rebuilds the Merkle tree, then snapshot()
+
+        recover():                          load the snapshot + replay the log tail into the
+                                            memtable, returns the last view record seen (or None)
+
+    Without a log every call except the memtable updates is a no-op, which is exactly
+    the old in-memory behaviour.
+
+    The memtable also keeps a MerkleTree (see merkle.py) over its keys and versions for
+    anti-entropy repair. write() keeps it up to date; anything that replaces the memtable
+    wholesale has to call checkpoint() afterwards.
+    """
+
+    def __init__(self, log=None, snapshot_path=None, snapshot_every=100000,
+                 merkle_depth=DEFAULT_DEPTH):
+        self.log = log
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every    # records between periodic snapshots
+        self.tree = MerkleTree(merkle_depth)
+
+        # memtable ###########################################################
+        self.kvs = {}                   # {key : value}
+        self.versions = History()       # {key : VectorClock}
+        self.item_history = {}          # {key : History}
+        ######################################################################
+
+        self.view_record = None         # last view record logged/replayed
+        self.snapshot_lsn = 0           # lsn covered by the last snapshot
+        self.snapshot_lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        STORAGE_DIR     - directory for the write-ahead log and snapshots (unset => memory only)
+        WAL_FSYNC       - always | interval | never (default interval)
+        WAL_FSYNC_INTERVAL - seconds between fsyncs for the interval policy (default 1)
+        SNAPSHOT_EVERY  - number of logged records between snapshots (default 100000)
+        MERKLE_DEPTH    - depth of the anti-entropy Merkle tree, same on every node (default 10)
+        """
+        merkle_depth = int(environ.get("MERKLE_DEPTH", DEFAULT_DEPTH))
+        if not environ.get("STORAGE_DIR"):
+            return cls(merkle_depth=merkle_depth)
+        os.makedirs(environ["STORAGE_DIR"], exist_ok=True)
+        log = WriteAheadLog(os.path.join(environ["STORAGE_DIR"], "kvs.wal"),
+                            environ.get("WAL_FSYNC", FSYNC_INTERVAL),
+                            float(environ.get("WAL_FSYNC_INTERVAL", 1.0)))
+        return cls(log, os.path.join(environ["STORAGE_DIR"], "kvs.snap"),
+                   int(environ.get("SNAPSHOT_EVERY", 100000)), merkle_depth)
+
+    # record encoding _____________________________________________________
+    @staticmethod
+    def put_record(key, value, clock, history):
+        return {"op": OP_PUT, "key": key, "value": value,
+                "clock": VectorClockEncoder().encode(clock),
+                "history": HistoryEncoder().encode(history) if history is not None else None}
+
+    def apply(self, record):
+        """
+            replay a single log record into the memtable
+        """
+        if record["op"] == OP_PUT:
+            key = record["key"]
+            self.kvs[key] = record["value"]
+            clock = json.loads(record["clock"], cls=VectorClockDecoder)
+            if clock is not None:
+                self.versions.hist[key] = clock
+            if record["history"] is not None:
+                self.item_history[key] = json.loads(record["history"], cls=HistoryDecoder)
+        elif record["op"] == OP_VIEW:
+            self.view_record = record
+    # _____________________________________________________________________
+
+    def write(self, key, value, clock, history=None):
+        self.kvs[key] = value
+        # callers update versions before writing, so hash what the memtable now holds
+        self.tree.update(key, value, self.versions[key])
+        if self.log is not None:
+            self.log.append(self.put_record(key, value, clock, history))
+
+    def log_view(self, view, repl_factor, current_view, routing=None):
+        self.view_record = {"op": OP_VIEW, "view": ",".join(view),
+                            "repl_factor": repl_factor, "current_view": current_view,
+                            "routing": routing}
+        if self.log is not None:
+            self.log.append(dict(self.view_record))
+
+    def snapshot(self):
+        if self.log is None:
+            return
+        with self.snapshot_lock:
+            # copy the memtable while no records can be appended -- everything up to
+            # the captured lsn is in the copy, everything after goes to the new segment
+            def capture():
+                return (self.log.lsn, dict(self.view_record or {}), list(self.kvs.items()),
+                        dict(self.versions.hist), dict(self.item_history))
+            lsn, view_record, kvs, versions, item_history = self.log.rotate(capture)
+
+            SnapshotWriter().write(self.snapshot_path, lsn, view_record,
+                                   kvs, versions, item_history)
+            self.log.drop_retired()
+            self.snapshot_lsn = lsn
+
+    def maybe_snapshot(self):
+        if self.log is not None and self.log.lsn - self.snapshot_lsn >= self.snapshot_every:
+            self.snapshot()
+
+    def checkpoint(self):
+        self.tree.rebuild(self.kvs, self.versions)
+        self.snapshot()
+
+    def recover(self):
+        if self.log is None:
+            return None
+        start = time.monotonic()
+        if os.path.exists(self.snapshot_path):
+            (self.snapshot_lsn, view_record, self.kvs,
+             self.versions, self.item_history) = SnapshotReader(self.snapshot_path).read()
+            self.view_record = view_record or None
+            self.log.lsn = self.snapshot_lsn
+
+        count = 0
+        for record in self.log.replay():
+            # records older than the snapshot are already in the memtable
+            if record["lsn"] <= self.snapshot_lsn:
+                continue
+            self.apply(record)
+            self.log.lsn = record["lsn"]
+            count += 1
+        print("Loaded snapshot at lsn {} and replayed {} log records ({} keys) in {:.3f}s".format(
+            self.snapshot_lsn, count, len(self.kvs), time.monotonic() - start), file=sys.stderr)
+        self.tree.rebuild(self.kvs, self.versions)
+        return self.view_record
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
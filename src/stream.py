@@ -0,0 +1,73 @@
+"""
+    Streamed reshard transfers -- a shard's (or fragment's) keys go over the wire as a stream
+    of bounded-size chunks instead of one body, so neither side ever has the whole transfer
+    serialized in memory, and the receiver applies each chunk as it arrives
+
+    Layout (a chunked HTTP body, Content-Type application/x-kvs-stream):
+
+        stream:     frame*
+        frame:      length (u32, big-endian) | wire.dumps(chunk)    -- chunk is a dict
+
+    Flow control is TCP's: the sender only builds the next chunk once the last one was
+    written to the socket, and the receiver only reads the next one once it has applied the
+    last, so a slow receiver slows the sender down instead of piling chunks up in memory.
+
+    API:
+        split(items, chunk_bytes):  groups (key, value) pairs into dicts of about chunk_bytes
+        frames(chunks):             encodes dicts for a request/response body (a generator)
+        read_frames(stream):        decodes them again from a file-like object as they arrive
+"""
+import struct
+import wire
+
+STREAM_MIMETYPE = "application/x-kvs-stream"
+STREAM_HEADERS = {"Content-Type": STREAM_MIMETYPE, "Accept": STREAM_MIMETYPE}
+
+DEFAULT_CHUNK_BYTES = 256 * 1024
+
+FRAME = struct.Struct("!I")
+# what a key costs in a chunk on top of its key and value (tags, lengths, its clock if any)
+ENTRY_OVERHEAD = 32
+
+
+def split(items, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    chunk, size = {}, 0
+    for key, value in items:
+        chunk[key] = value
+        size += len(key) + (len(value) if isinstance(value, str) else 0) + ENTRY_OVERHEAD
+        if size >= chunk_bytes:
+            yield chunk
+            chunk, size = {}, 0
+    if chunk:
+        yield chunk
+
+
+def frames(chunks):
+    for chunk in chunks:
+        data = wire.dumps(chunk)
+        yield FRAME.pack(len(data)) + data
+
+
+def read_exactly(stream, size):
+    parts, got = [], 0
+    while got < size:
+        more = stream.read(size - got)
+        if not more:
+            break
+        parts.append(more)
+        got += len(more)
+    return b"".join(parts)
+
+
+def read_frames(stream):
+    while True:
+        header = read_exactly(stream, FRAME.size)
+        if not header:
+            return
+        if len(header) < FRAME.size:
+            raise ValueError("Stream ended in the middle of a frame")
+        length = FRAME.unpack(header)[0]
+        data = read_exactly(stream, length)
+        if len(data) < length:
+            raise ValueError("Stream ended in the middle of a frame")
+        yield wire.loads(data)
@@ -0,0 +1,122 @@
+"""
+    Reshard traffic throttling -- token buckets that pace the streams a view change sends, so
+    they don't take all of a link and starve client requests on the same nodes
+
+    A node has one bucket for all the reshard traffic it sends (rate) and one per peer host it
+    sends to (peer_rate, or a rate of its own for a host in peer_rates). Every frame of a
+    reshard stream (see stream.py) takes its size in tokens from both before it goes out; if
+    there aren't enough it waits for them. Buckets refill at their rate up to burst bytes, and
+    a frame bigger than what's left borrows ahead (the bucket goes negative) instead of waiting
+    for a burst it could never get. A rate of 0 means no limit.
+
+    Peers are counted by host, not address: several nodes on one machine share its link.
+
+    What's throttled: fragments and migrated keys (Node.send_payload), and the kvs a replica
+    hands its old shard's leader (get_keys, get_retired). Client traffic never is.
+
+    API:
+        TokenBucket(rate, burst):
+            take(n):                wait until n tokens are there, take them -- returns the
+                                    seconds it waited
+        Throttle(rate, peer_rate, burst, peer_rates):
+            from_environ(environ)
+            frames(peer, frames):   the frames (bytes), each after it got its tokens
+            stats():                {"seconds", "bytes", "rate", "peer-rate", "peers"} -- the
+                                    seconds spent waiting and bytes sent since the node started
+"""
+import time
+import threading
+
+
+def host_of(address):
+    """
+        the host part of a node address ("10.10.0.2:13800" -> "10.10.0.2")
+    """
+    return address.rsplit(":", 1)[0] if ":" in address else address
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate                # bytes per second, 0 = no limit
+        self.burst = burst or rate      # most tokens it holds (default: a second's worth)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # take them now (maybe going negative) -- whoever comes next waits behind us
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            # (a greenlet sleep, the server is monkey-patched)
+            time.sleep(wait)
+        return wait
+
+
+class Throttle:
+    def __init__(self, rate=0, peer_rate=0, burst=None, peer_rates=None):
+        self.rate = rate
+        self.peer_rate = peer_rate
+        self.burst = burst
+        self.peer_rates = dict(peer_rates or {})   # {host : bytes per second}
+        self.bucket = TokenBucket(rate, burst)
+        self.peer_buckets = {}                      # {host : TokenBucket}
+        self.waited = 0.0
+        self.sent = 0
+        self.peer_waited = {}                       # {host : seconds}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, environ):
+        """
+        RESHARD_RATE        - bytes/s of reshard traffic a node sends in all (default 0, no limit)
+        RESHARD_PEER_RATE   - bytes/s of reshard traffic a node sends to any one peer host
+                              (default 0, no limit)
+        RESHARD_PEER_RATES  - rates of their own for some peers, "host=bytes/s,host=bytes/s"
+        RESHARD_BURST       - bytes a bucket can save up (default: a second's worth of its rate)
+        """
+        peer_rates = {}
+        for entry in environ.get("RESHARD_PEER_RATES", "").split(","):
+            if entry.strip():
+                host, rate = entry.split("=")
+                peer_rates[host_of(host.strip())] = float(rate)
+        burst = environ.get("RESHARD_BURST")
+        return cls(float(environ.get("RESHARD_RATE", 0)),
+                   float(environ.get("RESHARD_PEER_RATE", 0)),
+                   float(burst) if burst else None, peer_rates)
+
+    def peer_bucket(self, host):
+        with self.lock:
+            if host not in self.peer_buckets:
+                self.peer_buckets[host] = TokenBucket(self.peer_rates.get(host, self.peer_rate),
+                                                      self.burst)
+            return self.peer_buckets[host]
+
+    def frames(self, peer, frames):
+        """
+        Input:  the address or host the frames go to, an iterable of bytes
+        Returns: a generator of the same frames, paced by the node's and the peer's bucket
+        """
+        host = host_of(peer)
+        bucket = self.peer_bucket(host)
+        for frame in frames:
+            waited = self.bucket.take(len(frame)) + bucket.take(len(frame))
+            with self.lock:
+                self.waited += waited
+                self.sent += len(frame)
+                if waited:
+                    self.peer_waited[host] = self.peer_waited.get(host, 0.0) + waited
+            yield frame
+
+    def stats(self):
+        with self.lock:
+            return {"seconds": round(self.waited, 3), "bytes": self.sent, "rate": self.rate,
+                    "peer-rate": self.peer_rate,
+                    "peers": {host: round(seconds, 3)
+                              for host, seconds in sorted(self.peer_waited.items())}}
@@ -2,7 +2,6 @@
     VectorClock class
 """
 import sys
-import copy
 import json
 
 
@@ -27,13 +26,55 @@ class VectorClockDecoder(json.JSONDecoder):
     def object_hook(self, dct):
         if dct is None:
             return None
-        clock = VectorClock(None, None, None)
-        for addr, time in dct.items():
-            if addr == "addr":
-                clock.addr = dct["addr"]
-                continue
-            clock.clock[addr] = time
-        return clock
+        home = dct.pop("addr", None)
+        return VectorClock.from_items(home, dct.items())
+
+
+# Every clock of a shard shares one layout: the tuple of replica addresses (in slot
+# order, i.e. the order of Node.shards[this_shard]) plus an {addr : slot} index.
+# Layouts are interned so clocks of the same shard can be compared with an identity check.
+_layouts = {}
+
+
+def get_layout(addr_list):
+    addrs = tuple(addr_list)
+    layout = _layouts.get(addrs)
+    if layout is None:
+        layout = (addrs, {addr: slot for slot, addr in enumerate(addrs)})
+        _layouts[addrs] = layout
+    return layout
+
+
+class ClockView:
+    """
+        dict-like view of a clock's entries, kept so code that pokes at
+        v_clock.clock[addr] directly keeps working
+    """
+    __slots__ = ("vclock",)
+
+    def __init__(self, vclock):
+        self.vclock = vclock
+
+    def __getitem__(self, addr):
+        return self.vclock[addr]
+
+    def __setitem__(self, addr, time):
+        self.vclock.set(addr, time)
+
+    def __contains__(self, addr):
+        return addr in self.vclock.index
+
+    def __iter__(self):
+        return iter(self.vclock.addrs)
+
+    def __len__(self):
+        return len(self.vclock.times)
+
+    def keys(self):
+        return self.vclock.addrs
+
+    def items(self):
+        return self.vclock.items()
 
 
 class VectorClock:
@@ -52,6 +93,9 @@ class VectorClock:
         merge(self, v2)
             merge vclock v2 into self.clock
 
+        dominates(self, v2)
+            True if every time in v2 is <= the same addr's time in self (v2 is in self's past)
+
         increment(self, address)
                 time(address) += 1
 
@@ -59,11 +103,21 @@ class VectorClock:
             self.clock = vectorclock2
             # this sets clock without changing self.addr
 
+        copy(self)
+            cheap copy (shares the address layout, copies the times)
+
         You can iterate through a vector clock with "for addr, time in v_clock.items()"
 
         You can access individual times with v_clock[addr]
+
+    Representation:
+        times is a fixed-length list of ints indexed by replica slot; addrs/index are the
+        interned layout shared by every clock of the shard, so compare/merge of two clocks
+        from the same shard is a single pass over two int lists.
         """
 
+    __slots__ = ("addrs", "index", "times", "addr")
+
     # constants
     GREATER_THAN = 1
     LESS_THAN = -1
@@ -71,43 +125,105 @@ class VectorClock:
     EQUAL = 2
 
     def __init__(self, this_addr, addr_list, v_clock=None):
-        self.clock = {}
         self.addr = None
         if this_addr == None and addr_list == None:
+            self.addrs, self.index = get_layout(())
+            self.times = []
             return
         if v_clock is None:
-            self.clock = dict.fromkeys(addr_list, 0)
+            self.addrs, self.index = get_layout(addr_list)
+            self.times = [0] * len(self.addrs)
         else:
-            self.clock = copy.deepcopy(v_clock.clock)
+            self.addrs, self.index = v_clock.addrs, v_clock.index
+            self.times = list(v_clock.times)
         self.addr = this_addr
 
+    @classmethod
+    def from_items(cls, home, pairs):
+        """
+            build a clock from (addr, time) pairs, e.g. a decoded JSON object
+        """
+        clock = cls.__new__(cls)
+        addrs = []
+        times = []
+        for addr, time in pairs:
+            addrs.append(addr)
+            times.append(time)
+        clock.addrs, clock.index = get_layout(addrs)
+        clock.times = times
+        clock.addr = home
+        return clock
+
+    def copy(self):
+        clock = VectorClock.__new__(VectorClock)
+        clock.addrs = self.addrs
+        clock.index = self.index
+        clock.times = list(self.times)
+        clock.addr = self.addr
+        return clock
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
     def __str__(self):
         """
             what to do it print(VectorClock) is called
         """
         ret = "{"
-        for addr, time in self.clock.items():
+        for time in self.times:
             ret += str(time) + ", "
         ret += "}"
         return ret
 
     # Iterator functions ________________________________
     def __getitem__(self, addr):
-        return self.clock[addr]
+        return self.times[self.index[addr]]
 
     def items(self):
-        return self.clock.items()
+        return zip(self.addrs, self.times)
 
     def __iter__(self):
-        return iter(self.clock.keys())
+        return iter(self.addrs)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def clock(self):
+        return ClockView(self)
     # ___________________________________________________
 
+    def set(self, addr, time):
+        """
+            set the time of addr, adding addr to the layout if it's new
+        """
+        slot = self.index.get(addr)
+        if slot is None:
+            self.addrs, self.index = get_layout(self.addrs + (addr,))
+            self.times.append(time)
+        else:
+            self.times[slot] = time
+
+    def aligned_times(self, addrs):
+        """
+            our times re-ordered to match another layout (missing addrs read as None)
+        """
+        index = self.index
+        times = self.times
+        return [times[index[addr]] if addr in index else None for addr in addrs]
+
     def update(self, v_clock):
         """
             set self.clock to equal v_clock
         """
-        for addr in self.clock:
-            self.clock[addr] = v_clock[addr]
+        if v_clock.addrs is self.addrs:
+            self.times = list(v_clock.times)
+            return
+        for addr in self.addrs:
+            self.set(addr, v_clock[addr])
 
     @staticmethod
     def compare(clock_1, clock_2):
@@ -125,20 +241,28 @@ class VectorClock:
         if clock_2 is None:
             return VectorClock.GREATER_THAN
 
+        times_1 = clock_1.times
+        times_2 = clock_2.times
+        if clock_1.addrs is not clock_2.addrs:
+            times_2 = clock_2.aligned_times(clock_1.addrs)
+            if None in times_2:
+                print("\n\nWooooaaah, hole up -- somethin real fucked up occurred\n\n", file=sys.stderr)
+                for i, j in clock_1.items():
+                    print("clock_1[{}]: {}:{}".format(clock_1.addr,i, j), file=sys.stderr)
+                for i, j in clock_2.items():
+                    print("clock_2[{}]: {}:{}".format(clock_2.addr,i, j), file=sys.stderr)
+                times_2 = [0 if time is None else time for time in times_2]
+
         # see if all values in one clock are either >= or < than other clock
         bigger, smaller = False, False
-        try:
-            for addr, time in clock_1.clock.items():
-                if time > clock_2.clock[addr]:
-                    bigger = True
-                elif time < clock_2.clock[addr]:
-                    smaller = True
-        except:
-            print("\n\nWooooaaah, hole up -- somethin real fucked up occurred\n\n", file=sys.stderr)
-            for i, j in clock_1.items():
-                print("clock_1[{}]: {}:{}".format(clock_1.addr,i, j), file=sys.stderr)
-            for i, j in clock_2.items():
-                print("clock_2[{}]: {}:{}".format(clock_2.addr,i, j), file=sys.stderr)
+        slot = 0
+        for time_1 in times_1:
+            time_2 = times_2[slot]
+            slot += 1
+            if time_1 > time_2:
+                bigger = True
+            elif time_1 < time_2:
+                smaller = True
 
         if (bigger and smaller):
             # they are concurrent, so break tie with vector clock addresses
@@ -159,16 +283,37 @@ class VectorClock:
         """
         if clock_2 is None:
             return
-        for addr, time in self.clock.items():
-            try:
-                self.clock[addr] = max(time, clock_2.clock[addr])
-            except:
-                print("\nAttempted to compare incompatible vector clocks\n", file=sys.stderr)
-                return
+        if clock_2.addrs is self.addrs:
+            self.times = [t1 if t1 >= t2 else t2 for t1, t2 in zip(self.times, clock_2.times)]
+            return
+        other_times = clock_2.aligned_times(self.addrs)
+        if None in other_times:
+            print("\nAttempted to compare incompatible vector clocks\n", file=sys.stderr)
+            return
+        self.times = [t1 if t1 >= t2 else t2 for t1, t2 in zip(self.times, other_times)]
+
+    def dominates(self, clock_2):
+        """
+        Input:  a Vclock (or None, which everything dominates)
+        Return: True if self >= clock_2 in every slot -- addrs self doesn't have count as 0
+        """
+        if clock_2 is None:
+            return True
+        if clock_2.addrs is self.addrs:
+            for t1, t2 in zip(self.times, clock_2.times):
+                if t1 < t2:
+                    return False
+            return True
+        index = self.index
+        times = self.times
+        for addr, time in clock_2.items():
+            if time > (times[index[addr]] if addr in index else 0):
+                return False
+        return True
 
     def increment(self):
         """
         input:  the address of a replica
         result: add 1 to time(address)
         """
-        self.clock[self.addr] += 1
+        self.times[self.index[self.addr]] += 1
@@ -0,0 +1,294 @@
+"""
+    Wire codecs for everything that carries clocks and histories (causal contexts, gossip,
+    resharding)
+
+    JSON (the default, and what old clients speak):
+        Histories and clocks are sent the way they always were -- as JSON strings produced by
+        HistoryEncoder/VectorClockEncoder and embedded in the outer document.
+
+    Binary (Content-Type / Accept: application/x-kvs-binary):
+        message:    version (u8) | address table | value
+        table:      varint n | n x string           -- every "ip:port" is sent once
+        value:      tag (1 byte) followed by
+                        N / T / F                   None / True / False
+                        I  zigzag varint            int
+                        D  8 byte double            float
+                        S  varint len + utf8        str
+                        L  varint n + n values      list
+                        M  varint n + n x (str, value)          dict
+                        C  varint home + varint n + n x (varint addr, varint time)
+                                                    VectorClock (addrs are table indexes,
+                                                    home is index + 1, 0 => None)
+                        H  varint n + n x (str, clock or N)     History
+"""
+import json
+import struct
+from flask import request
+from vector_clock import VectorClock, VectorClockDecoder, VectorClockEncoder
+from history import History, HistoryDecoder, HistoryEncoder, LazyHistory
+
+BINARY_MIMETYPE = "application/x-kvs-binary"
+JSON_MIMETYPE = "application/json"
+
+# headers for node-to-node requests that want binary both ways
+BINARY_HEADERS = {"Content-Type": BINARY_MIMETYPE, "Accept": BINARY_MIMETYPE}
+
+VERSION = 1
+
+NONE, TRUE, FALSE = b"N"[0], b"T"[0], b"F"[0]
+INT, FLOAT, STR = b"I"[0], b"D"[0], b"S"[0]
+LIST, DICT = b"L"[0], b"M"[0]
+CLOCK, HISTORY = b"C"[0], b"H"[0]
+
+DOUBLE = struct.Struct("!d")
+
+
+# JSON ##############################################################################################
+
+class WireJSONEncoder(json.JSONEncoder):
+    """
+        encodes Histories/VectorClocks inside a response exactly like the old
+        HistoryEncoder().encode(...) strings, so old clients see no difference
+    """
+
+    def default(self, obj):
+        if isinstance(obj, LazyHistory) and not obj.changed:
+            # nothing changed -- send back exactly what the client sent
+            return obj.raw
+        if isinstance(obj, History):
+            return HistoryEncoder().encode(obj)
+        if isinstance(obj, VectorClock):
+            return VectorClockEncoder().encode(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def to_history(value):
+    """
+        History from either wire format (a decoded History or an old-style JSON string)
+    """
+    if value is None or isinstance(value, History):
+        return value
+    return json.loads(value, cls=HistoryDecoder)
+
+
+def lazy_history(value):
+    """
+        like to_history, but a JSON string only gets its clocks decoded as they're needed
+        (see LazyHistory)
+    """
+    if isinstance(value, str):
+        return LazyHistory(value)
+    return to_history(value)
+
+
+def to_clock(value):
+    """
+        VectorClock (or None) from either wire format
+    """
+    if value is None or isinstance(value, VectorClock):
+        return value
+    return json.loads(value, cls=VectorClockDecoder)
+
+
+# binary ############################################################################################
+
+class Encoder:
+    def __init__(self):
+        self.addr_index = {}
+        self.addrs = []
+        self.out = bytearray()
+
+    def varint(self, n):
+        out = self.out
+        while n > 0x7F:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+
+    def string(self, string):
+        data = string.encode("utf-8")
+        self.varint(len(data))
+        self.out += data
+
+    def addr(self, addr):
+        index = self.addr_index.get(addr)
+        if index is None:
+            index = self.addr_index[addr] = len(self.addrs)
+            self.addrs.append(addr)
+        return index
+
+    def clock(self, clock):
+        if clock is None:
+            self.out.append(NONE)
+            return
+        self.out.append(CLOCK)
+        self.varint(0 if clock.addr is None else self.addr(clock.addr) + 1)
+        self.varint(len(clock))
+        for addr, time in clock.items():
+            self.varint(self.addr(addr))
+            self.varint(time)
+
+    def value(self, value):
+        out = self.out
+        if value is None:
+            out.append(NONE)
+        elif value is True:
+            out.append(TRUE)
+        elif value is False:
+            out.append(FALSE)
+        elif isinstance(value, int):
+            out.append(INT)
+            self.varint(value << 1 if value >= 0 else ((-value) << 1) - 1)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += DOUBLE.pack(value)
+        elif isinstance(value, str):
+            out.append(STR)
+            self.string(value)
+        elif isinstance(value, (list, tuple)):
+            out.append(LIST)
+            self.varint(len(value))
+            for item in value:
+                self.value(item)
+        elif isinstance(value, dict):
+            out.append(DICT)
+            self.varint(len(value))
+            for key, item in value.items():
+                self.string(str(key))
+                self.value(item)
+        elif isinstance(value, VectorClock):
+            self.clock(value)
+        elif isinstance(value, History):
+            out.append(HISTORY)
+            self.varint(len(value.hist))
+            for key, clock in value.items():
+                self.string(key)
+                self.clock(clock)
+        else:
+            raise TypeError("Can't binary-encode {}".format(type(value).__name__))
+
+    def encode(self, value):
+        self.value(value)
+        body = self.out
+        # the address table goes in front of the body, now that it's complete
+        self.out = bytearray([VERSION])
+        self.varint(len(self.addrs))
+        for addr in self.addrs:
+            self.string(addr)
+        self.out += body
+        return bytes(self.out)
+
+
+class Decoder:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def varint(self):
+        data = self.data
+        shift = 0
+        n = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            n |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def string(self):
+        length = self.varint()
+        start = self.pos
+        self.pos += length
+        return str(self.data[start:self.pos], "utf-8")
+
+    def clock_body(self):
+        home = self.varint()
+        addrs = self.addrs
+        pairs = []
+        for _ in range(self.varint()):
+            addr = addrs[self.varint()]
+            pairs.append((addr, self.varint()))
+        return VectorClock.from_items(addrs[home - 1] if home else None, pairs)
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            n = self.varint()
+            return n >> 1 if not n & 1 else -((n + 1) >> 1)
+        if tag == FLOAT:
+            value = DOUBLE.unpack_from(self.data, self.pos)[0]
+            self.pos += DOUBLE.size
+            return value
+        if tag == STR:
+            return self.string()
+        if tag == LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == DICT:
+            dct = {}
+            for _ in range(self.varint()):
+                key = self.string()
+                dct[key] = self.value()
+            return dct
+        if tag == CLOCK:
+            return self.clock_body()
+        if tag == HISTORY:
+            hist = History()
+            for _ in range(self.varint()):
+                key = self.string()
+                hist.hist[key] = self.value()
+            return hist
+        raise ValueError("Unknown binary tag {!r} at byte {}".format(chr(tag), self.pos - 1))
+
+    def decode(self):
+        if self.data[0] != VERSION:
+            raise ValueError("Unsupported binary message version {}".format(self.data[0]))
+        self.pos = 1
+        self.addrs = [self.string() for _ in range(self.varint())]
+        return self.value()
+
+
+def dumps(value):
+    return Encoder().encode(value)
+
+
+def loads(data):
+    return Decoder(data).decode()
+
+
+def response_body(response):
+    """
+        decode a requests.Response from another node in whichever format it came back in
+    """
+    if response.headers.get("Content-Type", "").startswith(BINARY_MIMETYPE):
+        return loads(response.content)
+    return response.json()
+
+
+def request_body():
+    """
+        decode the body of the current flask request in whichever format it was sent in
+    """
+    if not request.get_data():
+        # no body at all (e.g. a GET with only a query string) -- no arguments
+        return {}
+    if request.mimetype == BINARY_MIMETYPE:
+        return loads(request.get_data())
+    return request.get_json()
+
+
+def request_like(value):
+    """
+        encode value the way the current flask request's body was (see request_body) -- to
+        forward a changed copy of it
+    """
+    if request.mimetype == BINARY_MIMETYPE:
+        return dumps(value)
+    return json.dumps(value)
@@ -1,7 +1,14 @@
+import os
+import sys
 import requests # Note, you may need to install this package via pip (or pip3)
 
+# RoutingClient places keys with the same code the nodes use
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import partitioner
+
 localhost = "localhost"
 timeout = 5
+view_header = "X-Kvs-View"
 
 class Client():
     def __init__(self,causal_context_flag=True,print_response=False):
@@ -102,3 +109,109 @@ class Client():
 
         return result
 
+
+class RoutingClient(Client):
+    """
+        a Client that learns the shard map from GET /kvs/topology, hashes keys itself and sends
+        them straight to a replica of the key's shard instead of paying a proxy hop
+
+        - keys go to the replica that coordinates writes of that key (partitioner.coordinator_order),
+          reads too, so a client reads its own writes from the replica that has them first
+        - if that replica doesn't answer, the next one is tried
+        - every node response carries its view epoch (X-Kvs-View), whenever that's newer than
+          ours the topology is fetched again
+        - address_map maps view addresses to where the client can reach them, e.g.
+          {"10.10.0.2:13800": "localhost:13802"} for docker's published ports
+    """
+
+    def __init__(self, seed_port, address_map=None, causal_context_flag=True, print_response=False):
+        Client.__init__(self, causal_context_flag, print_response)
+        self.seed_port = seed_port
+        self.address_map = address_map or {}
+        self.topology = None
+        self.partitioner = None
+        self.refreshes = 0          # how often the topology was fetched
+        self.proxied = 0            # responses that still needed a proxy hop (stale topology)
+        self.refreshTopology()
+
+    def target(self, addr):
+        return self.address_map.get(addr, addr)
+
+    def refreshTopology(self):
+        # ask the seed node first, then any node of the topology we already have
+        candidates = ["%s:%s" % (localhost, str(self.seed_port))]
+        if self.topology is not None:
+            candidates += [self.target(addr) for addr in self.topology["view"]]
+        for candidate in candidates:
+            try:
+                result = requests.get("http://%s/kvs/topology" % candidate, timeout=timeout)
+            except requests.exceptions.RequestException:
+                continue
+            if result.status_code != 200:
+                continue
+            topology = result.json()
+            # never go back to an older view than one we've already seen
+            if self.topology is None or topology["current_view"] >= self.topology["current_view"]:
+                self.topology = topology
+                self.partitioner = partitioner.from_routing(topology["routing"],
+                                                            len(topology["shards"]))
+            self.refreshes += 1
+            break
+        return self.topology
+
+    def replicas(self, key):
+        shard = self.topology["shards"][self.partitioner.shard(key)]
+        return partitioner.coordinator_order(key, shard)
+
+    def checkView(self, result):
+        view = result.headers.get(view_header)
+        if view is not None and int(view) > self.topology["current_view"]:
+            self.refreshTopology()
+
+    def sendKey(self, method, key, body):
+        for addr in self.replicas(key):
+            try:
+                result = requests.request(method, "http://%s/kvs/keys/%s" % (self.target(addr), key),
+                                          timeout=timeout, json=body,
+                                          headers={"Content-Type": "application/json"})
+            except requests.exceptions.RequestException:
+                continue
+            self.checkView(result)
+            return result
+
+        # nobody of the shard answered -- the view may have moved on, let the seed node proxy it
+        self.refreshTopology()
+        result = requests.request(method, "http://%s:%s/kvs/keys/%s" % (localhost, str(self.seed_port), key),
+                                  timeout=timeout, json=body,
+                                  headers={"Content-Type": "application/json"})
+        self.checkView(result)
+        return result
+
+    def putKey(self, key, value, port=None):
+        # port is only there so RoutingClient can stand in for Client -- the key picks the node
+        result = self.sendKey("PUT", key, {"value": value, "causal-context": self.causal_context})
+
+        if self.print_response:
+            print("PUT key result %s"%str(result.content))
+
+        return self.formatResult(result)
+
+    def getKey(self, key, port=None):
+        result = self.sendKey("GET", key, {"causal-context": self.causal_context})
+
+        if self.print_response:
+            print("GET key result %s"%str(result.content))
+
+        return self.formatResult(result)
+
+    def viewChange(self, view, repl_factor, port):
+        result = Client.viewChange(self, view, repl_factor, port)
+        self.refreshTopology()
+        return result
+
+    def formatResult(self, result):
+        result = Client.formatResult(self, result)
+        # only proxied responses name the node that answered
+        if "address" in result:
+            self.proxied += 1
+        return result
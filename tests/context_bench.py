@@ -0,0 +1,56 @@
+"""
+    Causal context benchmark: how big the context a client carries gets over a long session
+    (and how long requests take), against a running cluster
+
+    every request is sent to a random node, half of them PUTs, over a growing set of keys --
+    without compaction the history has an entry for every key the session ever touched
+
+    run from the tests directory:
+        python context_bench.py [num requests] [node ports...]
+"""
+import sys
+import json
+import time
+import random
+import requests
+
+DEFAULT_PORTS = [13802, 13803, 13804, 13805]
+REPORT_EVERY = 500
+THINK_TIME = 0.002          # between requests, so gossip gets to run during the session
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    ports = [int(arg) for arg in sys.argv[2:]] or DEFAULT_PORTS
+    context = {}
+    elapsed, failed = 0.0, 0
+
+    print("{:>9} {:>15} {:>14} {:>12} {:>7}".format(
+        "requests", "history entries", "context bytes", "avg ms/req", "failed"), file=sys.stderr)
+    for i in range(1, num_requests + 1):
+        # the key space keeps growing, like a session that keeps touching new keys
+        key = "session-key{}".format(random.randrange(i // 2 + 1))
+        url = "http://localhost:{}/kvs/keys/{}".format(random.choice(ports), key)
+        start = time.perf_counter()
+        if i % 2:
+            response = requests.put(url, json={"value": str(i), "causal-context": context})
+        else:
+            response = requests.get(url, json={"causal-context": context})
+        elapsed += time.perf_counter() - start
+
+        body = response.json()
+        if response.status_code in (200, 201, 404) and "causal-context" in body:
+            context = body["causal-context"]
+        else:
+            failed += 1
+
+        if i % REPORT_EVERY == 0:
+            history = context.get("history", "{}")
+            entries = len(json.loads(history) if isinstance(history, str) else history)
+            print("{:>9} {:>15} {:>14} {:>12.2f} {:>7}".format(
+                i, entries, len(json.dumps(context)), elapsed * 1000 / REPORT_EVERY, failed))
+            elapsed, failed = 0.0, 0
+        time.sleep(THINK_TIME)
+
+
+main()
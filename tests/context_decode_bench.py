@@ -0,0 +1,80 @@
+"""
+    Causal context decoding benchmark: what a local GET spends on the client's JSON context,
+    decoding all of it up front vs. lazily (wire.lazy_history, only this shard's high clock)
+
+    per GET: decode the context, look up the key's clock and this shard's high clock, set a
+    new high clock and encode the context for the response
+
+    run from the tests directory with src on the path:
+        PYTHONPATH=../src python context_decode_bench.py [history sizes...]
+"""
+import sys
+import json
+import time
+from vector_clock import VectorClock
+from history import History
+import wire
+
+SHARDS = [["10.10.0.{}:13800".format(2 * i + 2), "10.10.0.{}:13800".format(2 * i + 3)]
+          for i in range(4)]
+THIS_SHARD = 1
+
+
+def make_context(num_keys):
+    history = History()
+    clocks = [VectorClock(shard[0], shard) for shard in SHARDS]
+    for i in range(num_keys):
+        clock = clocks[i % len(SHARDS)]
+        clock.increment()
+        history.insert("key{}".format(i), clock)
+    context = {"history": history, "high_clock_list": clocks, "current_view": 0}
+    # what a JSON client sends
+    return json.loads(json.dumps(context, cls=wire.WireJSONEncoder))
+
+
+def eager_get(context, key, cur_time):
+    history = wire.to_history(context["history"])
+    high_clock_list = [wire.to_clock(clock) for clock in context["high_clock_list"]]
+    history[key]
+    cur_time.merge(high_clock_list[THIS_SHARD])
+    high_clock_list[THIS_SHARD] = cur_time
+    return json.dumps({"history": history, "high_clock_list": high_clock_list},
+                      cls=wire.WireJSONEncoder)
+
+
+def lazy_get(context, key, cur_time):
+    history = wire.lazy_history(context["history"])
+    high_clock_list = [wire.to_clock(clock) if shard_id == THIS_SHARD else clock
+                       for shard_id, clock in enumerate(context["high_clock_list"])]
+    history[key]
+    cur_time.merge(high_clock_list[THIS_SHARD])
+    high_clock_list[THIS_SHARD] = cur_time
+    return json.dumps({"history": history, "high_clock_list": high_clock_list},
+                      cls=wire.WireJSONEncoder)
+
+
+def time_gets(get, context, repeat):
+    cur_time = VectorClock(SHARDS[THIS_SHARD][0], SHARDS[THIS_SHARD])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = get(context, "key1", cur_time)
+    return (time.perf_counter() - start) / repeat, out
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000]
+    print("{:>8} {:>14} {:>14} {:>9}".format("entries", "eager us/GET", "lazy us/GET", "speedup"),
+          file=sys.stderr)
+    for size in sizes:
+        context = make_context(size)
+        repeat = max(5, 20000 // size)
+        eager, eager_out = time_gets(eager_get, context, repeat)
+        lazy, lazy_out = time_gets(lazy_get, context, repeat)
+        # the lazy path sends back the same context
+        assert json.loads(eager_out)["history"] == json.loads(lazy_out)["history"] or \
+            wire.to_history(json.loads(eager_out)["history"]).hist.keys() == \
+            wire.to_history(json.loads(lazy_out)["history"]).hist.keys()
+        print("{:>8} {:>14.1f} {:>14.1f} {:>8.1f}x".format(size, eager * 1e6, lazy * 1e6, eager / lazy))
+
+
+main()
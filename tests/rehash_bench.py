@@ -0,0 +1,83 @@
+"""
+    Rehash benchmark: how long a node takes to split its store into per-shard fragments for a
+    new view -- the one loop through the routing table a view change used to run vs. the
+    rehasher (rehash.py) with 1..N worker processes, for growing store sizes
+
+    the first parallel run for a worker count includes starting the pool (spawn), reported
+    separately; the timed runs reuse it like the next view change would
+
+    run from the tests directory with src on the path:
+        PYTHONPATH=../src python rehash_bench.py [max keys] [max workers] [partitioner]
+"""
+import os
+import sys
+import time
+from partitioner import from_routing, RoutingTable, MOD
+from rehash import Rehasher
+
+NUM_SHARDS = 4
+
+
+def fragments_of(store, keys, shard_ids):
+    fragments = [{} for _ in range(NUM_SHARDS)]
+    for key, shard_id in zip(keys, shard_ids):
+        fragments[shard_id][key] = store[key]
+    return fragments
+
+
+def loop_rehash(store, routing):
+    # what Node.rehash did: every key through the routing table's cache
+    router = RoutingTable(from_routing(routing, NUM_SHARDS))
+    fragments = [{} for _ in range(NUM_SHARDS)]
+    for key, value in store.items():
+        fragments[router.shard(key)][key] = value
+    return fragments
+
+
+def rehasher_rehash(rehasher, store, routing):
+    keys = list(store)
+    shard_ids = rehasher.shards(keys, from_routing(routing, NUM_SHARDS), routing)
+    return fragments_of(store, keys, shard_ids)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    max_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(2, os.cpu_count() or 1)
+    routing = {"partitioner": sys.argv[3] if len(sys.argv) > 3 else MOD, "hash": "md5",
+               "vnodes": 128}
+    print("{} cores, {} partitioner, {} shards".format(
+        os.cpu_count(), routing["partitioner"], NUM_SHARDS))
+
+    sizes = [n for n in (10000, 100000, 1000000, 10000000) if n <= max_keys]
+    worker_counts = [w for w in (1, 2, 4, 8, 16) if w <= max_workers]
+    rehashers = {workers: Rehasher(workers, min_keys=0) for workers in worker_counts}
+    header = "{:>9} {:>9}".format("keys", "loop") + "".join(
+        "{:>11}".format("{} proc".format(w)) for w in worker_counts)
+    print(header)
+    try:
+        for num_keys in sizes:
+            store = {"key{}".format(i): "v" for i in range(num_keys)}
+            took, expected = timed(loop_rehash, store, routing)
+            row = "{:>9} {:>9.3f}".format(num_keys, took)
+            for workers, rehasher in rehashers.items():
+                if rehasher.pool is None and rehasher.parallel(num_keys):
+                    startup, _ = timed(rehasher_rehash, rehasher, store, routing)
+                    print("  ({} proc: first run incl. pool start {:.3f}s)".format(
+                        workers, startup), file=sys.stderr)
+                took, fragments = timed(rehasher_rehash, rehasher, store, routing)
+                assert fragments == expected
+                row += "{:>11.3f}".format(took)
+            print(row)
+    finally:
+        for rehasher in rehashers.values():
+            rehasher.close()
+
+
+if __name__ == "__main__":
+    main()
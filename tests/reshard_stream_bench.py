@@ -0,0 +1,89 @@
+"""
+    Reshard transfer benchmark: one fragment sent to /kvs/reshard/put_payload as a single
+    binary body (how reshard data used to move) vs. as a stream of chunks (stream.py)
+
+    starts a one-node store for every run (src/app.py) and reports how long the transfer took,
+    how much memory the sender needed to build it (tracemalloc peak) and how much the node's
+    peak RSS grew while taking it in
+
+    run from the tests directory:
+        python reshard_stream_bench.py [keys] [value bytes]
+"""
+import os
+import sys
+import time
+import socket
+import tracemalloc
+import subprocess
+import requests
+
+PORT = 13871
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+import wire
+import stream
+
+
+def start_node():
+    addr = "127.0.0.1:{}".format(PORT)
+    env = dict(os.environ, ADDRESS=addr, VIEW=addr, REPL_FACTOR="1", HOST="127.0.0.1",
+               PORT=str(PORT))
+    env.pop("STORAGE_DIR", None)
+    node = subprocess.Popen([sys.executable, "app.py"], cwd=SRC, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", PORT), timeout=1).close()
+            return node
+        except OSError:
+            time.sleep(0.05)
+    node.kill()
+    raise RuntimeError("node did not start")
+
+
+def peak_rss_mb(pid):
+    with open("/proc/{}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmHWM"):
+                return int(line.split()[1]) / 1024
+
+
+def send(fragment, streamed):
+    url = "http://127.0.0.1:{}/kvs/reshard/put_payload".format(PORT)
+    if streamed:
+        chunks = ({"payload": chunk} for chunk in stream.split(fragment.items()))
+        return requests.put(url, data=stream.frames(chunks), headers=stream.STREAM_HEADERS)
+    return requests.put(url, data=wire.dumps({"payload": fragment}),
+                        headers=wire.BINARY_HEADERS)
+
+
+def main():
+    num_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    value_bytes = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    fragment = {"key{}".format(i): "v" * value_bytes for i in range(num_keys)}
+    print("{} keys, {:.0f} MB".format(num_keys, num_keys * value_bytes / 2 ** 20),
+          file=sys.stderr)
+    print("{:>9} {:>9} {:>16} {:>16}".format(
+        "mode", "seconds", "sender peak MB", "node RSS +MB"), file=sys.stderr)
+    for streamed in (False, True):
+        node = start_node()
+        try:
+            before = peak_rss_mb(node.pid)
+            tracemalloc.start()
+            start = time.monotonic()
+            response = send(fragment, streamed)
+            took = time.monotonic() - start
+            sender_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            assert response.status_code == 200, response.text
+            count = requests.get("http://127.0.0.1:{}/kvs/key-count".format(PORT)).json()
+            assert count["key-count"] == num_keys, count
+            print("{:>9} {:>9.2f} {:>16.1f} {:>16.1f}".format(
+                "stream" if streamed else "one body", took, sender_peak,
+                peak_rss_mb(node.pid) - before))
+        finally:
+            node.kill()
+            node.wait()
+
+
+main()
@@ -0,0 +1,50 @@
+"""
+    Routing benchmark: the original md5 hexdigest -> int -> % shards lookup vs. the
+    partitioners in partitioner.py, with and without the routing table's LRU cache
+
+    run from the tests directory with src on the path:
+        PYTHONPATH=../src python routing_bench.py [num keys] [num lookups]
+"""
+import sys
+import time
+import random
+import hashlib
+from partitioner import make_partitioner, RoutingTable, MOD, RING, MD5, BLAKE2B
+
+NUM_SHARDS = 4
+
+
+def original_hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % NUM_SHARDS
+
+
+def time_lookups(lookup, keys):
+    start = time.perf_counter()
+    for key in keys:
+        lookup(key)
+    return time.perf_counter() - start
+
+
+def main():
+    num_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+
+    # skewed workload -- most requests hit a small set of hot keys
+    keys = ["key{}".format(i) for i in range(num_keys)]
+    random.seed(0)
+    workload = [keys[min(int(random.expovariate(1 / (num_keys / 20))), num_keys - 1)]
+                for _ in range(num_lookups)]
+
+    baseline = time_lookups(original_hash, workload)
+    print("{:<28} {:>8.3f}s".format("md5 % shards (original)", baseline))
+    for name in (MOD, RING):
+        for hash_name in (MD5, BLAKE2B):
+            part = make_partitioner(name, NUM_SHARDS, hash_name=hash_name)
+            for cached in (False, True):
+                lookup = RoutingTable(part).shard if cached else part.shard
+                elapsed = time_lookups(lookup, workload)
+                label = "{} {}{}".format(name, hash_name, " + cache" if cached else "")
+                print("{:<28} {:>8.3f}s  ({:.2f}x)".format(label, elapsed, baseline / elapsed))
+
+
+main()
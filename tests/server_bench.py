@@ -0,0 +1,121 @@
+"""
+    Server benchmark: throughput and latency of a one-node store on Flask's threaded
+    development server (what app.py used to run) vs. the gevent WSGI server (server.py)
+
+    starts the node itself (src/app.py, SERVER=dev / SERVER=gevent) and drives it from
+    client processes, each with a few threads on keep-alive connections, half PUTs and half
+    GETs over a small key space. The clients use http.client rather than requests so that
+    they cost less CPU than the node they are measuring.
+
+    run from the tests directory:
+        python server_bench.py [seconds per run] [concurrency levels...]
+"""
+import os
+import sys
+import time
+import json
+import random
+import signal
+import socket
+import threading
+import subprocess
+import http.client
+import multiprocessing
+
+PORT = 13870
+THREADS_PER_PROCESS = 8
+NUM_KEYS = 1000
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def start_node(mode):
+    addr = "127.0.0.1:{}".format(PORT)
+    env = dict(os.environ, ADDRESS=addr, VIEW=addr, REPL_FACTOR="1", HOST="127.0.0.1",
+               PORT=str(PORT), SERVER=mode)
+    env.pop("STORAGE_DIR", None)
+    node = subprocess.Popen([sys.executable, "app.py"], cwd=SRC, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", PORT), timeout=1).close()
+            return node
+        except OSError:
+            time.sleep(0.05)
+    node.kill()
+    raise RuntimeError("node did not start")
+
+
+def client(args):
+    threads, seconds, seed = args
+    results = []
+
+    def run(rng):
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+        latencies, failed = [], 0
+        stop = time.monotonic() + seconds
+        while time.monotonic() < stop:
+            path = "/kvs/keys/bench{}".format(rng.randrange(NUM_KEYS))
+            put = rng.random() < 0.5
+            body = {"value": "x" * 32, "causal-context": {}} if put else {"causal-context": {}}
+            start = time.perf_counter()
+            try:
+                conn.request("PUT" if put else "GET", path, body=json.dumps(body),
+                             headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+            latencies.append(time.perf_counter() - start)
+        conn.close()
+        results.append((latencies, failed))
+
+    workers = [threading.Thread(target=run, args=(random.Random(seed * 100 + i),))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [latency for latencies, _ in results for latency in latencies], \
+        sum(failed for _, failed in results)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(concurrency, seconds):
+    processes = max(1, concurrency // THREADS_PER_PROCESS)
+    threads = concurrency // processes
+    with multiprocessing.Pool(processes) as pool:
+        runs = pool.map(client, [(threads, seconds, seed) for seed in range(processes)])
+    latencies = [latency for run, _ in runs for latency in run]
+    return len(latencies) / seconds, latencies, sum(failed for _, failed in runs)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    levels = [int(arg) for arg in sys.argv[2:]] or [1, 8, 32, 128]
+    print("{:>7} {:>12} {:>10} {:>9} {:>9} {:>7} {:>12}".format(
+        "server", "concurrency", "req/s", "p50 ms", "p99 ms", "failed", "shutdown s"),
+        file=sys.stderr)
+    for mode in ("dev", "gevent"):
+        for concurrency in levels:
+            node = start_node(mode)
+            try:
+                rate, latencies, failed = measure(concurrency, seconds)
+                start = time.monotonic()
+                node.send_signal(signal.SIGTERM)
+                node.wait(timeout=30)
+                shutdown = time.monotonic() - start
+            finally:
+                node.kill()
+            print("{:>7} {:>12} {:>10.0f} {:>9.2f} {:>9.2f} {:>7} {:>12.2f}".format(
+                mode, concurrency, rate, percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, failed, shutdown))
+
+
+main()
@@ -0,0 +1,66 @@
+"""
+    Session benchmark: the same session of requests sent with its causal-context in every
+    body vs. with a session token (the nodes keep the context), against a running cluster
+
+    reports the request body size and latency percentiles of both
+
+    run from the tests directory:
+        python session_bench.py [num requests] [node ports...]
+"""
+import sys
+import json
+import time
+import random
+import requests
+
+DEFAULT_PORTS = [13802, 13803, 13804, 13805]
+THINK_TIME = 0.002          # between requests, so gossip gets to run during the session
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(num_requests, ports, use_session):
+    random.seed(1)
+    context, token = {}, ""
+    sizes, latencies, failed = [], [], 0
+    for i in range(1, num_requests + 1):
+        key = "bench-key{}".format(random.randrange(i // 2 + 1))
+        url = "http://localhost:{}/kvs/keys/{}".format(random.choice(ports), key)
+        body = {"session": token} if use_session else {"causal-context": context}
+        if i % 2:
+            body["value"] = str(i)
+        data = json.dumps(body)
+        start = time.perf_counter()
+        response = requests.request("PUT" if i % 2 else "GET", url, data=data,
+                                    headers={"Content-Type": "application/json"})
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(data))
+
+        reply = response.json()
+        if response.status_code in (200, 201, 404):
+            if use_session:
+                token = reply.get("session", token)
+            else:
+                context = reply.get("causal-context", context)
+        else:
+            failed += 1
+        time.sleep(THINK_TIME)
+    return sizes, latencies, failed
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    ports = [int(arg) for arg in sys.argv[2:]] or DEFAULT_PORTS
+    print("{:>15} {:>14} {:>14} {:>10} {:>10} {:>7}".format(
+        "mode", "avg req bytes", "max req bytes", "p50 ms", "p99 ms", "failed"), file=sys.stderr)
+    for mode in ("causal-context", "session"):
+        sizes, latencies, failed = run(num_requests, ports, mode == "session")
+        print("{:>15} {:>14.0f} {:>14} {:>10.2f} {:>10.2f} {:>7}".format(
+            mode, sum(sizes) / len(sizes), max(sizes), percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, failed))
+
+
+main()
@@ -0,0 +1,83 @@
+"""
+    Startup-time benchmark: full write-ahead log replay vs. snapshot + log tail
+
+    run from the tests directory with src on the path:
+        PYTHONPATH=../src python storage_bench.py [key counts...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from vector_clock import VectorClock
+from history import History
+from storage import StorageEngine, WriteAheadLog, FSYNC_NEVER
+
+ADDRS = ["10.10.0.2:13800", "10.10.0.3:13800", "10.10.0.4:13800"]
+TAIL_FRACTION = 0.05        # fraction of writes that land after the snapshot
+
+
+def open_engine(directory):
+    return StorageEngine(WriteAheadLog(os.path.join(directory, "kvs.wal"), FSYNC_NEVER),
+                         os.path.join(directory, "kvs.snap"))
+
+
+def fill(engine, num_keys, num_writes):
+    clock = VectorClock(ADDRS[0], ADDRS)
+    for i in range(num_writes):
+        key = "key{}".format(i % num_keys)
+        clock.increment()
+        hist = History()
+        hist.insert(key, clock)
+        engine.versions.insert(key, clock)
+        engine.write(key, "value{}".format(i), clock, hist)
+
+
+def time_recovery(directory):
+    engine = open_engine(directory)
+    start = time.perf_counter()
+    engine.recover()
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return elapsed, len(engine.kvs)
+
+
+def bench(num_keys):
+    full_dir = tempfile.mkdtemp()
+    snap_dir = tempfile.mkdtemp()
+    num_writes = 2 * num_keys
+    tail = int(num_writes * TAIL_FRACTION)
+    try:
+        # full replay: every write is still in the log
+        engine = open_engine(full_dir)
+        engine.log_view(ADDRS, 3, 0)
+        fill(engine, num_keys, num_writes)
+        engine.close()
+
+        # snapshot + tail: same writes, but a snapshot was taken near the end
+        engine = open_engine(snap_dir)
+        engine.log_view(ADDRS, 3, 0)
+        fill(engine, num_keys, num_writes - tail)
+        engine.snapshot()
+        fill(engine, num_keys, tail)
+        engine.close()
+
+        full_time, full_keys = time_recovery(full_dir)
+        snap_time, snap_keys = time_recovery(snap_dir)
+        assert full_keys == snap_keys == num_keys
+        print("{:>10} {:>10} {:>12.3f} {:>14.3f} {:>8.1f}x".format(
+            num_keys, num_writes, full_time, snap_time, full_time / snap_time))
+    finally:
+        shutil.rmtree(full_dir)
+        shutil.rmtree(snap_dir)
+
+
+def main():
+    key_counts = [int(arg) for arg in sys.argv[1:]] or [10000, 50000, 200000]
+    print("{:>10} {:>10} {:>12} {:>14} {:>9}".format(
+        "keys", "writes", "replay (s)", "snap+tail (s)", "speedup"), file=sys.stderr)
+    for num_keys in key_counts:
+        bench(num_keys)
+
+
+main()
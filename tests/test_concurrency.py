@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import threading
+import unittest
+from vector_clock import VectorClock
+from history import History
+from merkle import MerkleTree
+from locks import StripedLock, RWLock
+from node import Node
+
+# a shard of two replicas -- B is never started, we play its part by calling gossip_ack
+A, B = "127.0.0.1:13991", "127.0.0.1:13992"
+VIEW = ",".join([A, B])
+WRITERS = 4
+READERS = 2
+ROUNDS = 1500
+KEYS = 50
+VIEW_CHANGES = 20
+
+
+def run_threads(*targets):
+    errors = []
+
+    def wrap(target):
+        try:
+            target()
+        except Exception as exception:
+            errors.append(exception)
+
+    threads = [threading.Thread(target=wrap, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    return errors
+
+
+class TestRWLock(unittest.TestCase):
+    def test_writer_waits_for_readers(self):
+        lock = RWLock()
+        reading, written = threading.Event(), threading.Event()
+
+        def writer():
+            reading.wait()
+            with lock.write():
+                written.set()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        with lock.read():
+            reading.set()
+            self.assertFalse(written.wait(0.2))
+        self.assertTrue(written.wait(5))
+        thread.join()
+
+    def test_waiting_writer_blocks_new_readers(self):
+        lock = RWLock()
+        order = []
+        writing = threading.Event()
+
+        def writer():
+            with lock.write():
+                order.append("w")
+                writing.wait()
+
+        def reader():
+            with lock.read():
+                order.append("r")
+
+        with lock.read():
+            threads = [threading.Thread(target=writer)]
+            threads[0].start()
+            while not lock.writers_waiting:
+                time.sleep(0.01)
+            threads.append(threading.Thread(target=reader))
+            threads[1].start()
+            time.sleep(0.1)
+            # only readers hold the lock, but the new one queues behind the writer
+            self.assertEqual(order, [])
+            # (we're inside read() already, that doesn't wait)
+            with lock.read():
+                pass
+        while not order:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(order, ["w"])
+        writing.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ["w", "r"])
+
+    def test_reentrant(self):
+        lock = RWLock()
+        with lock.write(), lock.write(), lock.read():
+            pass
+        with lock.read(), lock.read():
+            self.assertRaises(RuntimeError, lock.write().__enter__)
+        with lock.write():
+            pass
+
+
+class TestStripedLock(unittest.TestCase):
+    def test_hold_in_stripe_order(self):
+        locks = StripedLock(8)
+        keys = ["key{}".format(i) for i in range(16)]
+
+        def grab(keys):
+            for _ in range(2000):
+                with locks.hold(keys):
+                    pass
+
+        # opposite orders would deadlock if hold() took the locks as given
+        self.assertEqual(run_threads(lambda: grab(keys), lambda: grab(keys[::-1])), [])
+
+    def test_same_key_same_lock(self):
+        locks = StripedLock(8)
+        self.assertIs(locks.lock("a"), locks.lock("a"))
+
+
+class TestNodeStress(unittest.TestCase):
+    """
+        PUTs, GETs, gossip from the other replica, my own gossip and view changes (the local
+        steps of one: new view, rehash, reset the histories), all at once on real threads
+    """
+
+    def setUp(self):
+        os.environ["ADDRESS"] = A
+        os.environ.pop("STORAGE_DIR", None)
+        self.node = Node(VIEW, 2)
+        self.addCleanup(self.node.close)
+        # switch threads as often as possible
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+    def test_concurrent_puts_gossip_and_view_changes(self):
+        node = self.node
+        versions = []               # (view, my clock time) of every write
+        last = {}                   # {key : last value written}
+        stop = threading.Event()
+
+        def writer(i):
+            context = {}
+            for n in range(ROUNDS):
+                key = "w{}-{}".format(i, n % KEYS)
+                # every other write carries the context of the previous one
+                context = context if n % 2 else {}
+                body, status = node.local_put(key, str(n), context)
+                self.assertIn(status, (200, 201))
+                versions.append((context["current_view"], context["high_clock_list"][0][A]))
+                last[key] = str(n)
+
+        def replica():
+            for n in range(ROUNDS):
+                key = "p{}".format(n % KEYS)
+                version = VectorClock(B, [A, B])
+                version.set(B, n + 1)
+                times = History()
+                times.hist[key] = version
+                node.gossip_ack({key: str(n)}, {}, times, version, B, seq=n + 1, ack=0)
+                last[key] = str(n)
+
+        def gossip():
+            while not stop.is_set():
+                node.gossip()
+
+        def reader():
+            while not stop.is_set():
+                for i in range(KEYS):
+                    body, status = node.local_get("w0-{}".format(i), *node.decode_context({}))
+                    self.assertIn(status, (200, 404))
+
+        def view_changes():
+            for _ in range(VIEW_CHANGES):
+                node.set_shards_and_view(VIEW, 2, node.current_view + 1)
+                node.reset_histories()
+                node.rehash()
+                node.fragments.clear()
+                time.sleep(0.01)
+
+        def workers():
+            errors = run_threads(*([lambda i=i: writer(i) for i in range(WRITERS)] +
+                                   [replica, view_changes]))
+            stop.set()
+            return errors
+
+        errors = []
+        errors += run_threads(lambda: errors.extend(workers()), gossip,
+                              *[reader for _ in range(READERS)])
+        self.assertEqual(errors, [])
+
+        # no two writes of a view got the same version
+        self.assertEqual(len(versions), WRITERS * ROUNDS)
+        self.assertEqual(len(set(versions)), len(versions))
+        # no write got lost
+        for key, value in last.items():
+            self.assertEqual(node.local_kvs[key], value, key)
+        # the Merkle tree kept up with the memtable
+        tree = MerkleTree(node.storage.tree.depth)
+        tree.rebuild(node.local_kvs, node.local_key_versions)
+        self.assertEqual(node.storage.tree.root(), tree.root())
+
+
+if __name__ == '__main__':
+    unittest.main()
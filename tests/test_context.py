@@ -0,0 +1,114 @@
+import os
+import threading
+import unittest
+from vector_clock import VectorClock
+from history import History
+from partitioner import make_partitioner, RoutingTable, MOD
+from node import Node
+
+SHARDS = [["10.10.0.2:13800", "10.10.0.3:13800"], ["10.10.0.4:13800", "10.10.0.5:13800"]]
+A, B = SHARDS[0]
+
+
+def clock(addrs, times, home=None):
+    vc = VectorClock(home or addrs[0], addrs)
+    for addr, time in zip(addrs, times):
+        vc.set(addr, time)
+    return vc
+
+
+def make_node():
+    os.environ["ADDRESS"] = A
+    node = Node.__new__(Node)
+    node.shards = SHARDS
+    node.this_shard = 0
+    node.router = RoutingTable(make_partitioner(MOD, len(SHARDS)))
+    node.cur_time = clock(SHARDS[0], [5, 0])
+    node.applied = {}
+    node.peer_applied = {}
+    node.unrecorded = set()
+    node.update_seq = 0
+    node.update_log = {}
+    node.update_request_ids = {}
+    node.clock_lock = threading.RLock()
+    node.update_lock = threading.RLock()
+    return node
+
+
+def key_in(node, shard_id, skip=0):
+    keys = (key for key in ("key{}".format(i) for i in range(1000))
+            if node.hash(key) == shard_id)
+    for _ in range(skip):
+        next(keys)
+    return next(keys)
+
+
+class TestDominates(unittest.TestCase):
+    def test_same_layout(self):
+        self.assertTrue(clock(SHARDS[0], [3, 2]).dominates(clock(SHARDS[0], [3, 1])))
+        self.assertTrue(clock(SHARDS[0], [3, 2]).dominates(clock(SHARDS[0], [3, 2])))
+        self.assertFalse(clock(SHARDS[0], [3, 2]).dominates(clock(SHARDS[0], [2, 3])))
+        self.assertTrue(clock(SHARDS[0], [0, 0]).dominates(None))
+
+    def test_other_layout(self):
+        # a clock decoded from JSON has its own (reordered) layout
+        other = VectorClock.from_items(B, [(B, 1), (A, 2)])
+        self.assertTrue(clock(SHARDS[0], [2, 1]).dominates(other))
+        self.assertFalse(clock(SHARDS[0], [1, 1]).dominates(other))
+        # addrs we don't have count as 0
+        self.assertFalse(clock(SHARDS[0], [9, 9]).dominates(clock(SHARDS[1], [1, 0])))
+        self.assertTrue(clock(SHARDS[0], [9, 9]).dominates(clock(SHARDS[1], [0, 0])))
+
+
+class TestCompaction(unittest.TestCase):
+    def test_stable_frontier_is_min_of_replicas(self):
+        node = make_node()
+        # B never gossiped with us -- nothing is stable yet
+        self.assertEqual(list(node.stable_frontier().times), [0, 0])
+        node.learn_applied(B, {A: 3, B: 4})
+        self.assertEqual(node.applied[B], 4)
+        self.assertEqual(list(node.stable_frontier().times), [3, 4])
+        # an older message doesn't move the frontier back
+        node.learn_applied(B, {A: 3, B: 2})
+        self.assertEqual(node.applied[B], 4)
+
+    def test_own_frontier_waits_for_record_update(self):
+        node = make_node()
+        self.assertEqual(node.applied_frontier()[A], 5)
+        # ticked, but not in the update log yet -- gossip wouldn't carry it
+        version = node.tick()
+        self.assertEqual(version[A], 6)
+        self.assertEqual(node.applied_frontier()[A], 5)
+        node.record_update("key", version=version)
+        self.assertEqual(node.applied_frontier()[A], 6)
+
+    def test_compact_history(self):
+        node = make_node()
+        node.learn_applied(B, {A: 3, B: 4})
+        stable_key, fresh_key = key_in(node, 0), key_in(node, 0, 1)
+        other_shard_key = key_in(node, 1)
+        history = History()
+        history.insert(stable_key, clock(SHARDS[0], [2, 4]))
+        history.insert(fresh_key, clock(SHARDS[0], [5, 1]))
+        history.insert(other_shard_key, clock(SHARDS[1], [0, 0]))
+
+        node.compact_history(history)
+        # only my shard's stable entry goes -- I can't tell what's stable in another shard
+        self.assertEqual(sorted(history), sorted([fresh_key, other_shard_key]))
+
+        # once B has caught up the rest of my shard's entries go too
+        node.learn_applied(B, {A: 5, B: 4})
+        node.compact_history(history)
+        self.assertEqual(list(history), [other_shard_key])
+
+    def test_single_replica_shard(self):
+        node = make_node()
+        node.shards = [[A], SHARDS[1]]
+        node.cur_time = clock([A], [5])
+        history = History()
+        history.insert(key_in(node, 0), clock([A], [5]))
+        self.assertEqual(list(node.compact_history(history)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
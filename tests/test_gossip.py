@@ -0,0 +1,101 @@
+import os
+import unittest
+from vector_clock import VectorClock
+from history import History
+from node import Node
+
+# a shard of two replicas -- B is never started, we play its part by calling gossip_ack
+A, B = "127.0.0.1:13981", "127.0.0.1:13982"
+VIEW = ",".join([A, B])
+
+
+class TestUpdateLog(unittest.TestCase):
+    def setUp(self):
+        os.environ["ADDRESS"] = A
+        os.environ.pop("STORAGE_DIR", None)
+        self.node = Node(VIEW, 2)
+        self.addCleanup(self.node.close)
+
+    def from_b(self, seq, ack, log_id, ack_log_id):
+        return self.node.gossip_ack({}, {}, History(), VectorClock(B, [A, B]), B, seq=seq,
+                                    ack=ack, log_id=log_id, ack_log_id=ack_log_id)[0]
+
+    def test_ack_of_an_older_log_is_ignored(self):
+        node = self.node
+        old_log = node.log_id
+        # B saw 5 of my writes, then I restarted / changed views
+        node.reset_update_log()
+        self.from_b(1, 5, "b1", old_log)
+        for i in range(3):
+            node.local_put("key{}".format(i), "value", {})
+        self.assertEqual(node.update_seq, 3)
+        self.assertEqual(node.peer_acked.get(B, 0), 0)
+        self.assertEqual(sorted(node.updates_for(B)["items"]), ["key0", "key1", "key2"])
+
+    def test_ack_is_clamped_to_my_last_write(self):
+        node = self.node
+        node.local_put("key0", "value", {})
+        self.from_b(1, 5, "b1", node.log_id)
+        self.assertEqual(node.peer_acked[B], 1)
+        node.local_put("key1", "value", {})
+        self.assertEqual(list(node.updates_for(B)["items"]), ["key1"])
+
+    def test_new_log_of_the_peer_starts_over(self):
+        node = self.node
+        self.from_b(7, 0, "b1", node.log_id)
+        self.assertEqual(node.received_from[B], 7)
+        # an answer that arrives late doesn't move the cursor back
+        self.from_b(6, 0, "b1", node.log_id)
+        self.assertEqual(node.received_from[B], 7)
+        # B restarted -- its seqs start over
+        response = self.from_b(1, 0, "b2", node.log_id)
+        self.assertEqual(node.received_from[B], 1)
+        self.assertEqual((response["ack"], response["ack-log"]), (1, "b2"))
+
+
+class TestStableFrontier(unittest.TestCase):
+    def setUp(self):
+        os.environ["ADDRESS"] = A
+        os.environ.pop("STORAGE_DIR", None)
+        self.node = Node(VIEW, 2)
+        self.addCleanup(self.node.close)
+
+    def gossip_round(self):
+        """
+            what my gossip with B does to the frontiers: B applies the message and answers with
+            its applied frontier -- caught up with me as far as the message said
+        """
+        msg = self.node.updates_for(B)
+        self.node.learn_applied(B, {A: msg["applied"][A], B: 0})
+        return msg
+
+    def test_write_in_flight_is_not_compacted(self):
+        node = self.node
+        record_update = node.record_update
+        messages = []
+
+        def gossip_first(*args, **kwargs):
+            # a gossip round between the write's tick and its record_update
+            messages.append(self.gossip_round())
+            record_update(*args, **kwargs)
+
+        node.record_update = gossip_first
+        body, status = node.local_put("key", "value", {})
+        node.record_update = record_update
+        version = body["causal-context"]["high_clock_list"][0]
+
+        # the message didn't carry the write, so B doesn't have it -- its entry stays
+        self.assertNotIn("key", messages[0]["items"])
+        self.assertFalse(node.stable_frontier().dominates(version))
+        history = History()
+        history.insert("key", version)
+        self.assertEqual(list(node.compact_history(history)), ["key"])
+
+        # the next round carries it, after that it's stable
+        self.assertIn("key", self.gossip_round()["items"])
+        self.assertTrue(node.stable_frontier().dominates(version))
+        self.assertEqual(list(node.compact_history(history)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
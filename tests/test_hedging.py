@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import unittest
+import gevent
+import requests
+from flask import Flask
+from latency import LatencyTracker, DEFAULT_HEDGE_DELAY
+from partitioner import make_partitioner, RoutingTable, MOD
+from node import Node
+
+REPLICAS = ["10.10.0.2:13800", "10.10.0.3:13800", "10.10.0.4:13800"]
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakePeers:
+    """
+        stands in for PeerPool: every replica answers with a fixed status after a fixed delay
+        (status None => the request fails)
+    """
+
+    def __init__(self, replies):
+        self.replies = replies          # {addr : (delay, status)}
+        self.sent = []
+
+    def send(self, method, addr, path, **kwargs):
+        self.sent.append(addr)
+        delay, status = self.replies[addr]
+        gevent.sleep(delay)
+        if status is None:
+            raise requests.exceptions.ConnectionError("down")
+        return FakeResponse(status)
+
+
+def make_node(replies):
+    node = Node.__new__(Node)
+    node.peers = FakePeers(replies)
+    node.latency = LatencyTracker()
+    return node
+
+
+class TestLatencyTracker(unittest.TestCase):
+    def test_ewma_and_order(self):
+        tracker = LatencyTracker(alpha=0.5)
+        tracker.record("a", 0.1)
+        tracker.record("a", 0.3)
+        self.assertAlmostEqual(tracker.ewma["a"], 0.2)
+        tracker.record("b", 0.05)
+        # never-measured peers go first so they get measured
+        self.assertEqual(tracker.order(["a", "b", "c"]), ["c", "b", "a"])
+
+    def test_hedge_delay_is_percentile(self):
+        tracker = LatencyTracker(percentile=90)
+        self.assertEqual(tracker.hedge_delay("a"), DEFAULT_HEDGE_DELAY)
+        for i in range(1, 101):
+            tracker.record("a", i / 1000)
+        self.assertAlmostEqual(tracker.hedge_delay("a"), 0.091)
+
+
+class TestHedgedGet(unittest.TestCase):
+    def test_fast_replica_no_hedge(self):
+        node = make_node({REPLICAS[0]: (0.001, 200), REPLICAS[1]: (0.001, 200),
+                          REPLICAS[2]: (0.001, 200)})
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertEqual((response.status_code, addr), (200, REPLICAS[0]))
+        self.assertEqual(node.peers.sent, [REPLICAS[0]])
+
+    def test_slow_replica_gets_hedged(self):
+        node = make_node({REPLICAS[0]: (0.4, 200), REPLICAS[1]: (0.01, 200),
+                          REPLICAS[2]: (0.01, 200)})
+        start = time.monotonic()
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(addr, REPLICAS[1])
+        # exactly one hedge, not a broadcast
+        self.assertEqual(node.peers.sent, REPLICAS[:2])
+
+    def test_not_found_is_an_answer(self):
+        # the replica passed the causal check -- no other replica is asked
+        node = make_node({REPLICAS[0]: (0.001, 404), REPLICAS[1]: (0.001, 200),
+                          REPLICAS[2]: (0.001, 200)})
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertEqual((response.status_code, addr), (404, REPLICAS[0]))
+        self.assertEqual(node.peers.sent, REPLICAS[:1])
+
+    def test_error_moves_on(self):
+        node = make_node({REPLICAS[0]: (0.001, 503), REPLICAS[1]: (0.001, None),
+                          REPLICAS[2]: (0.001, 404)})
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertEqual((response.status_code, addr), (404, REPLICAS[2]))
+
+    def test_nack_moves_on(self):
+        node = make_node({REPLICAS[0]: (0.001, 400), REPLICAS[1]: (0.001, 200),
+                          REPLICAS[2]: (0.001, 200)})
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertEqual((response.status_code, addr), (200, REPLICAS[1]))
+        self.assertEqual(node.peers.sent, REPLICAS[:2])
+
+    def test_all_bad(self):
+        node = make_node({REPLICAS[0]: (0.001, 400), REPLICAS[1]: (0.001, None),
+                          REPLICAS[2]: (0.001, None)})
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertEqual((response.status_code, addr), (400, REPLICAS[0]))
+        node = make_node({addr: (0.001, None) for addr in REPLICAS})
+        self.assertEqual(node.hedged_get(REPLICAS, "/kvs/keys/k"), (None, None))
+
+    def test_prefers_fastest(self):
+        node = make_node({REPLICAS[0]: (0.001, 200), REPLICAS[1]: (0.001, 200),
+                          REPLICAS[2]: (0.001, 200)})
+        node.latency.record(REPLICAS[0], 0.2)
+        node.latency.record(REPLICAS[1], 0.1)
+        node.latency.record(REPLICAS[2], 0.01)
+        response, addr = node.hedged_get(REPLICAS, "/kvs/keys/k")
+        self.assertEqual(addr, REPLICAS[2])
+
+
+class FakeWriteResponse:
+    status_code = 201
+    headers = {"Content-Type": "application/json"}
+
+    def json(self):
+        return {"message": "Added successfully"}
+
+
+class TestProxiedPut(unittest.TestCase):
+    """
+        the coordinator times out (it may have written the key anyway), the write fails over
+    """
+
+    def setUp(self):
+        os.environ["ADDRESS"] = "10.10.0.9:13800"
+        self.node = Node.__new__(Node)
+        self.node.shards = [REPLICAS]
+        self.node.router = RoutingTable(make_partitioner(MOD, 1))
+        self.node.peers = self
+        self.sent = []
+
+    def send(self, method, addr, path, data=None, **kwargs):
+        self.sent.append(data)
+        if len(self.sent) == 1:
+            raise requests.exceptions.Timeout("timed out")
+        return FakeWriteResponse()
+
+    def put(self, body):
+        with Flask(__name__).test_request_context("/kvs/keys/k", method="PUT", json=body):
+            return self.node.put("k")
+
+    def test_proxy_gives_it_a_request_id(self):
+        body, status = self.put({"value": "v", "causal-context": {}})
+        self.assertEqual(status, 201)
+        self.assertEqual(len(self.sent), 2)
+        # both replicas got the same ID
+        self.assertEqual(self.sent[0], self.sent[1])
+        forwarded = json.loads(self.sent[0])
+        self.assertEqual(forwarded["value"], "v")
+        self.assertTrue(forwarded["request-id"])
+
+    def test_client_request_id_is_kept(self):
+        self.put({"value": "v", "causal-context": {}, "request-id": "mine"})
+        self.assertEqual([json.loads(data)["request-id"] for data in self.sent], ["mine", "mine"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import random
+import unittest
+from vector_clock import VectorClock
+from history import History
+from merkle import MerkleTree
+
+ADDRS = ["10.10.0.2:13800", "10.10.0.3:13800"]
+
+
+def fill(num_keys):
+    kvs, versions = {}, History()
+    clock = VectorClock(ADDRS[0], ADDRS)
+    for i in range(num_keys):
+        clock.increment()
+        kvs["key{}".format(i)] = "value{}".format(i)
+        versions.insert("key{}".format(i), clock)
+    return kvs, versions
+
+
+def walk(tree_a, tree_b):
+    """
+        the same descent Node.anti_entropy does over HTTP
+        returns (divergent leaf buckets, number of hashes requested)
+    """
+    level, indexes, requested = 0, [0], 0
+    while True:
+        requested += len(indexes)
+        diverged = [index for index, mine, theirs
+                    in zip(indexes, tree_a.hashes(level, indexes), tree_b.hashes(level, indexes))
+                    if mine != theirs]
+        if not diverged or level == tree_a.depth:
+            return diverged, requested
+        level, indexes = level + 1, tree_a.children(diverged)
+
+
+class TestMerkleTree(unittest.TestCase):
+    def test_incremental_matches_rebuild(self):
+        kvs, versions = fill(500)
+        incremental = MerkleTree(6)
+        for key in random.sample(list(kvs), len(kvs)):
+            incremental.update(key, kvs[key], versions[key])
+        rebuilt = MerkleTree(6)
+        rebuilt.rebuild(kvs, versions)
+        self.assertEqual(incremental.levels, rebuilt.levels)
+        self.assertNotEqual(rebuilt.root(), 0)
+
+    def test_remove_and_overwrite(self):
+        kvs, versions = fill(50)
+        tree = MerkleTree(4)
+        tree.rebuild(kvs, versions)
+        root = tree.root()
+        tree.update("extra", "x", None)
+        self.assertNotEqual(tree.root(), root)
+        tree.remove("extra")
+        self.assertEqual(tree.root(), root)
+        self.assertEqual(sum(len(bucket) for bucket in tree.buckets), 50)
+
+        # rewriting the same version changes nothing, a newer one does
+        tree.update("key1", kvs["key1"], versions["key1"])
+        self.assertEqual(tree.root(), root)
+        tree.update("key1", "new value", versions["key1"])
+        self.assertNotEqual(tree.root(), root)
+
+    def test_home_address_does_not_matter(self):
+        clock_a = VectorClock(ADDRS[0], ADDRS)
+        clock_b = VectorClock(ADDRS[1], ADDRS)
+        tree_a, tree_b = MerkleTree(3), MerkleTree(3)
+        tree_a.update("k", "v", clock_a)
+        tree_b.update("k", "v", clock_b)
+        self.assertEqual(tree_a.root(), tree_b.root())
+
+    def test_descent_finds_only_divergent_keys(self):
+        kvs, versions = fill(5000)
+        tree_a, tree_b = MerkleTree(10), MerkleTree(10)
+        tree_a.rebuild(kvs, versions)
+        tree_b.rebuild(kvs, versions)
+        self.assertEqual(walk(tree_a, tree_b), ([], 1))
+
+        changed = ["key7", "key1234", "key4999"]
+        clock = VectorClock(ADDRS[1], ADDRS)
+        for key in changed:
+            clock.increment()
+            tree_b.update(key, "changed", clock)
+        tree_b.update("only-on-b", "v", None)
+
+        diverged, requested = walk(tree_a, tree_b)
+        self.assertLessEqual(len(diverged), len(changed) + 1)
+        for key in changed + ["only-on-b"]:
+            self.assertIn(key, tree_b.keys_in(diverged))
+        # the bucket exchange only carries a handful of the 5000 keys
+        self.assertLess(len(tree_a.keys_in(diverged)), 50)
+        # and the descent asks for at most 2 hashes per divergent key per level
+        self.assertLessEqual(requested, 1 + 2 * 4 * tree_a.depth)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from node import Node
+from partitioner import from_routing
+
+# A alone, then A and B as two shards of one replica -- B is never started
+A, B = "127.0.0.1:13993", "127.0.0.1:13994"
+KEYS = ["key{}".format(i) for i in range(50)]
+
+
+class TestOnlineReshard(unittest.TestCase):
+    def setUp(self):
+        os.environ["ADDRESS"] = A
+        os.environ.pop("STORAGE_DIR", None)
+        self.node = Node(A, 1)
+        self.addCleanup(self.node.close)
+        for key in KEYS:
+            self.node.local_put(key, "old" + key, {})
+
+    def begin(self, old_shards):
+        self.node.begin_migration(",".join([A, B]), 1, 1, self.node.routing, old_shards)
+        self.mine = [key for key in KEYS if self.node.hash(key) == self.node.this_shard]
+        self.others = [key for key in KEYS if key not in self.mine]
+
+    def begin_as_new_node(self):
+        # as if B had every key in the old view and A just joined: A's reads of its keys fall
+        # back to B's retired kvs (played by a dict)
+        self.begin([[B]])
+        retired_on_b = {key: "b" + key for key in KEYS}
+        self.node.fetch_retired = lambda replica, key: (
+            (retired_on_b[key], None) if replica == B and key in retired_on_b else None)
+
+    def get(self, key):
+        history, high_clock_list, view_id = self.node.decode_context({})
+        return self.node.waiting_get(key, history, high_clock_list, view_id, 0)
+
+    def test_keeps_what_it_still_owns(self):
+        node = self.node
+        self.begin([[A]])
+        self.assertEqual((node.current_view, len(node.shards)), (1, 2))
+        self.assertEqual(sorted(node.local_kvs), sorted(self.mine))
+        self.assertEqual(len(node.retired_kvs), len(KEYS))
+        self.assertEqual(node.migrating, {0})
+        self.assertEqual(node.topology()[0]["migrating"], [0])
+        self.assertEqual(self.get(self.mine[0])[0]["value"], "old" + self.mine[0])
+        # the view changed under a request for another shard's key
+        self.assertEqual(self.get(self.others[0])[1], 503)
+
+    def test_reads_fall_back_until_migrated(self):
+        self.begin_as_new_node()
+        self.assertEqual(len(self.node.local_kvs), 0)
+        key = self.mine[0]
+        body, status = self.get(key)
+        self.assertEqual((status, body["value"]), (200, "b" + key))
+        missing = next(key for key in ("missing{}".format(i) for i in range(100))
+                       if self.node.hash(key) == self.node.this_shard)
+        self.assertEqual(self.get(missing)[1], 404)
+
+        self.node.confirm_migrated(0)
+        self.assertEqual(self.get(key)[1], 404)
+        self.assertEqual(self.node.retired_kvs, {})
+
+    def test_new_writes_beat_migrated_keys(self):
+        self.begin_as_new_node()
+        written, moved = self.mine[:2]
+        self.node.local_put(written, "new", {})
+        self.node.put_payload([{"payload": {written: "b", moved: "b"}}])
+        self.assertEqual(self.get(written)[0]["value"], "new")
+        self.assertEqual(self.get(moved)[0]["value"], "b")
+
+    def test_one_view_change_at_a_time(self):
+        self.begin([[A]])
+        body, status = self.node.try_reshard(A, 1)
+        self.assertEqual((status, body["migrating"]), (503, [0]))
+
+    def test_plan_moves(self):
+        # A alone -> A and B: only the keys B owns now go, to B
+        body, status = self.node.plan_moves(",".join([A, B]), 1)
+        self.assertEqual(status, 200)
+        [move] = body["moves"]
+        to_b = [key for key in KEYS
+                if from_routing(self.node.routing, 2).shard(key) == 1]
+        self.assertEqual((move["from"], move["to"], move["keys"]), (A, B, len(to_b)))
+        self.assertEqual(move["bytes"], sum(len(key) + len("old" + key) for key in to_b))
+        # -> A and B as one shard of two replicas: everything goes to B
+        [move] = self.node.plan_moves(",".join([A, B]), 2)[0]["moves"]
+        self.assertEqual((move["to"], move["keys"]), (B, len(KEYS)))
+
+    def test_dry_run_is_online_only(self):
+        body, status = self.node.try_reshard(",".join([A, B]), 1, online=False, dry_run=True)
+        self.assertEqual((status, body["mode"]), (400, "offline"))
+        # (VIEW_CHANGE_MODE defaults to online)
+        body, status = self.node.try_reshard(",".join([A, B]), 1, dry_run=True)
+        self.assertEqual(body["mode"], "online")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+from partitioner import (make_partitioner, routing_from_environ, from_routing, RoutingTable,
+                         coordinator_order, MOD, RING, RENDEZVOUS, BLAKE2B)
+
+KEYS = ["key{}".format(i) for i in range(20000)]
+
+
+def placement(name, num_shards, hash_name="md5"):
+    part = make_partitioner(name, num_shards, hash_name=hash_name)
+    return [part.shard(key) for key in KEYS]
+
+
+def fraction_moved(name, old_shards, new_shards):
+    old = placement(name, old_shards)
+    new = placement(name, new_shards)
+    return sum(1 for a, b in zip(old, new) if a != b) / len(KEYS), old, new
+
+
+class TestPartitioner(unittest.TestCase):
+    def test_shard_ids_in_range(self):
+        for name in (MOD, RING, RENDEZVOUS):
+            for num_shards in (1, 2, 5):
+                shard_ids = set(placement(name, num_shards))
+                self.assertEqual(shard_ids, set(range(num_shards)), name)
+
+    def test_mod_is_the_original_placement(self):
+        import hashlib
+        part = make_partitioner(MOD, 3)
+        for key in KEYS[:100]:
+            self.assertEqual(part.shard(key),
+                             int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % 3)
+
+    def test_growing_moves_about_one_over_n_plus_one(self):
+        print()
+        for num_shards in range(1, 9):
+            expected = 1 / (num_shards + 1)
+            mod_moved = fraction_moved(MOD, num_shards, num_shards + 1)[0]
+            for name in (RING, RENDEZVOUS):
+                moved, old, new = fraction_moved(name, num_shards, num_shards + 1)
+                print("{:>10} {} -> {} shards: moved {:.3f} (ideal {:.3f}, mod {:.3f})".format(
+                    name, num_shards, num_shards + 1, moved, expected, mod_moved))
+                self.assertLess(abs(moved - expected), 0.35 * expected, name)
+                # keys only ever move onto the new shard
+                for a, b in zip(old, new):
+                    if a != b:
+                        self.assertEqual(b, num_shards)
+            if num_shards > 1:
+                self.assertGreater(mod_moved, 0.45)
+
+    def test_shrinking_moves_only_the_removed_shard(self):
+        for name in (RING, RENDEZVOUS):
+            for num_shards in range(2, 8):
+                moved, old, new = fraction_moved(name, num_shards, num_shards - 1)
+                for a, b in zip(old, new):
+                    if a != b:
+                        self.assertEqual(a, num_shards - 1)
+                self.assertLess(abs(moved - 1 / num_shards), 0.35 / num_shards, name)
+
+    def test_ring_is_balanced(self):
+        num_shards = 4
+        counts = [0] * num_shards
+        for shard_id in placement(RING, num_shards):
+            counts[shard_id] += 1
+        for count in counts:
+            self.assertLess(abs(count - len(KEYS) / num_shards), 0.25 * len(KEYS) / num_shards)
+
+    def test_unknown_partitioner(self):
+        with self.assertRaises(ValueError):
+            make_partitioner("nope", 2)
+        with self.assertRaises(ValueError):
+            routing_from_environ({"HASH": "nope"})
+
+    def test_blake2b_placement(self):
+        for name in (MOD, RING, RENDEZVOUS):
+            shard_ids = placement(name, 4, BLAKE2B)
+            self.assertEqual(set(shard_ids), set(range(4)))
+            self.assertNotEqual(shard_ids, placement(name, 4))
+        old, new = placement(RING, 4, BLAKE2B), placement(RING, 5, BLAKE2B)
+        moved = sum(1 for a, b in zip(old, new) if a != b) / len(KEYS)
+        self.assertLess(abs(moved - 0.2), 0.07)
+
+    def test_routing_settings(self):
+        routing = routing_from_environ({"PARTITIONER": RING, "HASH": BLAKE2B, "VNODES": "16"})
+        self.assertEqual(routing, {"partitioner": RING, "hash": BLAKE2B, "vnodes": 16})
+        part = from_routing(routing, 3)
+        self.assertEqual((part.name, part.hash_name, part.vnodes), (RING, BLAKE2B, 16))
+        # views logged before the hash was recorded fall back to md5
+        self.assertEqual(from_routing({"partitioner": MOD}, 3).hash_name, "md5")
+
+    def test_coordinator_order(self):
+        replicas = ["10.10.0.2:13800", "10.10.0.3:13800", "10.10.0.4:13800"]
+        part = make_partitioner(MOD, 2)
+        firsts = {}
+        for key in KEYS[:3000]:
+            order = coordinator_order(key, replicas)
+            # every replica once, and the same key always starts at the same one
+            self.assertEqual(sorted(order), replicas)
+            self.assertEqual(order, coordinator_order(key, replicas))
+            firsts.setdefault((part.shard(key), order[0]), 0)
+            firsts[(part.shard(key), order[0])] += 1
+        # the keys of every shard spread over all of its replicas
+        self.assertEqual(len(firsts), 2 * len(replicas))
+        for count in firsts.values():
+            self.assertGreater(count, 3000 / 6 * 0.8)
+
+
+class TestRoutingTable(unittest.TestCase):
+    def test_cache_matches_partitioner(self):
+        part = make_partitioner(RING, 5)
+        router = RoutingTable(part, cache_size=100)
+        for _ in range(2):
+            for key in KEYS[:500]:
+                self.assertEqual(router.shard(key), part.shard(key))
+
+    def test_lru_eviction(self):
+        router = RoutingTable(make_partitioner(MOD, 3), cache_size=3)
+        for key in ("a", "b", "c"):
+            router.shard(key)
+        router.shard("a")           # a is now the most recently used
+        router.shard("d")           # so b gets evicted
+        self.assertEqual(list(router.cache), ["c", "a", "d"])
+
+    def test_reset_invalidates(self):
+        router = RoutingTable(make_partitioner(MOD, 1))
+        self.assertEqual(router.shard("key1"), 0)
+        router.reset(make_partitioner(MOD, 7))
+        self.assertEqual(len(router.cache), 0)
+        self.assertEqual(router.shard("key1"), make_partitioner(MOD, 7).shard("key1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
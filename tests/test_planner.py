@@ -0,0 +1,35 @@
+import unittest
+from planner import shards_of, moves, summary, entry_bytes
+
+A, B, C, D, E, F = ("10.0.0.{}:13800".format(i) for i in range(1, 7))
+
+
+class TestPlanner(unittest.TestCase):
+    def test_shards_of(self):
+        self.assertEqual(shards_of([D, A, C, B], 2), [[A, B], [C, D]])
+        # like Node.set_shards_and_view: the sorted view, repl_factor addresses per shard
+        self.assertEqual(shards_of([A, B, C, D, E, F], 3), [[A, B, C], [D, E, F]])
+
+    def test_only_new_replicas_get_keys(self):
+        # old shard [A, B] -> new shards [A, C] and [D, B]
+        plan = moves([A, B], [[A, C], [D, B]], [("x", 0), ("y", 1), ("z", 0)])
+        self.assertEqual(plan, {C: ["x", "z"], D: ["y"]})
+
+    def test_nothing_to_move(self):
+        self.assertEqual(moves([A, B], [[A, B]], [("x", 0), ("y", 0)]), {})
+
+    def test_stale_copies_get_fixed(self):
+        plan = moves([A, B], [[A, B], [C, D]], [("x", 0), ("y", 1)], stale={B: {"x"}, E: {"y"}})
+        self.assertEqual(plan, {B: ["x"], C: ["y"], D: ["y"]})
+
+    def test_summary(self):
+        plan = {C: ["x", "yy"], B: ["x"]}
+        self.assertEqual(summary(A, plan, len), [
+            {"from": A, "to": B, "keys": 1, "bytes": 1},
+            {"from": A, "to": C, "keys": 2, "bytes": 3}])
+        self.assertEqual(entry_bytes("k", "vä"), 4)
+        self.assertEqual(entry_bytes("k", None), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from partitioner import from_routing, MOD, RING, RENDEZVOUS
+from rehash import Rehasher
+
+KEYS = ["key{}".format(i) for i in range(5000)]
+
+
+class TestRehasher(unittest.TestCase):
+    def test_parallel_matches_serial(self):
+        rehasher = Rehasher(workers=2, min_keys=1000)
+        try:
+            for name in (MOD, RING, RENDEZVOUS):
+                routing = {"partitioner": name, "hash": "md5", "vnodes": 16}
+                part = from_routing(routing, 3)
+                self.assertEqual(list(rehasher.shards(KEYS, part, routing)),
+                                 [part.shard(key) for key in KEYS], name)
+        finally:
+            rehasher.close()
+
+    def test_small_store_stays_in_process(self):
+        rehasher = Rehasher(workers=2, min_keys=len(KEYS) + 1)
+        routing = {"partitioner": MOD, "hash": "md5"}
+        part = from_routing(routing, 4)
+        self.assertEqual(rehasher.shards(KEYS, part, routing), [part.shard(key) for key in KEYS])
+        self.assertIsNone(rehasher.pool)
+
+    def test_from_environ(self):
+        rehasher = Rehasher.from_environ({"REHASH_WORKERS": "1", "REHASH_MIN_KEYS": "10"})
+        self.assertEqual((rehasher.workers, rehasher.min_keys), (1, 10))
+        self.assertFalse(rehasher.parallel(100))
+        self.assertGreaterEqual(Rehasher.from_environ({}).workers, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
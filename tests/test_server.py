@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import socket
+import signal
+import unittest
+import threading
+import subprocess
+import http.client
+
+# a server with one slow endpoint, in its own process so it can get SIGTERM
+APP = """
+from gevent import monkey
+monkey.patch_all()
+import os, time
+from flask import Flask
+from server import Server
+
+class FakeNode:
+    def close(self):
+        print("node closed", flush=True)
+
+app = Flask(__name__)
+
+@app.route("/slow")
+def slow():
+    time.sleep(1)
+    return "done"
+
+Server.from_environ(app, os.environ).serve(FakeNode())
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestServer(unittest.TestCase):
+    def start(self, **settings):
+        self.port = free_port()
+        env = dict(os.environ, HOST="127.0.0.1", PORT=str(self.port), **settings)
+        self.proc = subprocess.Popen([sys.executable, "-c", APP], env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                     universal_newlines=True)
+        self.addCleanup(self.proc.kill)
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        self.fail("server did not start")
+
+    def connection(self):
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+
+    def test_keep_alive(self):
+        self.start()
+        conn = self.connection()
+        sockets = []
+        for _ in range(2):
+            conn.request("GET", "/missing")
+            response = conn.getresponse()
+            response.read()
+            self.assertEqual(response.status, 404)
+            sockets.append(conn.sock)
+        # both requests went over the same connection
+        self.assertIsNotNone(sockets[0])
+        self.assertIs(sockets[0], sockets[1])
+        conn.close()
+
+    def test_keep_alive_disabled(self):
+        self.start(KEEPALIVE="0")
+        conn = self.connection()
+        conn.request("GET", "/missing")
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.getheader("Connection"), "close")
+        self.assertIsNone(conn.sock)
+        conn.close()
+
+    def test_graceful_shutdown(self):
+        self.start()
+        # an idle keep-alive connection shouldn't hold up the shutdown
+        idle = self.connection()
+        idle.request("GET", "/missing")
+        idle.getresponse().read()
+
+        result = {}
+
+        def slow_request():
+            conn = self.connection()
+            conn.request("GET", "/slow")
+            response = conn.getresponse()
+            result["response"] = (response.status, response.read())
+
+        request = threading.Thread(target=slow_request)
+        request.start()
+        time.sleep(0.3)
+        start = time.monotonic()
+        self.proc.send_signal(signal.SIGTERM)
+        request.join()
+        self.assertEqual(self.proc.wait(timeout=5), 0)
+        # the request in flight finished, and nothing waited for the idle connection
+        self.assertEqual(result["response"], (200, b"done"))
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertIn("node closed", self.proc.stdout.read())
+        # no longer accepting
+        self.assertRaises(OSError, socket.create_connection, ("127.0.0.1", self.port), 1)
+        idle.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
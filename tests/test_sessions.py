@@ -0,0 +1,114 @@
+import unittest
+from vector_clock import VectorClock
+from history import History
+import wire
+import sessions
+from sessions import SessionStore
+
+ADDRS = ["10.10.0.2:13800", "10.10.0.3:13800"]
+
+
+def clock(*times):
+    vc = VectorClock(ADDRS[0], ADDRS)
+    for addr, time in zip(ADDRS, times):
+        vc.set(addr, time)
+    return vc
+
+
+def context(entries, high_clock, view=0):
+    history = History()
+    for key, times in entries.items():
+        history.insert(key, clock(*times))
+    return {"history": history, "high_clock_list": [high_clock, None], "current_view": view}
+
+
+class TestTokens(unittest.TestCase):
+    def test_round_trip(self):
+        token = sessions.make_token("abc", 3, 17)
+        self.assertEqual(sessions.parse_token(token), ("abc", 3, 17))
+        self.assertEqual(sessions.parse_token(""), (None, None, 0))
+        self.assertRaises(ValueError, sessions.parse_token, "garbage")
+
+
+class TestDelta(unittest.TestCase):
+    def test_only_changes(self):
+        ctx = context({"a": (1, 0), "b": (2, 0)}, clock(2, 0))
+        before = sessions.snapshot(ctx)
+        self.assertIsNone(sessions.context_delta(before, ctx))
+
+        # a request writes c and compaction drops a
+        ctx["history"].insert("c", clock(3, 0))
+        del ctx["history"].hist["a"]
+        ctx["high_clock_list"][0] = clock(3, 0)
+        delta = sessions.context_delta(before, ctx)
+        self.assertEqual(list(delta["history"]), ["c"])
+        self.assertEqual(list(delta["drop"]), ["a"])
+        self.assertEqual(delta["high_clock_list"][0].times, [3, 0])
+
+        # the delta survives the trip to the owner
+        decoded = wire.loads(wire.dumps(delta))
+        self.assertEqual(list(wire.to_history(decoded["drop"])), ["a"])
+
+
+class TestSessionStore(unittest.TestCase):
+    def test_apply_merges_deltas(self):
+        store = SessionStore()
+        ctx = context({"a": (1, 0)}, clock(1, 0))
+        delta = sessions.context_delta(sessions.snapshot({}), ctx)
+        self.assertEqual(store.apply("s", delta, 0), 1)
+
+        # two requests that both started from version 1
+        first = {"history": History(), "drop": History(), "high_clock_list": [clock(2, 0), None],
+                 "current_view": 0}
+        first["history"].insert("b", clock(2, 0))
+        second = {"history": History(), "drop": History(), "high_clock_list": [clock(1, 1), None],
+                  "current_view": 0}
+        second["history"].insert("c", clock(1, 1))
+        self.assertEqual(store.apply("s", first, 1), 2)
+        self.assertEqual(store.apply("s", second, 1), 3)
+
+        version, merged = store.get("s")
+        self.assertEqual(version, 3)
+        self.assertEqual(sorted(merged["history"]), ["a", "b", "c"])
+        self.assertEqual(merged["high_clock_list"][0].times, [2, 1])
+
+    def test_drop_keeps_newer_entries(self):
+        store = SessionStore()
+        store.put("s", 1, context({"a": (1, 0), "b": (1, 0)}, clock(1, 0)))
+        delta = {"history": History(), "drop": History(), "high_clock_list": [None, None],
+                 "current_view": 0}
+        delta["drop"].insert("a", clock(1, 0))
+        # b was rewritten by another request since this one read it
+        delta["drop"].insert("b", clock(0, 1))
+        store.apply("s", delta, 1)
+        self.assertEqual(list(store.get("s")[1]["history"]), ["b"])
+
+    def test_behind_and_newer_view(self):
+        store = SessionStore()
+        store.put("s", 2, context({"a": (1, 0)}, clock(1, 0)))
+        delta = sessions.context_delta(sessions.snapshot({}), context({"z": (0, 1)}, clock(0, 1), 1))
+        # the request started from a version we never saw
+        self.assertIsNone(store.apply("s", delta, 5))
+        # a newer view throws the old context away
+        self.assertEqual(store.apply("s", delta, 2), 3)
+        version, ctx = store.get("s")
+        self.assertEqual((list(ctx["history"]), ctx["current_view"]), (["z"], 1))
+
+    def test_copies_and_capacity(self):
+        store = SessionStore(capacity=2)
+        live = clock(1, 0)
+        store.put("s1", 1, context({}, live))
+        live.increment()
+        self.assertEqual(store.get("s1")[1]["high_clock_list"][0].times, [1, 0])
+        # an older version never replaces a newer one
+        store.put("s1", 0, context({"x": (5, 5)}, clock(5, 5)))
+        self.assertEqual(store.get("s1")[0], 1)
+        store.put("s2", 1, {})
+        store.get("s1")
+        store.put("s3", 1, {})
+        self.assertIsNone(store.get("s2"))
+        self.assertIsNotNone(store.get("s1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
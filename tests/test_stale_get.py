@@ -0,0 +1,73 @@
+import os
+import time
+import unittest
+from vector_clock import VectorClock
+from history import History
+from node import Node
+
+# a shard of two replicas -- B is never started, we play its part by calling gossip_ack
+A, B = "127.0.0.1:13995", "127.0.0.1:13996"
+VIEW = ",".join([A, B])
+
+
+class TestStaleGet(unittest.TestCase):
+    def setUp(self):
+        os.environ["ADDRESS"] = A
+        os.environ.pop("STORAGE_DIR", None)
+        self.node = Node(VIEW, 2)
+        self.addCleanup(self.node.close)
+        self.pulls = 0
+        self.node.pull = self.fake_pull
+
+    def from_b(self, key, value):
+        version = VectorClock(B, [A, B])
+        version.set(B, 1)
+        times = History()
+        times.hist[key] = version
+        self.node.gossip_ack({key: value}, {}, times, version, B, seq=1, ack=0)
+
+    def fake_pull(self, key, clock=None, timeout=None):
+        self.pulls += 1
+        return True
+
+    def test_max_staleness_option(self):
+        node = self.node
+        self.assertIsNone(node.max_staleness({}))
+        self.assertIsNone(node.max_staleness({"consistency": "causal"}))
+        self.assertEqual(node.max_staleness({"consistency": "any"}), float("inf"))
+        self.assertEqual(node.max_staleness({"max-staleness": "250"}), 0.25)
+        for args in ({"consistency": "strong"}, {"max-staleness": "-1"},
+                     {"max-staleness": "soon"}):
+            self.assertRaises(ValueError, node.max_staleness, args)
+
+    def test_any_reads_what_is_here(self):
+        # B never gossiped with us, but "any" doesn't care
+        self.node.local_put("key", "mine", {})
+        body, status = self.node.stale_get("key", float("inf"))
+        self.assertEqual((status, body["value"]), (200, "mine"))
+        self.assertNotIn("causal-context", body)
+        self.assertIsNone(body["replica-lag"])
+        self.assertLess(body["version-age"], 1000)
+        self.assertEqual(self.pulls, 0)
+
+        body, status = self.node.stale_get("missing", float("inf"))
+        self.assertEqual(status, 404)
+
+    def test_max_staleness(self):
+        self.from_b("key", "theirs")
+        time.sleep(0.1)
+        # heard from B just now
+        body, status = self.node.stale_get("key", 1)
+        self.assertEqual((status, body["value"]), (200, "theirs"))
+        self.assertGreaterEqual(body["replica-lag"], 100)
+        self.assertGreaterEqual(body["version-age"], 100)
+        self.assertEqual(self.pulls, 0)
+        # too long ago -- asks B for the key first
+        body, status = self.node.stale_get("key", 0.05)
+        self.assertEqual(status, 200)
+        self.assertLess(body["replica-lag"], 50)
+        self.assertEqual(self.pulls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
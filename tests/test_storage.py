@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+from vector_clock import VectorClock
+from history import History
+from storage import StorageEngine, WriteAheadLog, FSYNC_ALWAYS
+
+ADDRS = ["10.10.0.2:13800", "10.10.0.3:13800"]
+
+
+class TestStorageEngine(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "kvs.wal")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open_engine(self):
+        return StorageEngine(WriteAheadLog(self.path, FSYNC_ALWAYS),
+                             os.path.join(self.dir, "kvs.snap"))
+
+    def test_replay_restores_memtable(self):
+        engine = self.open_engine()
+        engine.log_view(ADDRS, 2, 3)
+        clock = VectorClock(ADDRS[0], ADDRS)
+        for i in range(10):
+            clock.increment()
+            hist = History()
+            hist.insert("key{}".format(i), clock)
+            engine.versions.insert("key{}".format(i), clock)
+            engine.write("key{}".format(i), "value{}".format(i), clock, hist)
+        engine.close()
+
+        engine = self.open_engine()
+        view = engine.recover()
+        self.assertEqual(view["current_view"], 3)
+        self.assertEqual(len(engine.kvs), 10)
+        self.assertEqual(engine.kvs["key9"], "value9")
+        self.assertEqual(engine.versions["key9"][ADDRS[0]], 10)
+        self.assertEqual(engine.item_history["key4"]["key4"][ADDRS[0]], 5)
+        engine.close()
+
+    def test_torn_tail_is_dropped(self):
+        engine = self.open_engine()
+        engine.write("a", "1", None)
+        engine.write("b", "2", None)
+        engine.close()
+        # simulate a crash in the middle of the last record
+        with open(self.path, "r+b") as log:
+            log.truncate(os.path.getsize(self.path) - 3)
+
+        engine = self.open_engine()
+        engine.recover()
+        self.assertEqual(engine.kvs, {"a": "1"})
+        # the log keeps working after the torn record was removed
+        engine.write("c", "3", None)
+        engine.close()
+        engine = self.open_engine()
+        engine.recover()
+        self.assertEqual(engine.kvs, {"a": "1", "c": "3"})
+        engine.close()
+
+    def test_checkpoint_compacts_log(self):
+        engine = self.open_engine()
+        for i in range(100):
+            engine.write("hot", str(i), None)
+        size = os.path.getsize(self.path)
+        engine.checkpoint()
+        self.assertLess(os.path.getsize(self.path), size)
+        engine.close()
+
+        engine = self.open_engine()
+        engine.recover()
+        self.assertEqual(engine.kvs, {"hot": "99"})
+        engine.close()
+
+    def test_snapshot_plus_tail(self):
+        engine = self.open_engine()
+        engine.log_view(ADDRS, 2, 1)
+        clock = VectorClock(ADDRS[1], ADDRS)
+        for i in range(50):
+            clock.increment()
+            engine.versions.insert("key{}".format(i), clock)
+            engine.write("key{}".format(i), i, clock)
+        engine.snapshot()
+        # only the records written after the snapshot stay in the log
+        for i in range(50, 60):
+            engine.write("key{}".format(i), i, None)
+        engine.write("key0", "overwritten", None)
+        engine.close()
+
+        engine = self.open_engine()
+        view = engine.recover()
+        self.assertEqual(view["view"], ",".join(ADDRS))
+        self.assertEqual(len(engine.kvs), 60)
+        self.assertEqual(engine.kvs["key0"], "overwritten")
+        self.assertEqual(engine.kvs["key49"], 49)
+        self.assertEqual(engine.versions["key49"][ADDRS[1]], 50)
+        self.assertEqual(engine.versions["key49"].addr, ADDRS[1])
+        self.assertEqual(engine.snapshot_lsn, 51)
+        self.assertEqual(engine.log.lsn, 62)
+        engine.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
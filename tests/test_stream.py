@@ -0,0 +1,45 @@
+import io
+import unittest
+from vector_clock import VectorClock
+from history import History
+import stream
+
+
+class TestStream(unittest.TestCase):
+    def test_split_bounds_chunks(self):
+        items = [("key{}".format(i), "v" * 100) for i in range(1000)]
+        chunks = list(stream.split(items, 4096))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            size = sum(len(k) + len(v) + stream.ENTRY_OVERHEAD for k, v in chunk.items())
+            self.assertLess(size, 4096 + 200)
+        merged = {}
+        for chunk in chunks:
+            merged.update(chunk)
+        self.assertEqual(merged, dict(items))
+
+    def test_split_nothing(self):
+        self.assertEqual(list(stream.split([], 4096)), [])
+
+    def test_frames_round_trip(self):
+        clock = VectorClock("a:1", ["a:1", "b:2"])
+        clock.increment()
+        history = History()
+        history.hist["key0"] = clock
+        chunks = [{"keys": {"key0": "x"}, "history": history}, {"payload": {"key1": "y"}}]
+        data = b"".join(stream.frames(chunks))
+        decoded = list(stream.read_frames(io.BufferedReader(io.BytesIO(data), 7)))
+        self.assertEqual(decoded[1], {"payload": {"key1": "y"}})
+        self.assertEqual(decoded[0]["keys"], {"key0": "x"})
+        self.assertEqual(VectorClock.compare(decoded[0]["history"]["key0"], clock),
+                         VectorClock.EQUAL)
+
+    def test_truncated(self):
+        data = b"".join(stream.frames([{"payload": {"key": "value"}}]))
+        for cut in (2, len(data) - 1):
+            with self.assertRaises(ValueError):
+                list(stream.read_frames(io.BytesIO(data[:cut])))
+
+
+if __name__ == '__main__':
+    unittest.main()
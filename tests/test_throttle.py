@@ -0,0 +1,45 @@
+import time
+import unittest
+from throttle import TokenBucket, Throttle, host_of
+
+
+class TestThrottle(unittest.TestCase):
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        self.assertEqual(bucket.take(10 ** 9), 0.0)
+        throttle = Throttle()
+        frames = [b"x" * 1000] * 5
+        self.assertEqual(list(throttle.frames("10.10.0.2:13800", frames)), frames)
+        self.assertEqual(throttle.stats()["seconds"], 0)
+        self.assertEqual(throttle.stats()["bytes"], 5000)
+
+    def test_bucket_paces(self):
+        # 20000 bytes at 100000/s with a 10000 burst: the first half goes at once
+        bucket = TokenBucket(100000, 10000)
+        start = time.monotonic()
+        waited = bucket.take(10000) + bucket.take(10000)
+        took = time.monotonic() - start
+        self.assertAlmostEqual(waited, 0.1, delta=0.02)
+        self.assertGreaterEqual(took, 0.09)
+
+    def test_frame_bigger_than_burst(self):
+        bucket = TokenBucket(100000, 1000)
+        self.assertAlmostEqual(bucket.take(11000), 0.1, delta=0.02)
+
+    def test_peer_rates(self):
+        throttle = Throttle.from_environ({"RESHARD_PEER_RATE": "100000", "RESHARD_BURST": "1000",
+                                          "RESHARD_PEER_RATES": "10.10.0.3=1000000"})
+        list(throttle.frames("10.10.0.2:13800", [b"x" * 1000] * 6))
+        list(throttle.frames("10.10.0.3:13800", [b"x" * 1000] * 6))
+        stats = throttle.stats()
+        self.assertAlmostEqual(stats["peers"]["10.10.0.2"], 0.05, delta=0.02)
+        self.assertLess(stats["peers"].get("10.10.0.3", 0), 0.02)
+        self.assertEqual(stats["bytes"], 12000)
+
+    def test_host_of(self):
+        self.assertEqual(host_of("10.10.0.2:13800"), "10.10.0.2")
+        self.assertEqual(host_of("10.10.0.2"), "10.10.0.2")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+import unittest
+from vector_clock import VectorClock
+from history import History
+from node import Node
+
+# a shard of two replicas -- B is never started, we play its part by calling gossip_ack
+A, B = "127.0.0.1:13993", "127.0.0.1:13994"
+VIEW = ",".join([A, B])
+
+
+def version(n):
+    clock = VectorClock(B, [A, B])
+    clock.set(B, n)
+    return clock
+
+
+class TestWaitingGet(unittest.TestCase):
+    def setUp(self):
+        os.environ["ADDRESS"] = A
+        os.environ.pop("STORAGE_DIR", None)
+        self.node = Node(VIEW, 2)
+        self.addCleanup(self.node.close)
+        self.pulls = 0
+        self.node.pull = self.fake_pull
+        self.pull_answer = None     # what B answers a pull with, if anything
+        self.from_b(1, "old")
+
+    def from_b(self, n, value):
+        times = History()
+        times.hist["key"] = version(n)
+        self.node.gossip_ack({"key": value}, {}, times, version(n), B, seq=n, ack=0)
+
+    def fake_pull(self, key, clock, timeout):
+        self.pulls += 1
+        if self.pull_answer is not None:
+            self.from_b(*self.pull_answer)
+        return self.node.has_version(key, clock)
+
+    def get(self, wait):
+        # a client that has already seen version 2 of the key
+        history = History()
+        history.hist["key"] = version(2)
+        start = time.monotonic()
+        body, status = self.node.waiting_get("key", history, [None], 0,
+                                             time.monotonic() + wait)
+        return body, status, time.monotonic() - start
+
+    def test_no_wait_nacks(self):
+        body, status, took = self.get(0)
+        self.assertEqual(status, 400)
+        self.assertEqual(self.pulls, 0)
+
+    def test_pull_answers(self):
+        self.pull_answer = (2, "new")
+        body, status, took = self.get(2)
+        self.assertEqual((status, body["value"]), (200, "new"))
+        self.assertEqual(self.pulls, 1)
+
+    def test_gossip_wakes_it_up(self):
+        timer = threading.Timer(0.1, self.from_b, (3, "newer"))
+        timer.start()
+        body, status, took = self.get(2)
+        timer.join()
+        self.assertEqual((status, body["value"]), (200, "newer"))
+        # woke up when the version landed, not at the next pull or the deadline
+        self.assertLess(took, 0.2)
+        self.assertEqual(self.node.version_waiters, {})
+
+    def test_deadline(self):
+        body, status, took = self.get(0.6)
+        self.assertEqual(status, 400)
+        self.assertGreaterEqual(took, 0.6)
+        self.assertLess(took, 1)
+        # pulled again every PULL_INTERVAL
+        self.assertGreater(self.pulls, 1)
+        self.assertEqual(self.node.version_waiters, {})
+
+    def test_pull_endpoint(self):
+        body, status = self.node.merkle_ack("pull", {
+            "keys": ["key", "missing"], "address": B, "current_view": 0,
+            "depth": self.node.storage.tree.depth})
+        self.assertEqual(status, 200)
+        self.assertEqual(body["items"], {"key": "old"})
+        self.assertEqual(VectorClock.compare(body["updated-key-times"]["key"], version(1)),
+                         VectorClock.EQUAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
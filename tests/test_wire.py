@@ -0,0 +1,106 @@
+import json
+import unittest
+from vector_clock import VectorClock
+from history import History, HistoryEncoder, LazyHistory
+import wire
+
+ADDRS = ["10.10.0.2:13800", "10.10.0.3:13800", "10.10.0.4:13800"]
+
+
+def make_history(n):
+    hist = History()
+    clock = VectorClock(ADDRS[0], ADDRS)
+    for i in range(n):
+        clock.increment()
+        hist.insert("key{}".format(i), clock)
+    hist.insert("deleted", None)
+    return hist
+
+
+class TestWire(unittest.TestCase):
+    def assertSameClock(self, clock_1, clock_2):
+        self.assertEqual(clock_1.addr, clock_2.addr)
+        self.assertEqual(list(clock_1.items()), list(clock_2.items()))
+
+    def test_plain_values_round_trip(self):
+        value = {"message": "ok", "n": -300, "big": 2 ** 40, "pi": 3.25, "flags": [True, False, None],
+                 "nested": {"list": ["a", "", "é"]}}
+        self.assertEqual(wire.loads(wire.dumps(value)), value)
+
+    def test_context_round_trip(self):
+        hist = make_history(20)
+        clock = VectorClock(ADDRS[1], ADDRS)
+        clock.increment()
+        context = {"history": hist, "high_clock_list": [clock, None], "current_view": 4}
+
+        decoded = wire.loads(wire.dumps({"causal-context": context}))["causal-context"]
+        self.assertEqual(decoded["current_view"], 4)
+        self.assertIsNone(decoded["high_clock_list"][1])
+        self.assertSameClock(decoded["high_clock_list"][0], clock)
+        self.assertIsNone(decoded["history"]["deleted"])
+        for key, hist_clock in hist.items():
+            if hist_clock is not None:
+                self.assertSameClock(decoded["history"][key], hist_clock)
+
+    def test_addresses_sent_once(self):
+        data = wire.dumps(make_history(50))
+        for addr in ADDRS:
+            self.assertEqual(data.count(addr.encode("utf-8")), 1)
+        # and it's much smaller than the double-encoded JSON it replaces
+        self.assertLess(len(data) * 4, len(HistoryEncoder().encode(make_history(50))))
+
+    def test_json_fallback(self):
+        hist = make_history(3)
+        clock = VectorClock(ADDRS[2], ADDRS)
+        old_style = json.loads(json.dumps({"history": hist, "clock": clock}, cls=wire.WireJSONEncoder))
+        # old clients see the usual embedded strings
+        self.assertEqual(old_style["history"], HistoryEncoder().encode(hist))
+        self.assertSameClock(wire.to_clock(old_style["clock"]), clock)
+        self.assertSameClock(wire.to_history(old_style["history"])["key2"], hist["key2"])
+        # already decoded values pass straight through
+        self.assertIs(wire.to_history(hist), hist)
+        self.assertIsNone(wire.to_clock(None))
+
+    def test_lazy_history(self):
+        hist = make_history(100)
+        raw = HistoryEncoder().encode(hist)
+        lazy = wire.lazy_history(raw)
+        self.assertIsInstance(lazy, LazyHistory)
+        self.assertEqual(len(lazy.hist), 101)
+        # looking a key up decodes only that clock
+        self.assertSameClock(lazy["key7"], hist["key7"])
+        self.assertIsNone(lazy["missing"])
+        self.assertIsNone(lazy["deleted"])
+        self.assertEqual(sorted(lazy.hist.decoded), ["deleted", "key7"])
+        # unchanged --> the very same string goes back out
+        self.assertEqual(json.loads(json.dumps({"history": lazy}, cls=wire.WireJSONEncoder))["history"], raw)
+
+        # changed --> untouched entries keep their strings, the rest is re-encoded
+        clock = VectorClock(ADDRS[0], ADDRS)
+        for _ in range(500):
+            clock.increment()
+        newer = History()
+        newer.insert("key3", clock)
+        newer.insert("new", clock)
+        self.assertEqual(sorted(lazy.merge(newer)), ["key3", "new"])
+        del lazy.hist["key9"]
+        self.assertEqual(len(lazy.hist.decoded), 4)
+        out = json.loads(json.dumps({"history": lazy}, cls=wire.WireJSONEncoder))["history"]
+        self.assertNotEqual(out, raw)
+        self.assertEqual(json.loads(out)["key50"], json.loads(raw)["key50"])
+        decoded = wire.to_history(out)
+        self.assertNotIn("key9", decoded)
+        self.assertSameClock(decoded["key3"], clock)
+        self.assertSameClock(decoded["new"], clock)
+        self.assertSameClock(decoded["key50"], hist["key50"])
+        # copies are plain Histories
+        self.assertNotIsInstance(lazy.copy(), LazyHistory)
+        self.assertEqual(len(lazy.copy().hist), 101)
+
+    def test_bad_version(self):
+        with self.assertRaises(ValueError):
+            wire.loads(b"\x09\x00N")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+    Micro-benchmark: array-backed VectorClock vs. the old dict-backed clock
+
+    run from the tests directory with src on the path:
+        PYTHONPATH=../src python vector_clock_bench.py [replica count]
+"""
+import sys
+import copy
+import timeit
+from vector_clock import VectorClock
+from history import History
+
+
+class DictVectorClock:
+    """
+        the previous implementation (dict keyed by "ip:port", deepcopy'd, try/except compare)
+    """
+    GREATER_THAN = 1
+    LESS_THAN = -1
+    EQUAL = 2
+
+    def __init__(self, this_addr, addr_list, v_clock=None):
+        if v_clock is None:
+            self.clock = dict.fromkeys(addr_list, 0)
+        else:
+            self.clock = copy.deepcopy(v_clock.clock)
+        self.addr = this_addr
+
+    @staticmethod
+    def compare(clock_1, clock_2):
+        bigger, smaller = False, False
+        try:
+            for addr, time in clock_1.clock.items():
+                if time > clock_2.clock[addr]:
+                    bigger = True
+                elif time < clock_2.clock[addr]:
+                    smaller = True
+        except:
+            pass
+        if (bigger and smaller):
+            if clock_1.addr <= clock_2.addr:
+                return DictVectorClock.GREATER_THAN
+            return DictVectorClock.LESS_THAN
+        if not (bigger or smaller):
+            return DictVectorClock.EQUAL
+        if bigger:
+            return DictVectorClock.GREATER_THAN
+        return DictVectorClock.LESS_THAN
+
+    def merge(self, clock_2):
+        for addr, time in self.clock.items():
+            try:
+                self.clock[addr] = max(time, clock_2.clock[addr])
+            except:
+                return
+
+    def increment(self):
+        self.clock[self.addr] += 1
+
+
+def make_pair(cls, addrs):
+    clock_1 = cls(addrs[0], addrs)
+    clock_2 = cls(addrs[-1], addrs)
+    for i, addr in enumerate(addrs):
+        clock_1.clock[addr] = i * 3
+        clock_2.clock[addr] = i * 3 + (1 if i % 2 else -1)
+    return clock_1, clock_2
+
+
+def per_op(stmt, namespace, number):
+    return min(timeit.repeat(stmt, globals=namespace, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    replicas = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    addrs = ["10.10.0.{}:13800".format(i + 2) for i in range(replicas)]
+    number = 100000
+
+    old_1, old_2 = make_pair(DictVectorClock, addrs)
+    new_1, new_2 = make_pair(VectorClock, addrs)
+    ops = [
+        ("compare", "cls.compare(c1, c2)"),
+        ("merge", "c1.merge(c2)"),
+        ("increment", "c1.increment()"),
+        ("copy (History.insert)", "copy_clock(c1)"),
+    ]
+    print("{} replicas, ns per operation".format(replicas))
+    print("{:<24} {:>10} {:>10} {:>9}".format("operation", "dict", "array", "speedup"))
+    for name, stmt in ops:
+        old = per_op(stmt, {"cls": DictVectorClock, "c1": old_1, "c2": old_2,
+                            "copy_clock": copy.deepcopy}, number)
+        new = per_op(stmt, {"cls": VectorClock, "c1": new_1, "c2": new_2,
+                            "copy_clock": VectorClock.copy}, number)
+        print("{:<24} {:>10.0f} {:>10.0f} {:>8.1f}x".format(name, old, new, old / new))
+
+    # end-to-end: History.insert of a fresh event into a history
+    hist = History()
+    clock = VectorClock(addrs[0], addrs)
+    new = per_op("clock.increment(); hist.insert('key', clock)",
+                 {"hist": hist, "clock": clock}, number)
+    print("{:<24} {:>10} {:>10.0f}".format("History.insert", "-", new))
+
+
+main()
@@ -0,0 +1,82 @@
+"""
+    Blocking GET benchmark: read-your-writes across nodes, with GETs NACKed right away
+    ("wait": 0, what clients always got before) vs. GETs that wait for the version
+    ("wait": WAIT seconds), against a running cluster
+
+    every round a client PUTs a key through one node and right away GETs it through
+    another, with the context of the PUT -- unless gossip already got the write to the
+    replica that answers, that replica doesn't have the version yet. A NACKed GET is retried
+    through the next node, like a client would. Reports the retries and GET latency.
+
+    run from the tests directory:
+        python waiting_get_bench.py [rounds] [node ports...]
+"""
+import sys
+import time
+import random
+import threading
+import requests
+
+DEFAULT_PORTS = [13802, 13803, 13804, 13805]
+WAIT = 1
+CLIENTS = 4
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def client(rounds, ports, wait, seed, results):
+    rng = random.Random(seed)
+    session = requests.Session()
+    context = {}
+    for i in range(rounds):
+        key = "wait-bench{}-{}".format(seed, rng.randrange(50))
+        put_port, get_port = rng.sample(ports, 2)
+        response = session.put("http://localhost:{}/kvs/keys/{}".format(put_port, key),
+                               json={"value": str(i), "causal-context": context})
+        context = response.json().get("causal-context", context)
+
+        start = time.perf_counter()
+        retries = 0
+        for attempt in range(len(ports) * 3):
+            port = ports[(ports.index(get_port) + attempt) % len(ports)]
+            response = session.get("http://localhost:{}/kvs/keys/{}".format(port, key),
+                                   json={"causal-context": context, "wait": wait})
+            if response.status_code != 400:
+                break
+            retries += 1
+        results["latencies"].append(time.perf_counter() - start)
+        results["retries"] += retries
+        if response.status_code == 200:
+            context = response.json()["causal-context"]
+        else:
+            results["failed"] += 1
+
+
+def run(rounds, ports, wait):
+    results = {"latencies": [], "retries": 0, "failed": 0}
+    threads = [threading.Thread(target=client, args=(rounds, ports, wait, seed, results))
+               for seed in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    ports = [int(arg) for arg in sys.argv[2:]] or DEFAULT_PORTS
+    print("{:>6} {:>8} {:>10} {:>9} {:>9} {:>7}".format(
+        "wait", "GETs", "retries", "p50 ms", "p99 ms", "failed"), file=sys.stderr)
+    for wait in (0, WAIT):
+        results = run(rounds, ports, wait)
+        latencies = results["latencies"]
+        print("{:>6} {:>8} {:>10} {:>9.2f} {:>9.2f} {:>7}".format(
+            wait, len(latencies), results["retries"], percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, results["failed"]))
+
+
+main()